@@ -0,0 +1,26 @@
+"""posts_keyset_indexes
+
+Revision ID: 3f1c2a9d7b10
+Revises: 60670342eb7c
+Create Date: 2026-10-18 10:12:41.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = '60670342eb7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_published_created_at_id', 'posts', ['created_at', 'id'], unique=False,
+                    postgresql_where=sa.text('published'))
+    op.create_index('ix_posts_owner_id_created_at_id', 'posts', ['owner_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_posts_owner_id_created_at_id', table_name='posts')
+    op.drop_index('ix_posts_published_created_at_id', table_name='posts')
@@ -0,0 +1,27 @@
+"""posts_likes_count
+
+Revision ID: 8b2d4e6f1a37
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 11:03:17.590224
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e6f1a37'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False))
+    # backfill counter from existing ratings
+    op.execute("UPDATE posts SET likes_count = counted.likes "
+               "FROM (SELECT post_id, COUNT(*) AS likes FROM ratings GROUP BY post_id) AS counted "
+               "WHERE posts.id = counted.post_id")
+
+
+def downgrade():
+    op.drop_column('posts', 'likes_count')
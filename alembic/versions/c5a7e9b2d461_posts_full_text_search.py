@@ -0,0 +1,30 @@
+"""posts_full_text_search
+
+Revision ID: c5a7e9b2d461
+Revises: 8b2d4e6f1a37
+Create Date: 2026-10-18 12:26:55.871302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c5a7e9b2d461'
+down_revision = '8b2d4e6f1a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                     sa.Computed("setweight(to_tsvector('english', title), 'A') || "
+                                                 "setweight(to_tsvector('english', content), 'B')",
+                                                 persisted=True),
+                                     nullable=True))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_posts_search_vector', table_name='posts')
+    op.drop_column('posts', 'search_vector')
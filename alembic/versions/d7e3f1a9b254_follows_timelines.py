@@ -0,0 +1,44 @@
+"""follows_timelines
+
+Revision ID: d7e3f1a9b254
+Revises: c5a7e9b2d461
+Create Date: 2026-10-18 20:41:08.137520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3f1a9b254'
+down_revision = 'c5a7e9b2d461'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('follows',
+                    sa.Column('follower_id', sa.Integer(), nullable=False),
+                    sa.Column('followee_id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'),
+                              nullable=False),
+                    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['followee_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('follower_id', 'followee_id'))
+    op.create_index('ix_follows_followee_id_follower_id', 'follows', ['followee_id', 'follower_id'], unique=False)
+    op.create_table('timelines',
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.Column('post_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('user_id', 'created_at', 'post_id'))
+    op.create_index('ix_timelines_post_id', 'timelines', ['post_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timelines_post_id', table_name='timelines')
+    op.drop_table('timelines')
+    op.drop_index('ix_follows_followee_id_follower_id', table_name='follows')
+    op.drop_table('follows')
+    op.drop_column('users', 'followers_count')
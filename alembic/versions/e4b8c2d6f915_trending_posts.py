@@ -0,0 +1,38 @@
+"""trending_posts
+
+Revision ID: e4b8c2d6f915
+Revises: d7e3f1a9b254
+Create Date: 2026-10-18 21:17:43.402886
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8c2d6f915'
+down_revision = 'd7e3f1a9b254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # time of existing ratings is unknown, they get epoch to stay out of trending window
+    op.add_column('ratings', sa.Column('created_at', sa.TIMESTAMP(timezone=True),
+                                       server_default=sa.text("'epoch'"), nullable=False))
+    op.alter_column('ratings', 'created_at', server_default=sa.text('NOW()'))
+    op.create_index('ix_ratings_created_at', 'ratings', ['created_at'], unique=False)
+    op.create_table('trending_posts',
+                    sa.Column('post_id', sa.Integer(), nullable=False),
+                    sa.Column('score', sa.Float(), nullable=False),
+                    sa.Column('refreshed_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'),
+                              nullable=False),
+                    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('post_id'))
+    op.create_index('ix_trending_posts_score_post_id', 'trending_posts', ['score', 'post_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trending_posts_score_post_id', table_name='trending_posts')
+    op.drop_table('trending_posts')
+    op.drop_index('ix_ratings_created_at', table_name='ratings')
+    op.drop_column('ratings', 'created_at')
@@ -0,0 +1,32 @@
+"""posts_fanned_out
+
+Revision ID: f2a6c8d4e137
+Revises: e4b8c2d6f915
+Create Date: 2026-10-18 23:05:12.518334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+# revision identifiers, used by Alembic.
+revision = 'f2a6c8d4e137'
+down_revision = 'e4b8c2d6f915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('fanned_out', sa.Boolean(), server_default='TRUE', nullable=False))
+    # posts of current celebrities were not fanned out
+    op.execute(sa.text("UPDATE posts SET fanned_out = FALSE "
+                       "WHERE owner_id IN (SELECT id FROM users WHERE followers_count > :limit)")
+               .bindparams(limit=settings.feed_fanout_limit))
+    op.create_index('ix_posts_pulled_owner_id_created_at_id', 'posts', ['owner_id', 'created_at', 'id'],
+                    unique=False, postgresql_where=sa.text('published AND NOT fanned_out'))
+
+
+def downgrade():
+    op.drop_index('ix_posts_pulled_owner_id_created_at_id', table_name='posts')
+    op.drop_column('posts', 'fanned_out')
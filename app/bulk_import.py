@@ -0,0 +1,298 @@
+"""Bulk import of users, posts and ratings with PostgreSQL COPY
+
+Usage: python -m app.bulk_import [--users users.ndjson] [--posts posts.ndjson]
+                                 [--ratings ratings.csv] [--batch-size 10000] [--hash-passwords]
+
+Files are NDJSON (one object per line) or CSV with header, chosen by extension.
+Fields:
+    users:   id, email, password (bcrypt hash), created_at
+    posts:   id, owner_id, title, content, published, created_at
+             (lines of GET /posts/export are accepted as well)
+    ratings: user_id, post_id
+
+Ids of the files are only used to link rows with each other, imported rows get new ids.
+Users are matched by email, so already existing users are reused. Rows referencing
+unknown users or posts are skipped. Every batch is committed separately.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from . import utils
+from .config import settings
+from .database import engine
+
+USER_FIELDS = ("id", "email", "password", "created_at")
+POST_FIELDS = ("id", "owner_id", "title", "content", "published", "created_at")
+RATING_FIELDS = ("user_id", "post_id")
+
+# staging tables of the connection, id maps link batches together
+CREATE_STAGING = """
+CREATE TEMP TABLE import_users (src_id bigint, email text, password text, created_at timestamptz);
+CREATE TEMP TABLE import_user_ids (src_id bigint PRIMARY KEY, id integer NOT NULL);
+CREATE TEMP TABLE import_posts (src_id bigint, src_owner_id bigint, title text, content text,
+                                published boolean, created_at timestamptz, id integer);
+CREATE TEMP TABLE import_post_ids (src_id bigint PRIMARY KEY, id integer NOT NULL);
+CREATE TEMP TABLE import_ratings (src_user_id bigint, src_post_id bigint);
+"""
+# pooled connection may be reused, so staging tables are dropped after import
+DROP_STAGING = "DROP TABLE IF EXISTS import_users, import_user_ids, import_posts, import_post_ids, import_ratings"
+
+# existing users with the same email are reused
+INSERT_USERS = """
+WITH inserted AS (
+    INSERT INTO users (email, password, created_at)
+    SELECT email, password, COALESCE(created_at, now()) FROM import_users
+    ON CONFLICT (email) DO NOTHING
+    RETURNING id
+)
+SELECT count(*) FROM inserted
+"""
+MAP_USERS = """
+INSERT INTO import_user_ids
+SELECT i.src_id, u.id FROM import_users i JOIN users u ON u.email = i.email
+WHERE i.src_id IS NOT NULL
+ON CONFLICT (src_id) DO NOTHING
+"""
+
+# new ids are taken from posts sequence, so map can be saved in the same statement
+NUMBER_POSTS = "UPDATE import_posts SET id = nextval(pg_get_serial_sequence('posts', 'id'))"
+INSERT_POSTS = """
+WITH inserted AS (
+    INSERT INTO posts (id, title, content, published, owner_id, created_at)
+    SELECT p.id, p.title, p.content, COALESCE(p.published, true), u.id, COALESCE(p.created_at, now())
+    FROM import_posts p JOIN import_user_ids u ON u.src_id = p.src_owner_id
+    RETURNING id
+)
+INSERT INTO import_post_ids
+SELECT p.src_id, p.id FROM import_posts p JOIN inserted USING (id) WHERE p.src_id IS NOT NULL
+"""
+
+# denormalized likes counters are updated together with ratings
+INSERT_RATINGS = """
+WITH inserted AS (
+    INSERT INTO ratings (user_id, post_id)
+    SELECT u.id, p.id FROM import_ratings r
+    JOIN import_user_ids u ON u.src_id = r.src_user_id
+    JOIN import_post_ids p ON p.src_id = r.src_post_id
+    ON CONFLICT DO NOTHING
+    RETURNING post_id
+), liked AS (
+    UPDATE posts SET likes_count = posts.likes_count + counted.likes
+    FROM (SELECT post_id, count(*) AS likes FROM inserted GROUP BY post_id) counted
+    WHERE posts.id = counted.post_id
+    RETURNING counted.likes
+)
+SELECT COALESCE(sum(likes), 0) FROM liked
+"""
+
+
+def read_rows(path: str) -> Iterator[dict]:
+    """Read rows of NDJSON or CSV file
+
+    :param path: file path, .csv is read as CSV, anything else as NDJSON
+    :return: rows as dictionaries
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith(".csv"):
+            # empty CSV field is a missing value
+            for row in csv.DictReader(file):
+                yield {field: value if value != "" else None for field, value in row.items()}
+            return
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def flatten_exported_post(row: dict) -> dict:
+    """Convert line of posts export into plain post row
+
+    :param row: post row, plain or {"Post": {..., "owner": {...}}, "likes": ...}
+    :return: post row with owner_id
+    """
+    if "Post" not in row:
+        return row
+    return {**row["Post"], "owner_id": row["Post"]["owner"]["id"]}
+
+
+def batches(rows: Iterable, size: int) -> Iterator[list]:
+    """Split rows into lists of given size"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_value(value: Any) -> str:
+    """Format value for COPY text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(cursor: Any, table: str, columns: tuple, rows: list[dict], fields: tuple) -> None:
+    """Truncate staging table and fill it with COPY FROM STDIN
+
+    :param cursor: psycopg2 cursor
+    :param table: staging table
+    :param columns: staging table columns
+    :param rows: rows to copy
+    :param fields: row fields in the order of columns
+    """
+    data = io.StringIO()
+    for row in rows:
+        data.write("\t".join(copy_value(row.get(field)) for field in fields) + "\n")
+    data.seek(0)
+    cursor.execute(f"TRUNCATE {table}")
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", data)
+
+
+def import_users(connection: Any, rows: Iterable[dict], batch_size: int, hash_passwords: bool = False,
+                 progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+    """Import users in batches
+
+    :param connection: psycopg2 connection with staging tables
+    :param rows: user rows
+    :param batch_size: amount of rows copied at once
+    :param hash_passwords: passwords are plain text and have to be hashed
+    :param progress: callback with table name, rows read and rows imported
+    :return: amount of imported users
+    """
+    read = imported = 0
+    executor = ProcessPoolExecutor(max_workers=settings.password_workers or None) if hash_passwords else None
+    try:
+        for batch in batches(rows, batch_size):
+            if executor is not None:
+                hashed = executor.map(utils.hash_password, [row["password"] for row in batch], chunksize=64)
+                batch = [{**row, "password": password} for row, password in zip(batch, hashed)]
+            with connection.cursor() as cursor:
+                copy_rows(cursor, "import_users", ("src_id", "email", "password", "created_at"), batch, USER_FIELDS)
+                cursor.execute(INSERT_USERS)
+                imported += cursor.fetchone()[0]
+                cursor.execute(MAP_USERS)
+            connection.commit()
+            read += len(batch)
+            if progress is not None:
+                progress("users", read, imported)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return imported
+
+
+def import_posts(connection: Any, rows: Iterable[dict], batch_size: int,
+                 progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+    """Import posts of imported users in batches
+
+    :param connection: psycopg2 connection with staging tables
+    :param rows: post rows
+    :param batch_size: amount of rows copied at once
+    :param progress: callback with table name, rows read and rows imported
+    :return: amount of imported posts
+    """
+    read = imported = 0
+    for batch in batches(map(flatten_exported_post, rows), batch_size):
+        with connection.cursor() as cursor:
+            copy_rows(cursor, "import_posts",
+                      ("src_id", "src_owner_id", "title", "content", "published", "created_at"), batch, POST_FIELDS)
+            cursor.execute(NUMBER_POSTS)
+            cursor.execute(INSERT_POSTS)
+            imported += cursor.rowcount
+        connection.commit()
+        read += len(batch)
+        if progress is not None:
+            progress("posts", read, imported)
+    return imported
+
+
+def import_ratings(connection: Any, rows: Iterable[dict], batch_size: int,
+                   progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+    """Import ratings of imported users and posts in batches, likes counters are updated
+
+    :param connection: psycopg2 connection with staging tables
+    :param rows: rating rows
+    :param batch_size: amount of rows copied at once
+    :param progress: callback with table name, rows read and rows imported
+    :return: amount of imported ratings
+    """
+    read = imported = 0
+    for batch in batches(rows, batch_size):
+        with connection.cursor() as cursor:
+            copy_rows(cursor, "import_ratings", ("src_user_id", "src_post_id"), batch, RATING_FIELDS)
+            cursor.execute(INSERT_RATINGS)
+            imported += cursor.fetchone()[0]
+        connection.commit()
+        read += len(batch)
+        if progress is not None:
+            progress("ratings", read, imported)
+    return imported
+
+
+def run_import(connection: Any, users: Optional[str] = None, posts: Optional[str] = None,
+               ratings: Optional[str] = None, batch_size: int = 10000, hash_passwords: bool = False,
+               progress: Optional[Callable[[str, int, int], None]] = None) -> dict:
+    """Import files into the database
+
+    :param connection: psycopg2 connection
+    :param users: users file path
+    :param posts: posts file path
+    :param ratings: ratings file path
+    :param batch_size: amount of rows copied at once
+    :param hash_passwords: users passwords are plain text and have to be hashed
+    :param progress: callback with table name, rows read and rows imported
+    :return: amount of imported rows by table
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_STAGING)
+    connection.commit()
+    result = {"users": 0, "posts": 0, "ratings": 0}
+    try:
+        if users is not None:
+            result["users"] = import_users(connection, read_rows(users), batch_size, hash_passwords, progress)
+        if posts is not None:
+            result["posts"] = import_posts(connection, read_rows(posts), batch_size, progress)
+        if ratings is not None:
+            result["ratings"] = import_ratings(connection, read_rows(ratings), batch_size, progress)
+    finally:
+        connection.rollback()   # failed batch
+        with connection.cursor() as cursor:
+            cursor.execute(DROP_STAGING)
+        connection.commit()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", help="users file")
+    parser.add_argument("--posts", help="posts file, owners have to be imported in the same run")
+    parser.add_argument("--ratings", help="ratings file, users and posts have to be imported in the same run")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows copied at once")
+    parser.add_argument("--hash-passwords", action="store_true", help="users passwords are plain text")
+    args = parser.parse_args()
+    started = time.perf_counter()
+
+    def report(table: str, read: int, imported: int) -> None:
+        print(f"{table}: {read} read, {imported} imported ({time.perf_counter() - started:.1f} s)", file=sys.stderr)
+
+    connection = engine.raw_connection()
+    try:
+        result = run_import(connection, args.users, args.posts, args.ratings, args.batch_size,
+                            args.hash_passwords, report)
+    finally:
+        connection.close()
+    print(", ".join(f"{table}: {count}" for table, count in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""In-process caches and shared response cache"""
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional
+
+import orjson
+
+from .config import settings
+
+# response cache keys
+POST_KEY = "post:{}"
+LATEST_POST_KEY = "posts:latest"
+FIRST_PAGE_KEY = "posts:first"
+
+
+class TTLCache:
+    """Bounded mapping with least recently used eviction
+    and expiration of every entry after its time to live
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: max amount of entries, 0 disables caching
+        :param ttl: default time to live of entry in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()     # key -> (expire time, value)
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get cached value
+
+        :param key: entry key
+        :param default: value returned on miss
+        :return: cached value or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]     # expired
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Cache value, evicting least recently used entry if full
+
+        :param key: entry key
+        :param value: value to cache
+        :param ttl: time to live of the entry, default one if not given
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove entry if cached
+
+        :param key: entry key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries and reset counters"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Cache usage counters
+
+        :return: amount of entries, hits and misses
+        """
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheBackend:
+    """Storage interface of response cache"""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get cached value or None"""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        """Cache value for ttl seconds"""
+        raise NotImplementedError
+
+    async def delete(self, *keys: str) -> None:
+        """Remove values"""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Cache in the worker memory,
+    writes of other workers are seen only after ttl
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.cache.pop(key)
+
+
+class RedisCacheBackend(CacheBackend):
+    """Cache shared by all workers in Redis compatible store"""
+
+    def __init__(self, client: Any):
+        """
+        :param client: asynchronous client with get, set(ex=) and delete methods
+        """
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisCacheBackend":
+        """Connect to store by url, requires redis package"""
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("redis package is required for redis response cache")
+        return cls(redis.from_url(url))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        await self.client.set(key, value, ex=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        await self.client.delete(*keys)
+
+
+def create_response_cache() -> Optional[CacheBackend]:
+    """Create response cache backend declared in settings"""
+    if settings.response_cache_backend == "memory":
+        return MemoryCacheBackend(maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
+    if settings.response_cache_backend == "redis":
+        return RedisCacheBackend.from_url(settings.response_cache_url)
+    return None
+
+
+response_cache: Optional[CacheBackend] = create_response_cache()
+
+
+async def cache_get(key: str) -> Any:
+    """Get cached response
+
+    :param key: response key
+    :return: decoded response or None on miss
+    """
+    if response_cache is None:
+        return None
+    value = await response_cache.get(key)
+    return None if value is None else orjson.loads(value)
+
+
+async def cache_set(key: str, value: Any) -> None:
+    """Cache response
+
+    :param key: response key
+    :param value: JSON serializable response
+    """
+    if response_cache is not None:
+        await response_cache.set(key, orjson.dumps(value), settings.response_cache_ttl)
+
+
+async def invalidate_posts(*post_ids: int) -> None:
+    """Remove cached responses with changed posts,
+    latest post and first page may include any of them
+
+    :param post_ids: ids of changed posts
+    """
+    if response_cache is not None:
+        await response_cache.delete(LATEST_POST_KEY, FIRST_PAGE_KEY, *(POST_KEY.format(id_) for id_ in post_ids))
@@ -1,30 +1,627 @@
 """Connection to database"""
-from sqlalchemy import create_engine
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from threading import Event, Lock, Thread
+from typing import Any, AsyncIterator, Callable, Optional
+
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
+from . import metrics
+from .cache import TTLCache
 from .config import settings
+from .profiling import run_in_threadpool
+
+
+def normalize_url(uri: str) -> str:
+    """Database url with scheme known to SQLAlchemy (heroku uses postgres://)"""
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+    return uri
+
+
+def async_url(uri: str) -> str:
+    """Same database through asyncpg driver"""
+    return uri.replace("postgresql://", "postgresql+asyncpg://", 1)
+
 
 # data base url
 # for deployment server
 if settings.database_url is not None:
-    uri = settings.database_url
-    if uri.startswith("postgres://"):
-        uri = uri.replace("postgres://", "postgresql://", 1)
-    SQLALCHEMY_DB_URL = uri
+    SQLALCHEMY_DB_URL = normalize_url(settings.database_url)
 else:       # for development
     SQLALCHEMY_DB_URL = f"{settings.database}://{settings.db_user}:{settings.db_password}" \
                         f"@{settings.host}:{settings.port}/{settings.db_name}"
+SQLALCHEMY_ASYNC_DB_URL = async_url(SQLALCHEMY_DB_URL)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Database usage of single request"""
+
+    def __init__(self, route: Optional[str] = None):
+        """
+        :param route: method and route template of the request
+        """
+        self.route = route
+        self.statements = 0
+        self.duration = 0.0
+
+
+# statistics of the request being handled, set by middleware
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+class SlowQueryLog:
+    """Statements slower than threshold in rotating JSON lines file,
+    plans of sampled SELECT statements are captured on background thread
+    """
+    # explains waiting for background thread, more slow queries are logged without plan
+    max_pending = 4
+
+    def __init__(self):
+        self.file_logger: Optional[logging.Logger] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        self.lock = Lock()
+
+    def record(self, conn: Any, statement: str, parameters: Any, duration: float, route: Optional[str]) -> None:
+        """Log slow statement, with query plan if sampled
+
+        :param conn: connection statement was executed with
+        :param statement: executed statement
+        :param parameters: statement parameters
+        :param duration: execution time in seconds
+        :param route: request route, None outside of requests
+        """
+        logger.warning("slow query took %.0f ms (%s): %s", duration * 1000, route, statement)
+        entry = {"time": datetime.now(timezone.utc).isoformat(), "duration_ms": round(duration * 1000, 3),
+                 "route": route, "statement": statement, "parameters": repr(parameters)[:1000]}
+        if statement.lstrip()[:6].upper() == "SELECT" and random.random() < settings.slow_query_explain_rate:
+            with self.lock:
+                sampled = self.pending < self.max_pending
+                if sampled:
+                    self.pending += 1
+                    if self.executor is None:
+                        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+            if sampled:
+                # plans of asyncpg statements are captured with psycopg2 engine
+                explain_engine = conn.engine if conn.dialect.driver == "psycopg2" else engine
+                self.executor.submit(self.explain_and_write, explain_engine, entry, statement, parameters)
+                return
+        self.write(entry)
+
+    def explain_and_write(self, explain_engine: Engine, entry: dict, statement: str, parameters: Any) -> None:
+        """Capture plan of the statement and log it"""
+        try:
+            entry["explain"] = self.explain(explain_engine, statement, parameters)
+        except Exception as error:
+            entry["explain_error"] = str(error)
+        finally:
+            with self.lock:
+                self.pending -= 1
+        self.write(entry)
+
+    @staticmethod
+    def explain(explain_engine: Engine, statement: str, parameters: Any) -> str:
+        """Run EXPLAIN (ANALYZE, BUFFERS) of SELECT statement in rolled back transaction
+
+        :param explain_engine: engine with psycopg2 driver
+        :param statement: statement with psycopg2 parameters, asyncpg dialect uses the same format
+        :param parameters: statement parameters
+        :return: query plan
+        """
+        connection = explain_engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                # analyzed statement runs again, don't let it get stuck
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(settings.slow_query_explain_timeout * 1000),))
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                return "\n".join(row[0] for row in cursor.fetchall())
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def write(self, entry: dict) -> None:
+        """Append entry to the log file"""
+        with self.lock:
+            if self.file_logger is None:
+                handler = RotatingFileHandler(settings.slow_query_log_file, maxBytes=settings.slow_query_log_size,
+                                              backupCount=settings.slow_query_log_backups)
+                self.file_logger = logging.getLogger("app.slow_queries")
+                self.file_logger.propagate = False
+                self.file_logger.setLevel(logging.INFO)
+                self.file_logger.addHandler(handler)
+        self.file_logger.info(json.dumps(entry, default=str))
+
+    def read(self, limit: int) -> list[dict]:
+        """Latest entries of the current log file, newest first
+
+        :param limit: max amount of entries
+        """
+        self.drain()
+        if not os.path.isfile(settings.slow_query_log_file):
+            return []
+        with open(settings.slow_query_log_file) as file:
+            lines = deque(file, maxlen=limit)
+        return [json.loads(line) for line in reversed(lines)]
+
+    def drain(self) -> None:
+        """Wait for captured plans to be written"""
+        if self.executor is not None:
+            self.executor.submit(lambda: None).result()
+
+    def close(self) -> None:
+        """Stop background thread and close the log file"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.file_logger is not None:
+            for handler in list(self.file_logger.handlers):
+                self.file_logger.removeHandler(handler)
+                handler.close()
+            self.file_logger = None
+
+
+slow_query_log = SlowQueryLog()
+
 
-engine = create_engine(SQLALCHEMY_DB_URL)
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    """Count statements of every engine into current request statistics"""
+    context.statement_started = time.perf_counter()
+    stats = query_stats.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def finish_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    """Add statement execution time to current request statistics and log slow statements"""
+    duration = time.perf_counter() - context.statement_started
+    stats = query_stats.get()
+    if stats is not None:
+        stats.duration += duration
+    if 0 < settings.slow_query_threshold < duration:
+        slow_query_log.record(conn, statement, parameters, duration, stats.route if stats is not None else None)
+
+
+class PoolStats:
+    """Connections pool usage counters"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, waited: float) -> None:
+        """Save time spent waiting for connection checkout
+
+        :param waited: wait time in seconds
+        """
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        metrics.POOL_WAIT.observe(waited)
+        if waited > settings.db_pool_log_wait:
+            logger.warning("database connection checkout waited %.3f s", waited)
+
+    def snapshot(self, pool: QueuePool) -> dict:
+        """Current pool state with collected counters
+
+        :param pool: pool counters belong to
+        :return: pool statistics
+        """
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
+class TimedPoolMixin:
+    """Measure time spent waiting for connection from the pool"""
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeouts += 1
+            metrics.POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        # keep counters when pool is recreated on engine dispose
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    """Queue pool with checkout wait time statistics"""
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    """Asyncio queue pool with checkout wait time statistics"""
+
+
+def track_pool(sync_engine: Engine) -> Engine:
+    """Collect pool statistics of the engine with pool events
+
+    :param sync_engine: engine to track
+    :return: same engine
+    """
+    stats = sync_engine.pool.stats = PoolStats()
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(*args):
+        stats.checkouts += 1
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(*args):
+        stats.connects += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(*args):
+        stats.invalidations += 1
+
+    return sync_engine
+
+
+def pool_options(poolclass: type) -> dict:
+    """Engine pool arguments from settings"""
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+engine = track_pool(create_engine(SQLALCHEMY_DB_URL, **pool_options(TimedQueuePool)))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# asynchronous engine, used by request handlers if enabled in settings
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DB_URL, **pool_options(TimedAsyncAdaptedQueuePool)) \
+    if settings.db_async else None
+if async_engine is not None:
+    track_pool(async_engine.sync_engine)
+AsyncSessionLocal: Optional[sessionmaker] = sessionmaker(async_engine, class_=AsyncSession, autoflush=False,
+                                                         expire_on_commit=False) if settings.db_async else None
 
-def get_db():
-    """Virtual database instance"""
-    db = SessionLocal()
+
+class ThreadedResult:
+    """Streamed result of ThreadedSession, rows are fetched in the threadpool"""
+
+    def __init__(self, result: Any):
+        self.result = result
+
+    async def partitions(self, size: Optional[int] = None) -> AsyncIterator[list]:
+        """Iterate over lists of rows fetched from server-side cursor
+
+        :param size: amount of rows in partition
+        """
+        partitions = self.result.partitions(size)
+        while True:
+            partition = await run_in_threadpool(next, partitions, None)
+            if partition is None:
+                return
+            yield partition
+
+    async def close(self) -> None:
+        """Close server-side cursor"""
+        await run_in_threadpool(self.result.close)
+
+
+class ThreadedSession:
+    """Synchronous session behind the AsyncSession interface
+
+    Every blocking call is sent to the threadpool,
+    so async handlers can work with psycopg2 driver too
+    """
+
+    def __init__(self, sync_session: Session):
+        self.sync_session = sync_session
+
+    @property
+    def info(self) -> dict:
+        """User data of the session"""
+        return self.sync_session.info
+
+    def add(self, instance: Any) -> None:
+        """Place object into the session"""
+        self.sync_session.add(instance)
+
+    def add_all(self, instances: list) -> None:
+        """Place objects into the session"""
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement: Any, params: Optional[dict] = None, **kwargs: Any) -> Any:
+        """Execute statement and return buffered result"""
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def stream(self, statement: Any, params: Optional[dict] = None, **kwargs: Any) -> ThreadedResult:
+        """Execute statement with server-side cursor and return streamed result"""
+        kwargs["execution_options"] = {**kwargs.get("execution_options", {}), "stream_results": True}
+        return ThreadedResult(await self.execute(statement, params, **kwargs))
+
+    async def scalar(self, statement: Any, params: Optional[dict] = None, **kwargs: Any) -> Any:
+        """Execute statement and return first column of the first row"""
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def get(self, entity: Any, ident: Any) -> Any:
+        """Get object by primary key"""
+        return await run_in_threadpool(self.sync_session.get, entity, ident)
+
+    async def flush(self) -> None:
+        """Flush pending changes"""
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self) -> None:
+        """Commit current transaction"""
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        """Rollback current transaction"""
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance: Any, attribute_names: Optional[list] = None) -> None:
+        """Reload object attributes from the database"""
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance: Any) -> None:
+        """Mark object as deleted"""
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def run_sync(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run function that takes synchronous session"""
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self) -> None:
+        """Release connection"""
+        await run_in_threadpool(self.sync_session.close)
+
+
+async def open_session(session_factory: sessionmaker, async_session_factory: Optional[sessionmaker]):
+    """Session of the database, asynchronous if enabled in settings
+
+    :param session_factory: synchronous sessions of the database
+    :param async_session_factory: asynchronous sessions, None if disabled
+    """
+    if async_session_factory is not None:
+        async with async_session_factory() as db:
+            yield db
+        return
+    db = ThreadedSession(session_factory())
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_db():
+    """Virtual database instance"""
+    async for db in open_session(SessionLocal, AsyncSessionLocal):
+        yield db
+
+
+class Replica:
+    """Read-only copy of the database with own connections pool"""
+
+    def __init__(self, url: str):
+        """
+        :param url: replica database url
+        """
+        url = normalize_url(url)
+        self.name = make_url(url).render_as_string(hide_password=True)
+        # synchronous engine is used for health checks in async mode too
+        self.engine = track_pool(create_engine(url, **pool_options(TimedQueuePool)))
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_engine = create_async_engine(async_url(url), **pool_options(TimedAsyncAdaptedQueuePool)) \
+            if settings.db_async else None
+        self.async_session_factory = None
+        if self.async_engine is not None:
+            track_pool(self.async_engine.sync_engine)
+            self.async_session_factory = sessionmaker(self.async_engine, class_=AsyncSession, autoflush=False,
+                                                      expire_on_commit=False)
+        for sync_engine in self.sync_engines():
+            event.listen(sync_engine, "handle_error", self.on_error)
+        self.healthy = True
+        self.last_error: Optional[str] = None
+
+    def sync_engines(self) -> list[Engine]:
+        """Engines whose pools serve the replica"""
+        return [self.engine] + ([self.async_engine.sync_engine] if self.async_engine is not None else [])
+
+    def mark_down(self, error: str) -> None:
+        """Take replica out of rotation until health check passes"""
+        if self.healthy:
+            logger.warning("database replica %s is out of rotation: %s", self.name, error)
+        self.healthy = False
+        self.last_error = error
+
+    def on_error(self, context: Any) -> None:
+        """Take replica out of rotation on lost connection, failed request is not retried"""
+        if context.is_disconnect:
+            self.mark_down(str(context.original_exception))
+
+    def check(self) -> bool:
+        """Check connection and replication lag, update replica state
+
+        :return: True if replica is healthy
+        """
+        try:
+            with self.engine.connect() as connection:
+                # NULL on primary, lag is not growing while replica has replayed everything received
+                lag = connection.scalar(text(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"))
+        except Exception as error:     # noqa, any failure means replica can't serve reads
+            self.mark_down(str(error))
+            return False
+        if lag is not None and lag > settings.db_replica_max_lag:
+            self.mark_down(f"replication lag {lag:.1f} s")
+            return False
+        if not self.healthy:
+            logger.warning("database replica %s is back in rotation", self.name)
+        self.healthy = True
+        self.last_error = None
+        return True
+
+    async def dispose(self) -> None:
+        """Close replica connections pools"""
+        self.engine.dispose()
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+
+    def stats(self) -> dict:
+        """Replica state with pool statistics"""
+        pools = {"sync": self.engine.pool.stats.snapshot(self.engine.pool)}
+        if self.async_engine is not None:
+            pool = self.async_engine.sync_engine.pool
+            pools["async"] = pool.stats.snapshot(pool)
+        return {"name": self.name, "healthy": self.healthy, "last_error": self.last_error, "pools": pools}
+
+
+class ReplicaSet:
+    """Replicas chosen round-robin, failed ones are checked
+    on background thread until they are healthy again
+    """
+
+    def __init__(self, urls: list[str]):
+        """
+        :param urls: replica database urls
+        """
+        self.replicas = [Replica(url) for url in urls]
+        self.counter = itertools.count()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        """Next healthy replica, None if there is none"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self.counter) % len(healthy)]
+
+    def check(self) -> None:
+        """Health check of every replica"""
+        for replica in self.replicas:
+            replica.check()
+
+    def run(self) -> None:
+        """Health checks loop of background thread"""
+        while not self.stopped.wait(settings.db_replica_check_interval):
+            self.check()
+
+    def start(self) -> None:
+        """Start periodic health checks"""
+        if self.replicas and self.thread is None:
+            self.check()
+            self.stopped.clear()
+            self.thread = Thread(target=self.run, name="replica-health", daemon=True)
+            self.thread.start()
+
+    async def stop(self) -> None:
+        """Stop health checks and close replicas connections"""
+        self.stopped.set()
+        if self.thread is not None:
+            await run_in_threadpool(self.thread.join)
+            self.thread = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+
+replicas = ReplicaSet(settings.db_replica_urls)
+# clients that have recently written, read from primary to see their own changes
+recent_writers = TTLCache(maxsize=settings.db_replica_pin_size, ttl=settings.db_replica_pin_seconds)
+
+
+def writer_key(authorization: Optional[str], client: Optional[str]) -> bytes:
+    """Client identity for primary pinning, token if authorized or address otherwise
+
+    :param authorization: Authorization header
+    :param client: client host
+    """
+    return hashlib.sha256((authorization or f"client:{client}").encode()).digest()
+
+
+def pin_writer(authorization: Optional[str], client: Optional[str]) -> None:
+    """Keep reads of the client on primary for db_replica_pin_seconds"""
+    recent_writers.set(writer_key(authorization, client), True)
+
+
+async def get_read_db(request: Request, db=Depends(get_db)):
+    """Virtual database instance of read-only handlers, served by replicas
+    if configured, primary for recent writers or if no replica is healthy
+
+    :param request: handled request
+    :param db: primary session, connects only if used
+    """
+    replica = None
+    if replicas:
+        client = request.client.host if request.client is not None else None
+        if recent_writers.get(writer_key(request.headers.get("authorization"), client)) is None:
+            replica = replicas.choose()
+    if replica is None:
+        yield db
+        return
+    async for replica_db in open_session(replica.session_factory, replica.async_session_factory):
+        replica_db.info["replica"] = replica.name
+        yield replica_db
+
+
+def from_replica(db) -> bool:
+    """Check if session reads from replica, lagging rows must not get into shared response cache,
+    or clients reading from primary after their write would get them back
+
+    :param db: session of get_read_db
+    """
+    return "replica" in db.info
+
+
+def get_pool_stats() -> dict:
+    """Statistics of every used connections pool"""
+    stats = {"sync": engine.pool.stats.snapshot(engine.pool)}
+    if async_engine is not None:
+        pool = async_engine.sync_engine.pool
+        stats["async"] = pool.stats.snapshot(pool)
+    if replicas:
+        stats["replicas"] = [replica.stats() for replica in replicas.replicas]
+    return stats
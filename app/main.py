@@ -16,10 +16,16 @@ Application is automized for CI/CD workflow with GitHub actions
 """
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import Base, engine
-from .routers import posts, users, auth, ratings
+from . import utils, metrics, write_behind
+from .trending import trending_refresher
+from .config import settings
+from .middleware import StatementCountMiddleware, MetricsMiddleware, ProfilingMiddleware, ReplicaPinMiddleware, \
+    AdmissionControlMiddleware, RateLimitMiddleware
+from .database import Base, engine, async_engine, replicas, slow_query_log
+from .routers import posts, users, auth, ratings, follows, admin
 
 __author__ = "Aleksandr Verevkin"
 __license__ = "GNU GPL v.3"
@@ -29,8 +35,20 @@ __maintainer__ = "Aleksandr Verevkin"
 # Base.metadata.create_all(bind=engine)     # manual creation of databases
 
 # API instance
-app = FastAPI()
-# CORS setup
+app = FastAPI(default_response_class=ORJSONResponse)
+# on demand profiling has no overhead unless enabled
+if settings.profiling_enabled:
+    app.add_middleware(ProfilingMiddleware)
+# read-your-writes window of read replicas
+if replicas:
+    app.add_middleware(ReplicaPinMiddleware)
+# overload is shed before requests take database connections and password workers
+app.add_middleware(AdmissionControlMiddleware)
+if settings.request_rate_limit > 0:
+    app.add_middleware(RateLimitMiddleware)    # limited requests don't take admission slots
+app.add_middleware(StatementCountMiddleware)
+app.add_middleware(MetricsMiddleware)     # measures whole request
+# CORS setup, outermost so rejected requests keep CORS headers and preflights take no rate limit tokens
 origins = ["*"]     # list of allowed origins (["*"] - all)
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +63,38 @@ app.include_router(posts.router, prefix="/posts", tags=["Posts"])
 app.include_router(users.router, prefix="/users", tags=["Users"])
 app.include_router(auth.router,  tags=["Users"])
 app.include_router(ratings.router, prefix="/rate", tags=["Ratings"])
+app.include_router(follows.router, prefix="/follow", tags=["Follows"])
+app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+
+
+@app.on_event("startup")
+async def start_background_jobs() -> None:
+    """Start health checks of read replicas, trending posts refresh and buffered rates flush"""
+    replicas.start()
+    trending_refresher.start()
+    if settings.rate_write_behind:
+        await write_behind.rating_buffer.start()
+
+
+@app.on_event("shutdown")
+async def close_connections() -> None:
+    """Write buffered rates, stop background jobs, close database connections pools, password workers,
+    slow query log and worker metrics
+    """
+    await write_behind.rating_buffer.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    await replicas.stop()
+    await trending_refresher.stop()
+    utils.shutdown_password_executor()
+    slow_query_log.close()
+    metrics.mark_process_dead()
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    """Metrics in Prometheus text format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
 
 
 @app.get("/", tags=["General"])
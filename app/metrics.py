@@ -0,0 +1,57 @@
+"""Prometheus metrics of requests and database usage
+
+With multiple worker processes PROMETHEUS_MULTIPROC_DIR environment variable
+has to point to an empty directory shared by the workers, so every worker
+writes its metrics there and /metrics aggregates all of them.
+"""
+import os
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time of request handling",
+                             ["method", "route", "status"])
+REQUEST_DB_STATEMENTS = Histogram("http_request_db_statements", "Database statements executed by request",
+                                  ["method", "route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, float("inf")))
+REQUEST_DB_DURATION = Histogram("http_request_db_duration_seconds", "Time of database statements of request",
+                                ["method", "route"])
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time of waiting for connection from the pool",
+                      buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, float("inf")))
+POOL_TIMEOUTS = Counter("db_pool_timeouts", "Connection checkouts failed on pool timeout")
+
+
+def multiprocess_dir() -> Optional[str]:
+    """Directory of multiprocess metrics, None in single process mode"""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+
+def observe_request(method: str, route: str, status: int, duration: float, statements: int,
+                    db_duration: float) -> None:
+    """Record finished request
+
+    :param method: request method
+    :param route: route path template, e.g. /posts/{id_}
+    :param status: response status code
+    :param duration: request handling time in seconds
+    :param statements: amount of executed database statements
+    :param db_duration: time of database statements in seconds
+    """
+    REQUEST_DURATION.labels(method, route, status).observe(duration)
+    REQUEST_DB_STATEMENTS.labels(method, route).observe(statements)
+    REQUEST_DB_DURATION.labels(method, route).observe(db_duration)
+
+
+def render() -> bytes:
+    """Metrics in Prometheus text exposition format, of all workers in multiprocess mode"""
+    if multiprocess_dir() is None:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead() -> None:
+    """Remove live metrics of stopped worker in multiprocess mode"""
+    if multiprocess_dir() is not None:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,353 @@
+"""ASGI middlewares"""
+import asyncio
+import cProfile
+import math
+import secrets
+import time
+import tracemalloc
+from collections import deque
+from typing import Optional
+from urllib.parse import parse_qs
+
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import database, metrics, oauth2, profiling
+from .cache import TTLCache
+from .config import settings
+
+DB_STATEMENTS_HEADER = b"x-db-statements"
+PROFILE_REPORT_HEADER = b"x-profile-report"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+# bcrypt-heavy requests of login and sign up
+AUTH_ROUTES = {("POST", "/login"), ("POST", "/users"), ("POST", "/users/")}
+# operators endpoints are never limited
+UNLIMITED_PREFIXES = ("/admin", "/metrics")
+
+
+class StatementCountMiddleware:
+    """Count database statements of every request and respond
+    with the amount in X-DB-Statements header, if enabled in settings
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.db_statements_header:
+            await self.app(scope, receive, send)
+            return
+        # statistics may be already collected by metrics middleware
+        stats = database.query_stats.get()
+        token = None
+        if stats is None:
+            stats = database.QueryStats(route=f"{scope['method']} {route_template(scope)}")
+            token = database.query_stats.set(stats)
+
+        async def send_with_count(message: Message) -> None:
+            # statements are counted until the response starts
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []),
+                                      (DB_STATEMENTS_HEADER, str(stats.statements).encode())]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            if token is not None:
+                database.query_stats.reset(token)
+
+
+def route_template(scope: Scope) -> str:
+    """Path template of the route handling request, so ids don't make separate metrics
+
+    :param scope: request scope
+    :return: route path like /posts/{id_}, or "unmatched"
+    """
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path     # method is not allowed
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    """Record time, status and database usage of every request
+    by route template, if enabled in settings
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+        route = route_template(scope)
+        stats = database.QueryStats(route=f"{scope['method']} {route}")
+        token = database.query_stats.set(stats)
+        status_code = 500   # if app fails before response
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            database.query_stats.reset(token)
+            metrics.observe_request(scope["method"], route, status_code, duration, stats.statements, stats.duration)
+
+
+def profile_requested(scope: Scope) -> bool:
+    """Check if request asks for profiling with X-Profile header or profile query flag,
+    only administrator (X-Admin-Token header) can profile requests
+    """
+    headers = Headers(scope=scope)
+    if "x-profile" not in headers and "profile" not in parse_qs(scope["query_string"].decode("latin-1")):
+        return False
+    token = headers.get("x-admin-token")
+    return settings.admin_token is not None and token is not None \
+        and secrets.compare_digest(token, settings.admin_token)
+
+
+class ProfilingMiddleware:
+    """Profile requests asked by administrator with cProfile and tracemalloc,
+    report name is returned in X-Profile-Report header (see profiling module)
+
+    Added only if enabled in settings, so it costs nothing otherwise.
+    One request is profiled at a time, others are handled as usual, but their
+    event loop time gets into the profile too, so report tells how many ran meanwhile.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.busy = False
+        self.running = 0    # requests of the worker being handled
+        self.concurrent = 0     # other requests running during profiled one
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.busy or not profile_requested(scope):
+            if self.busy:
+                self.concurrent += 1
+            self.running += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.running -= 1
+            return
+        self.busy = True
+        self.concurrent = self.running
+        name = profiling.report_name(scope["method"], scope["path"])
+
+        async def send_with_report(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (PROFILE_REPORT_HEADER, name.encode())]
+            await send(message)
+        profile = cProfile.Profile()
+        # threadpool calls of the request are profiled too
+        thread_calls: list[cProfile.Profile] = []
+        token = profiling.thread_profiles.set(thread_calls)
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - started
+            profiling.thread_profiles.reset(token)
+            snapshot = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+            self.busy = False
+            await run_in_threadpool(profiling.save_report, name, profile, snapshot, duration, thread_calls,
+                                    self.concurrent)
+
+
+class ReplicaPinMiddleware:
+    """Pin reads of the client to primary database after successful write,
+    so replication lag doesn't hide its own posts and likes (see database.get_read_db)
+
+    Added only if read replicas are configured.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message: Message) -> None:
+            # pinned before client gets the response and sends the next request
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                client = scope.get("client")
+                database.pin_writer(Headers(scope=scope).get("authorization"), client[0] if client else None)
+            await send(message)
+        await self.app(scope, receive, send_with_pin)
+
+
+def request_class(scope: Scope) -> Optional[str]:
+    """Route class of admission control and rate limits
+
+    :param scope: request scope
+    :return: "auth", "read" or "write", None for not limited requests
+    """
+    path = scope["path"]
+    if path.startswith(UNLIMITED_PREFIXES):
+        return None
+    if (scope["method"], path) in AUTH_ROUTES:
+        return "auth"
+    return "read" if scope["method"] in SAFE_METHODS else "write"
+
+
+class ConcurrencyLimit:
+    """Requests of one route class handled at once with queue of waiting ones,
+    used only from the event loop
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.duration = 0.0     # moving average of request time (seconds)
+
+    async def acquire(self, limit: int) -> bool:
+        """Take handling slot, waiting in queue while all of them are taken
+
+        :param limit: max amount of requests handled at once
+        :return: False if queue is full or waiting timed out
+        """
+        if self.active < limit and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= settings.admission_queue_size:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, settings.admission_queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            # client is gone right after slot was handed over
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Hand slot over to the first waiting request or free it"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def observe(self, duration: float) -> None:
+        """Update average request time with finished request"""
+        self.duration = duration if not self.duration else self.duration + (duration - self.duration) * 0.1
+
+    def retry_after(self, limit: int) -> int:
+        """Seconds until queued requests are likely handled
+
+        :param limit: max amount of requests handled at once
+        """
+        return max(1, math.ceil((len(self.waiters) + 1) * self.duration / limit))
+
+
+class AdmissionControlMiddleware:
+    """Cap requests handled at once by route class (reads, writes and auth), so overload
+    is shed early with 503 and Retry-After instead of piling up in database pool
+    and password workers queues, limits are set in settings (admission_*)
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.limits = {route_class: ConcurrencyLimit() for route_class in ("read", "write", "auth")}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        route_class = request_class(scope) if scope["type"] == "http" else None
+        limit = getattr(settings, f"admission_{route_class}_limit") if route_class is not None else 0
+        if limit <= 0:
+            await self.app(scope, receive, send)
+            return
+        concurrency = self.limits[route_class]
+        if not await concurrency.acquire(limit):
+            response = ORJSONResponse({"detail": "server is busy, try again later"},
+                                      status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                      headers={"Retry-After": str(concurrency.retry_after(limit))})
+            await response(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            concurrency.observe(time.perf_counter() - started)
+            concurrency.release()
+
+
+class RateLimitMiddleware:
+    """Limit requests rate of every client with token bucket, excess requests get 429
+    with Retry-After; clients are told apart by user id of valid bearer token or by address
+
+    Added only if enabled in settings, buckets are kept by every worker.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # bucket is full again after its time to live, so expired buckets are just dropped
+        self.buckets = TTLCache(maxsize=settings.request_rate_clients,
+                                ttl=settings.request_rate_burst / settings.request_rate_limit)
+
+    def take(self, client: tuple) -> float:
+        """Take request token of the client
+
+        :param client: client key
+        :return: 0 if token was taken, otherwise seconds until the next one
+        """
+        now = time.monotonic()
+        bucket = self.buckets.get(client)
+        tokens = settings.request_rate_burst if bucket is None \
+            else min(settings.request_rate_burst, bucket[0] + (now - bucket[1]) * settings.request_rate_limit)
+        if tokens < 1:
+            return (1 - tokens) / settings.request_rate_limit
+        self.buckets.set(client, (tokens - 1, now))
+        return 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or request_class(scope) is None:
+            await self.app(scope, receive, send)
+            return
+        user_id = oauth2.token_user_id(Headers(scope=scope).get("authorization"))
+        if user_id is not None:
+            client = ("user", user_id)
+        else:
+            client = ("client", scope["client"][0] if scope.get("client") else None)
+        wait = self.take(client)
+        if wait:
+            response = ORJSONResponse({"detail": "too many requests, try again later"},
+                                      status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                      headers={"Retry-After": str(math.ceil(wait))})
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -1,8 +1,9 @@
 """Database table models"""
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
 from .database import Base
 
@@ -16,11 +17,31 @@ class Post(Base):
     content = Column(String, nullable=False)
     published = Column(Boolean, server_default="TRUE", nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("NOW()"))
+    # denormalized amount of ratings, maintained on every rating change
+    likes_count = Column(Integer, server_default="0", nullable=False)
+    # full-text search document, title is weighted above content
+    search_vector = deferred(Column(TSVECTOR, Computed("setweight(to_tsvector('english', title), 'A') || "
+                                                       "setweight(to_tsvector('english', content), 'B')",
+                                                       persisted=True)))
     # reference to user
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # published into followers timelines, false for posts of celebrities pulled by feeds at read time
+    fanned_out = Column(Boolean, server_default="TRUE", nullable=False)
 
     owner = relationship("User")
 
+    __table_args__ = (
+        # keyset pagination over published feed, newest first
+        Index("ix_posts_published_created_at_id", "created_at", "id", postgresql_where=text("published")),
+        # keyset pagination over user own posts
+        Index("ix_posts_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        # full-text search over title and content
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+        # feed pull of posts that are not in timelines
+        Index("ix_posts_pulled_owner_id_created_at_id", "owner_id", "created_at", "id",
+              postgresql_where=text("published AND NOT fanned_out")),
+    )
+
 
 class User(Base):
     """Table with users"""
@@ -30,6 +51,8 @@ class User(Base):
     email = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("NOW()"))
+    # denormalized amount of followers, maintained on every follow change
+    followers_count = Column(Integer, server_default="0", nullable=False)
 
 
 class Rating(Base):
@@ -38,3 +61,53 @@ class Rating(Base):
 
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("NOW()"))
+
+    __table_args__ = (
+        # recent ratings for trending posts ranking
+        Index("ix_ratings_created_at", "created_at"),
+    )
+
+
+class Follow(Base):
+    """Table with users following other users"""
+    __tablename__ = "follows"
+
+    follower_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    followee_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("NOW()"))
+
+    __table_args__ = (
+        # followers of author for timeline fan-out
+        Index("ix_follows_followee_id_follower_id", "followee_id", "follower_id"),
+    )
+
+
+class TimelineEntry(Base):
+    """Table with home timelines, posts of followed users fanned out on write"""
+    __tablename__ = "timelines"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # copy of post creation time, so feed is a range scan of the primary key
+    created_at = Column(TIMESTAMP(timezone=True), primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        # removal of deleted posts from timelines
+        Index("ix_timelines_post_id", "post_id"),
+    )
+
+
+class TrendingPost(Base):
+    """Table with precomputed ranking of trending posts, replaced on every refresh"""
+    __tablename__ = "trending_posts"
+
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    # recent likes decayed by their age
+    score = Column(Float, nullable=False)
+    refreshed_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("NOW()"))
+
+    __table_args__ = (
+        # keyset pagination over ranking, best first
+        Index("ix_trending_posts_score_post_id", "score", "post_id"),
+    )
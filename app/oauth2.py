@@ -1,12 +1,17 @@
 """JWT (JSON web token) generation and validations"""
+import hashlib
+import secrets
+import time
 from datetime import datetime, timedelta
+from typing import Optional
 
-from fastapi import Depends, status, HTTPException
+from fastapi import Depends, Header, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import schemas, database, models
+from .cache import TTLCache
 from .config import settings
 
 SECRET_KEY = settings.jwt_encode_key
@@ -16,6 +21,11 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # declare oauth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# decoded tokens by token digest, entry lives until token expiration
+token_cache = TTLCache(maxsize=settings.token_cache_size, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# recently verified users by their id
+user_cache = TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
 
 def create_access_token(data: dict) -> str:
     """Encode JWT with provided data
@@ -39,6 +49,11 @@ def verify_access_token(token: str, credential_exception: Exception) -> schemas.
     :param credential_exception: invalid credentials exception
     :return: token scheme
     """
+    # token was already verified
+    token_digest = hashlib.sha256(token.encode()).digest()
+    token_data = token_cache.get(token_digest)
+    if token_data is not None:
+        return token_data
     # decode jwt and extract payload
     try:
         payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
@@ -47,21 +62,78 @@ def verify_access_token(token: str, credential_exception: Exception) -> schemas.
     user_id = payload.get("user_id")
     if user_id is None:
         raise credential_exception
-    return schemas.TokenData(user_id=user_id)
+    token_data = schemas.TokenData(user_id=user_id, email=payload.get("email"))
+    # tokens without expiration are not cached
+    if isinstance(payload.get("exp"), (int, float)):
+        token_cache.set(token_digest, token_data, ttl=payload["exp"] - time.time())
+    return token_data
+
+
+def token_user_id(authorization: Optional[str]) -> Optional[int]:
+    """User id of valid bearer token, without user lookup
 
+    :param authorization: Authorization header
+    :return: user id, None if token is missing or invalid
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return int(verify_access_token(token, ValueError()).user_id)
+    except ValueError:
+        return None
+
+
+def invalidate_user(user_id: int) -> None:
+    """Drop user from verified users cache,
+    must be called after user is changed or removed
+
+    :param user_id: user id
+    """
+    user_cache.pop(user_id)
 
-def verify_current_user(token: str = Depends(oauth2_scheme),
-                        db: Session = Depends(database.get_db)) -> models.User:
+
+def clear_user_cache() -> None:
+    """Drop all verified users"""
+    user_cache.clear()
+
+
+async def verify_current_user(token: str = Depends(oauth2_scheme),
+                              db: AsyncSession = Depends(database.get_db)) -> schemas.CurrentUser:
     """Verify user rights
     by validation of provided JWT
 
     :param db: dependency database
     :param token: provided JWT
-    :return: token scheme
+    :return: verified user
     """
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                           detail="Couldn't verify credentials",
                                           headers={"WWW-Authenticate": "Bearer"})
     token_data = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter_by(id=token_data.user_id).first()
+    user_id = int(token_data.user_id)
+    # signed claims are enough, no need to look for user
+    if settings.auth_trust_token_claims:
+        return schemas.CurrentUser(id=user_id, email=token_data.email)
+    user = user_cache.get(user_id)
+    if user is None:
+        found_user = await db.get(models.User, user_id)
+        # token of removed user
+        if found_user is None:
+            raise credentials_exception
+        user = schemas.CurrentUser.from_orm(found_user)
+        user_cache.set(user_id, user)
     return user
+
+
+def verify_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Verify access to administration endpoints
+    by comparing X-Admin-Token header with configured admin token
+
+    :param x_admin_token: provided admin token
+    """
+    # administration is disabled without configured token
+    if settings.admin_token is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="unauthorized action")
@@ -0,0 +1,41 @@
+"""Keyset (cursor) pagination helpers
+
+Cursor is an opaque url-safe string that encodes
+sort key of the last row on the page, so the next page
+can seek straight to it instead of skipping rows with OFFSET
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Callable
+
+from fastapi import status, HTTPException
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode sort key values into opaque cursor
+
+    :param values: sort key of the last fetched row (datetime, float, int...)
+    :return: url-safe cursor string
+    """
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values],
+                     separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: Callable[[Any], Any]) -> tuple:
+    """Decode cursor back into sort key values
+
+    :param cursor: cursor received from client
+    :param types: converters for each encoded value (datetime.fromisoformat, int...)
+    :return: tuple of decoded values
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("cursor length mismatch")
+        return tuple(convert(value) for convert, value in zip(types, values))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
@@ -0,0 +1,114 @@
+"""Profiling reports of single requests
+
+Every profiled request leaves two files in profiling directory:
+    <name>.prof - cProfile statistics, open with snakeviz or convert to flame graph (flameprof)
+    <name>.txt  - call tree of the slowest functions and tracemalloc allocations summary
+
+Event loop thread is profiled together with threadpool calls made by the profiled
+request through run_in_threadpool below (synchronous database session, password
+hashing without workers). Password jobs of worker processes show up as waiting, and
+event loop time of other requests running meanwhile is included, report tells how many.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from starlette import concurrency
+
+from .config import settings
+
+REPORT_NAME = re.compile(r"^[\w.-]+\.(prof|txt)$")
+
+# profiles of threadpool calls made by profiled request
+thread_profiles: ContextVar[Optional[list[cProfile.Profile]]] = ContextVar("thread_profiles", default=None)
+
+
+def profiled_call(profiles: list[cProfile.Profile], func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Call function in the threadpool under its own profiler
+
+    :param profiles: profiles of the request, call profile is appended
+    :param func: function to call
+    :return: function result
+    """
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        profiles.append(profile)
+
+
+async def run_in_threadpool(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Run function in the threadpool, profiled if request that runs it is profiled
+
+    :param func: function to run
+    :return: function result
+    """
+    profiles = thread_profiles.get()
+    if profiles is None:
+        return await concurrency.run_in_threadpool(func, *args, **kwargs)
+    return await concurrency.run_in_threadpool(profiled_call, profiles, func, *args, **kwargs)
+
+
+def report_name(method: str, path: str) -> str:
+    """Unique report name of request, without extension"""
+    path = re.sub(r"[^\w-]+", "_", path).strip("_") or "root"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{time.monotonic_ns() % 10 ** 6:06d}-{method}-{path}"
+
+
+def save_report(name: str, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot, duration: float,
+                thread_calls: Optional[list[cProfile.Profile]] = None, concurrent: int = 0) -> None:
+    """Write statistics and text report of profiled request
+
+    :param name: report name
+    :param profile: disabled profiler of the request
+    :param snapshot: allocations snapshot taken at the end of the request
+    :param duration: request time in seconds
+    :param thread_calls: profiles of threadpool calls of the request
+    :param concurrent: amount of other requests running on the event loop meanwhile
+    """
+    os.makedirs(settings.profiling_dir, exist_ok=True)
+    path = os.path.join(settings.profiling_dir, name)
+    text = io.StringIO()
+    text.write(f"{name}: {duration * 1000:.1f} ms\n")
+    text.write(f"threadpool calls: {len(thread_calls or [])} (included), "
+               f"password jobs of worker processes show up as waiting\n")
+    text.write(f"other requests on the event loop meanwhile: {concurrent}"
+               f"{' (their event loop time is included)' if concurrent else ''}\n\n")
+    stats = pstats.Stats(profile, *(thread_calls or []), stream=text)
+    stats.dump_stats(path + ".prof")
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE)
+    stats.print_stats(settings.profiling_top)
+    stats.print_callees(settings.profiling_top)
+    text.write("Allocations by line:\n")
+    allocations = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics("lineno")
+    for allocation in allocations[:settings.profiling_top]:
+        text.write(f"{allocation}\n")
+    with open(path + ".txt", "w") as file:
+        file.write(text.getvalue())
+
+
+def list_reports() -> list[str]:
+    """Names of saved reports, newest first"""
+    if not os.path.isdir(settings.profiling_dir):
+        return []
+    return sorted((name for name in os.listdir(settings.profiling_dir) if REPORT_NAME.match(name)), reverse=True)
+
+
+def read_report(name: str) -> Optional[bytes]:
+    """Content of saved report file, None if there is no such report
+
+    :param name: report file name with extension
+    """
+    if not REPORT_NAME.match(name):
+        return None
+    path = os.path.join(settings.profiling_dir, name)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as file:
+        return file.read()
@@ -0,0 +1,37 @@
+"""Router with service administration queries"""
+from fastapi import Depends, APIRouter, HTTPException, Query, Response, status
+
+from .. import database, oauth2, profiling
+
+# declare router
+router = APIRouter()
+
+
+@router.get("/pool", dependencies=[Depends(oauth2.verify_admin)])
+def get_pool_stats() -> dict:
+    """Database connections pool usage"""
+    return database.get_pool_stats()
+
+
+@router.get("/slow-queries", dependencies=[Depends(oauth2.verify_admin)])
+def get_slow_queries(limit: int = Query(50, ge=1, le=1000)) -> list[dict]:
+    """Latest slow statements with captured plans, newest first"""
+    return database.slow_query_log.read(limit)
+
+
+@router.get("/profiles", dependencies=[Depends(oauth2.verify_admin)])
+def get_profiles() -> list[str]:
+    """Saved profiling reports, newest first"""
+    return profiling.list_reports()
+
+
+@router.get("/profiles/{name}", dependencies=[Depends(oauth2.verify_admin)])
+def get_profile(name: str) -> Response:
+    """Profiling report, text summary (.txt) or cProfile statistics (.prof)"""
+    report = profiling.read_report(name)
+    # return 404 if report does not exist
+    if report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"report was not found (name: {name})")
+    media_type = "text/plain" if name.endswith(".txt") else "application/octet-stream"
+    return Response(report, media_type=media_type)
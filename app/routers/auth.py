@@ -1,7 +1,8 @@
 """User login-in"""
 from fastapi import status, HTTPException, Depends, APIRouter
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import database, models, schemas, oauth2, utils
 
@@ -10,20 +11,20 @@ router = APIRouter()
 
 
 @router.post("/login", response_model=schemas.Token)
-def user_login(user_credentials: OAuth2PasswordRequestForm = Depends(),
-               db: Session = Depends(database.get_db)) -> schemas.Token:
+async def user_login(user_credentials: OAuth2PasswordRequestForm = Depends(),
+                     db: AsyncSession = Depends(database.get_db)) -> schemas.Token:
     """Give user JWT for access to post operations
 
     OAuth2PasswordRequestForm data form: {"username": "...", "password": "..."}
     """
     # find user by given email
-    user = db.query(models.User).filter_by(email=user_credentials.username).first()
+    user = (await db.execute(select(models.User).filter_by(email=user_credentials.username))).scalars().first()
     # return 403 if user was not found
     if user is None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="invalid credentials")
     # check if passwords are the same
-    if not utils.verify_password(password=user_credentials.password, hashed_password=user.password):
+    if not await utils.verify_password_async(password=user_credentials.password, hashed_password=user.password):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="invalid credentials")
-    access_token: str = oauth2.create_access_token(data={"user_id": user.id})
+    access_token: str = oauth2.create_access_token(data={"user_id": user.id, "email": user.email})
     token_res = schemas.Token(token=access_token, token_type="bearer")
     return token_res
@@ -0,0 +1,65 @@
+"""Router with follow queries"""
+from typing import NoReturn
+
+from fastapi import status, HTTPException, Depends, APIRouter
+from sqlalchemy import select, update, delete, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas, database, models, oauth2, timeline
+
+router = APIRouter()
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def follow_user(follow: schemas.Follow, db: AsyncSession = Depends(database.get_db),
+                      verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> dict:
+    """Follow or unfollow another user, posts show up in or leave your feed"""
+    if follow.user_id == verified_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="you can't follow yourself")
+    if follow.dir == 1:     # follow existing user, existing follow is skipped
+        followee = select(literal(verified_user.id), models.User.id).where(models.User.id == follow.user_id)
+        changed_follow = insert(models.Follow).from_select(["follower_id", "followee_id"], followee)\
+            .on_conflict_do_nothing()
+        followers_change = 1
+    else:   # unfollow
+        changed_follow = delete(models.Follow)\
+            .where(models.Follow.follower_id == verified_user.id, models.Follow.followee_id == follow.user_id)
+        followers_change = -1
+    changed_follow = changed_follow.returning(models.Follow.followee_id).cte("changed_follow")
+    # change follow and keep denormalized followers counter in the same statement
+    followers_count = await db.scalar(update(models.User).where(models.User.id == changed_follow.c.followee_id)
+                                      .values(followers_count=models.User.followers_count + followers_change)
+                                      .returning(models.User.followers_count)
+                                      .execution_options(synchronize_session=False))
+    if followers_count is None:
+        await raise_not_followed(db, follow)
+    # not fanned out posts of celebrities are pulled by feed at read time, the rest is backfilled
+    if follow.dir == 0:
+        await timeline.remove_author(db, verified_user.id, follow.user_id)
+    else:
+        await timeline.backfill(db, verified_user.id, follow.user_id)
+    # commit changes into a database
+    await db.commit()
+    return {"detail": f"user is {'' if follow.dir else 'un'}followed"}
+
+
+async def raise_not_followed(db: AsyncSession, follow: schemas.Follow) -> NoReturn:
+    """Explain why follow was not changed
+
+    :param db: database session
+    :param follow: requested follow
+    :raise HTTPException: 404 if user is not found or is not followed, 409 if user is already followed
+    """
+    user_id = await db.scalar(select(models.User.id).where(models.User.id == follow.user_id))
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"user was not found (id: {follow.user_id})")
+    # return 409 if follow already exist
+    if follow.dir == 1:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="user is already followed")
+    # return 404 if follow does not exist
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                        detail="user is not followed")
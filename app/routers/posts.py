@@ -1,157 +1,436 @@
 """Router with post queries"""
-from fastapi import Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from datetime import datetime
+from typing import AsyncIterator, NoReturn, Optional, Union
 
-from .. import database, models, schemas, oauth2
+import orjson
+
+from fastapi import BackgroundTasks, Response, status, HTTPException, Depends, APIRouter, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, contains_eager, aliased
+from sqlalchemy.sql import Select, Insert, Update
+from sqlalchemy import select, insert, update, delete, desc, func, tuple_, cast, true, not_, literal_column, REAL, \
+    case
+
+from .. import database, models, schemas, oauth2, cache, timeline
+from ..config import settings
+from ..pagination import encode_cursor, decode_cursor
 
 # declare router
 router = APIRouter()
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def select_posts(*columns) -> Select:
+    """Select posts with likes and owners loaded in the same query
+
+    :param columns: additional columns to select
+    :return: select statement with (Post, likes, *columns) rows
+    """
+    return select(models.Post, models.Post.likes_count.label("likes"), *columns)\
+        .options(joinedload(models.Post.owner))
+
+
+def serialize_post(row) -> dict:
+    """Convert (Post, likes) row into JSON compatible response
+
+    Built directly from the row instead of validating pydantic models,
+    fields and their order are the same as in schemas.PostResponse
+
+    :param row: (Post, likes) row with loaded owner
+    :return: post response
+    """
+    post, owner = row.Post, row.Post.owner
+    return {
+        "Post": {
+            "title": post.title,
+            "content": post.content,
+            "published": post.published,
+            "id": post.id,
+            "created_at": post.created_at,
+            "owner": {"id": owner.id, "email": owner.email, "created_at": owner.created_at},
+        },
+        "likes": row.likes,
+    }
+
+
+def posts_response(posts: list, next_cursor: Optional[str] = None) -> ORJSONResponse:
+    """Serialize posts list straight with orjson
+
+    :param posts: serialized posts
+    :param next_cursor: cursor of the next page, if there is one
+    :return: JSON response with cursor in X-Next-Cursor header
+    """
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor is not None else None
+    return ORJSONResponse(posts, headers=headers)
+
+
+def page_cursor(posts: list, limit: int) -> Optional[str]:
+    """Cursor pointing after the last post of the page
+
+    :param posts: serialized posts ordered from newest to oldest
+    :param limit: page size
+    :return: cursor, None if page is not full and there is nothing after it
+    """
+    if limit <= 0 or len(posts) < limit:
+        return None
+    last_post = posts[-1]["Post"]
+    return encode_cursor(last_post["created_at"], last_post["id"])
+
+
+async def paginate(db: AsyncSession, query: Select, limit: int, skip: int, cursor: Optional[str]) -> list:
+    """Fetch one page of posts ordered from newest to oldest
+
+    With cursor given, seek straight after the last seen (created_at, id)
+    using composite index, otherwise fall back to the OFFSET paging.
+
+    :param db: database session
+    :param query: posts query with (Post, likes) rows
+    :param limit: page size
+    :param skip: amount of posts to skip (legacy offset paging)
+    :param cursor: cursor of the previous page
+    :return: page of serialized posts
+    """
+    query = query.order_by(desc(models.Post.created_at), desc(models.Post.id))
+    if cursor is not None:
+        created_at, id_ = decode_cursor(cursor, datetime.fromisoformat, int)
+        query = query.where(tuple_(models.Post.created_at, models.Post.id) < tuple_(created_at, id_))
+    elif skip:
+        query = query.offset(skip)
+    return [serialize_post(row) for row in (await db.execute(query.limit(limit))).all()]
+
+
+async def cached_first_page(db: AsyncSession, query: Select, limit: int) -> list:
+    """Fetch first page of published posts through response cache
+
+    Cache keeps the longest first page, shorter pages are its slices,
+    so one entry serves every page size and is invalidated at once.
+
+    :param db: database session
+    :param query: published posts query with (Post, likes) rows
+    :param limit: page size, not greater than cached page
+    :return: page of serialized posts
+    """
+    posts = await cache.cache_get(cache.FIRST_PAGE_KEY)
+    if posts is None:
+        posts = await paginate(db, query, settings.response_cache_first_page, 0, None)
+        if not database.from_replica(db):
+            await cache.cache_set(cache.FIRST_PAGE_KEY, posts)
+    return posts[:limit]
+
+
+def select_written_posts(statement: Union[Insert, Update], *columns) -> Select:
+    """Run INSERT or UPDATE of posts and select written posts
+    with likes and owners in the same statement
+
+    :param statement: posts INSERT or UPDATE
+    :param columns: extra labeled columns returned by the statement
+    :return: select statement with (Post, likes, *columns) rows
+    """
+    written_posts = statement.returning(*models.Post.__table__.c, *columns).cte("written_posts")
+    post = aliased(models.Post, written_posts, name="Post")
+    return select(post, written_posts.c.likes_count.label("likes"),
+                  *(written_posts.c[column.name] for column in columns))\
+        .join(post.owner).options(contains_eager(post.owner))\
+        .order_by(written_posts.c.id)\
+        .execution_options(populate_existing=True)
+
+
+async def raise_not_owned(db: AsyncSession, id_: int) -> NoReturn:
+    """Explain why write to the post matched nothing
+
+    :param db: database session
+    :param id_: post id
+    :raise HTTPException: 404 if post does not exist, 403 if post is foreign
+    """
+    if await db.scalar(select(models.Post.id).where(models.Post.id == id_)) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"post was not found (id: {id_})")
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                        detail="unauthorized action")
+
+
+async def fetch_post(db: AsyncSession, id_: int):
+    """Fetch single post with likes by id
+
+    :param db: database session
+    :param id_: post id
+    :return: (Post, likes) row or None
+    """
+    return (await db.execute(select_posts().where(models.Post.id == id_)
+                             .execution_options(populate_existing=True))).first()
+
 
 @router.get("/", response_model=list[schemas.PostResponse])
-def get_posts(db: Session = Depends(database.get_db),
-              limit: int = 10, skip: int = 0, search: str = "") -> list[schemas.PostResponse]:
+async def get_posts(db: AsyncSession = Depends(database.get_read_db),
+                    limit: int = Query(10, ge=0, le=settings.max_page_size),
+                    skip: int = 0, search: str = "",
+                    cursor: Optional[str] = None) -> ORJSONResponse:
     """Fetch all published posts"""
     # fetch all existing, published posts
-    all_posts = db.query(models.Post, func.count(models.Rating.post_id).label("likes"))\
-        .join(models.Rating, models.Rating.post_id == models.Post.id, isouter=True)\
-        .group_by(models.Post.id)\
-        .filter(models.Post.title.contains(search), models.Post.published == "TRUE")\
-        .order_by(desc(models.Post.created_at))\
-        .limit(limit).offset(skip).all()
-    return all_posts
+    all_posts = select_posts()\
+        .where(models.Post.title.contains(search), models.Post.published == true())
+    # most requested first page is served from cache
+    if cache.response_cache is not None and cursor is None and not skip and not search \
+            and 0 < limit <= settings.response_cache_first_page:
+        posts = await cached_first_page(db, all_posts, limit)
+    else:
+        posts = await paginate(db, all_posts, limit, skip, cursor)
+    return posts_response(posts, page_cursor(posts, limit))
 
 
 @router.get("/my", response_model=list[schemas.PostResponse])
-def get_posts_my(db: Session = Depends(database.get_db),
-                 verified_user: models.User = Depends(oauth2.verify_current_user),
-                 limit: int = 10, skip: int = 0, search: str = "") -> list[schemas.PostResponse]:
+async def get_posts_my(db: AsyncSession = Depends(database.get_read_db),
+                       verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user),
+                       limit: int = Query(10, ge=0, le=settings.max_page_size),
+                       skip: int = 0, search: str = "",
+                       cursor: Optional[str] = None) -> ORJSONResponse:
     """Fetch all your posts, published and unpublished"""
     # fetch all user posts
-    my_posts = db.query(models.Post, func.count(models.Rating.post_id).label("likes"))\
-        .join(models.Rating, models.Rating.post_id == models.Post.id, isouter=True)\
-        .group_by(models.Post.id)\
-        .filter(models.Post.title.contains(search), models.Post.owner_id == verified_user.id)\
-        .order_by(desc(models.Post.created_at))\
-        .limit(limit).offset(skip).all()
-    return my_posts
+    my_posts = select_posts()\
+        .where(models.Post.title.contains(search), models.Post.owner_id == verified_user.id)
+    posts = await paginate(db, my_posts, limit, skip, cursor)
+    return posts_response(posts, page_cursor(posts, limit))
+
+
+@router.get("/search", response_model=list[schemas.PostResponse])
+async def search_posts(q: str = Query(..., min_length=1), db: AsyncSession = Depends(database.get_read_db),
+                       limit: int = Query(10, ge=0, le=settings.max_page_size),
+                       cursor: Optional[str] = None) -> ORJSONResponse:
+    """Full-text search over published posts titles and content, most relevant first"""
+    ts_query = func.websearch_to_tsquery(literal_column("'english'"), q)
+    rank = func.ts_rank(models.Post.search_vector, ts_query)
+    # match against GIN indexed search document
+    found_posts = select_posts(rank.label("rank"))\
+        .where(models.Post.search_vector.op("@@")(ts_query), models.Post.published == true())\
+        .order_by(desc(rank), desc(models.Post.id))
+    if cursor is not None:
+        last_rank, last_id = decode_cursor(cursor, float, int)
+        # ts_rank is real, compare with real to not lose ties on rounding
+        found_posts = found_posts.where(tuple_(rank, models.Post.id) < tuple_(cast(last_rank, REAL), last_id))
+    page = (await db.execute(found_posts.limit(limit))).all()
+    next_cursor = encode_cursor(page[-1].rank, page[-1].Post.id) if limit > 0 and len(page) == limit else None
+    return posts_response([serialize_post(row) for row in page], next_cursor)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_posts(db: AsyncSession = Depends(database.get_read_db),
+                       verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> StreamingResponse:
+    """Stream all published posts as newline delimited JSON
+
+    Rows are read from server-side cursor in batches,
+    so memory use doesn't depend on amount of posts
+    """
+    result = await db.stream(select_posts()
+                             .where(models.Post.published == true())
+                             .order_by(models.Post.id)
+                             .execution_options(yield_per=settings.export_batch_size))
+
+    async def export_lines() -> AsyncIterator[bytes]:
+        try:
+            async for rows in result.partitions(settings.export_batch_size):
+                yield b"".join(orjson.dumps(serialize_post(row)) + b"\n" for row in rows)
+        finally:
+            await result.close()
+    return StreamingResponse(export_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/feed", response_model=list[schemas.PostResponse])
+async def get_feed(db: AsyncSession = Depends(database.get_read_db),
+                   verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user),
+                   limit: int = Query(10, ge=0, le=settings.max_page_size),
+                   cursor: Optional[str] = None) -> ORJSONResponse:
+    """Fetch published posts of followed users, newest first"""
+    after = decode_cursor(cursor, datetime.fromisoformat, int) if cursor is not None else None
+    feed = timeline.select_feed(verified_user.id, limit, after)
+    feed_posts = select_posts().join(feed, models.Post.id == feed.c.post_id)\
+        .order_by(desc(models.Post.created_at), desc(models.Post.id)).limit(limit)
+    posts = [serialize_post(row) for row in (await db.execute(feed_posts)).all()]
+    return posts_response(posts, page_cursor(posts, limit))
+
+
+@router.get("/trending", response_model=list[schemas.PostResponse])
+async def get_trending_posts(db: AsyncSession = Depends(database.get_read_db),
+                             limit: int = Query(10, ge=0, le=settings.max_page_size),
+                             cursor: Optional[str] = None) -> ORJSONResponse:
+    """Fetch published posts with most recent likes, from periodically refreshed ranking"""
+    score = models.TrendingPost.score
+    trending_posts = select_posts(score.label("score"))\
+        .join(models.TrendingPost, models.TrendingPost.post_id == models.Post.id)\
+        .where(models.Post.published == true())\
+        .order_by(desc(score), desc(models.TrendingPost.post_id))
+    if cursor is not None:
+        last_score, last_id = decode_cursor(cursor, float, int)
+        trending_posts = trending_posts.where(tuple_(score, models.TrendingPost.post_id) < tuple_(last_score, last_id))
+    page = (await db.execute(trending_posts.limit(limit))).all()
+    next_cursor = encode_cursor(page[-1].score, page[-1].Post.id) if limit > 0 and len(page) == limit else None
+    return posts_response([serialize_post(row) for row in page], next_cursor)
 
 
 @router.get("/latest", response_model=schemas.PostResponse)
-def get_latest_post(db: Session = Depends(database.get_db)) -> schemas.PostResponse:
+async def get_latest_post(db: AsyncSession = Depends(database.get_read_db)) -> schemas.PostResponse:
     """Fetch last published post"""
+    latest_post = await cache.cache_get(cache.LATEST_POST_KEY)
+    if latest_post is not None:
+        return latest_post
     # get last posted
-    latest_post = db.query(models.Post, func.count(models.Rating.post_id).label("likes"))\
-        .join(models.Rating, models.Rating.post_id == models.Post.id, isouter=True)\
-        .group_by(models.Post.id)\
-        .filter(models.Post.published == "TRUE")\
-        .order_by(desc(models.Post.created_at)).first()
+    latest_post = (await db.execute(select_posts()
+                                    .where(models.Post.published == true())
+                                    .order_by(desc(models.Post.created_at), desc(models.Post.id))
+                                    .limit(1))).first()
+    if latest_post is not None:
+        latest_post = serialize_post(latest_post)
+        if not database.from_replica(db):
+            await cache.cache_set(cache.LATEST_POST_KEY, latest_post)
     return latest_post
 
 
 @router.get("/{id_}", response_model=schemas.PostResponse)
-def get_post(id_: int, db: Session = Depends(database.get_db),
-             verified_user: models.User = Depends(oauth2.verify_current_user)) -> schemas.PostResponse:
+async def get_post(id_: int, db: AsyncSession = Depends(database.get_read_db),
+                   verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> schemas.PostResponse:
     """Find and fetch post by given id"""
-    # find post by id
-    found_post = db.query(models.Post, func.count(models.Rating.post_id).label("likes"))\
-        .join(models.Rating, models.Rating.post_id == models.Post.id, isouter=True)\
-        .group_by(models.Post.id)\
-        .filter(models.Post.id == id_).first()
-    # return 404 if post was not found
+    found_post = await cache.cache_get(cache.POST_KEY.format(id_))
     if found_post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post was not found (id: {id_})")
+        # find post by id
+        found_post = await fetch_post(db, id_)
+        # return 404 if post was not found
+        if found_post is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"post was not found (id: {id_})")
+        found_post = serialize_post(found_post)
+        if not database.from_replica(db):
+            await cache.cache_set(cache.POST_KEY.format(id_), found_post)
     # return 404 if getting not published post from another user
-    if found_post.Post.published is False and found_post.Post.owner_id != verified_user.id:
+    if found_post["Post"]["published"] is False and found_post["Post"]["owner"]["id"] != verified_user.id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"post was not found (id: {id_})")
     return found_post
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Post)
-def create_post(post: schemas.PostCreate, db: Session = Depends(database.get_db),
-                verified_user: models.User = Depends(oauth2.verify_current_user)) -> schemas.Post:
+async def create_post(post: schemas.PostCreate, background_tasks: BackgroundTasks,
+                      db: AsyncSession = Depends(database.get_db),
+                      verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> dict:
     """Create new post"""
-    # insert single post
-    created_post = models.Post(**dict(post), owner_id=verified_user.id)      # unpack class as dict for easier input
-    db.add(created_post)
+    # insert single post and get it back with its owner
+    created_post = (await db.execute(select_written_posts(
+        insert(models.Post).values(**dict(post), owner_id=verified_user.id,
+                                   fanned_out=timeline.fan_out_flag(verified_user.id))))).first()
+    followers_count = created_post.Post.owner.followers_count
+    # serialize before commit expires loaded post
+    created_post = serialize_post(created_post)
+    # commit changes into database
+    await db.commit()
+    # new published post shows up on the first page and in followers feeds
+    if post.published:
+        await cache.invalidate_posts()
+        timeline.schedule_fan_out(background_tasks, db, verified_user.id, followers_count,
+                                  [created_post["Post"]["id"]])
+    return created_post["Post"]
+
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=list[schemas.Post])
+async def create_posts(posts: list[schemas.PostCreate], background_tasks: BackgroundTasks,
+                       db: AsyncSession = Depends(database.get_db),
+                       verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> list[dict]:
+    """Create multiple posts in one statement"""
+    if len(posts) > settings.bulk_post_limit:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"too many posts in bulk (max: {settings.bulk_post_limit})")
+    if not posts:
+        return []
+    # multi-row insert, ids are given in input order
+    created_posts = (await db.execute(select_written_posts(
+        insert(models.Post).values([{**dict(post), "owner_id": verified_user.id,
+                                     "fanned_out": timeline.fan_out_flag(verified_user.id)} for post in posts])))).all()
+    followers_count = created_posts[0].Post.owner.followers_count
+    # serialize before commit expires loaded posts
+    created_posts = [serialize_post(row)["Post"] for row in created_posts]
     # commit changes into database
-    db.commit()
-    # get created post for returning
-    db.refresh(created_post)
-    return created_post
+    await db.commit()
+    published_ids = [post["id"] for post in created_posts if post["published"]]
+    if published_ids:
+        await cache.invalidate_posts()
+        timeline.schedule_fan_out(background_tasks, db, verified_user.id, followers_count, published_ids)
+    return created_posts
 
 
 @router.put("/publish/{id_}")
-def change_post_visibility(id_: int, db: Session = Depends(database.get_db),
-                           verified_user: models.User = Depends(oauth2.verify_current_user)) -> dict:
+async def change_post_visibility(id_: int, background_tasks: BackgroundTasks,
+                                 db: AsyncSession = Depends(database.get_db),
+                                 verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> dict:
     """Change post visibility on opposite, published <-> unpublished"""
-    # find post by id
-    post = db.query(models.Post).filter(models.Post.id == id_)
-    fetched_post = post.first()
-    # raise 404 if post wasn't found
-    if fetched_post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post was not found (id: {id_})")
-    # raise 403 if user have insufficient rights
-    if fetched_post.owner_id != verified_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="unauthorized action")
-    # fetched_post.published = not fetched_post.published
-    updated_post = schemas.PostCreate(title=fetched_post.title, content=fetched_post.content,
-                                      published=not fetched_post.published)
-    # update fetched post
-    post.update(dict(updated_post), synchronize_session=False)
+    # flip visibility of own post, with owner followers for fan-out
+    changed_post = (await db.execute(update(models.Post)
+                                     .where(models.Post.id == id_, models.Post.owner_id == verified_user.id)
+                                     .values(published=not_(models.Post.published),
+                                             fanned_out=timeline.fan_out_flag(models.Post.owner_id))
+                                     .returning(models.Post.published,
+                                                select(models.User.followers_count)
+                                                .where(models.User.id == models.Post.owner_id)
+                                                .scalar_subquery())
+                                     .execution_options(synchronize_session=False))).first()
+    # raise 404 or 403 if nothing was updated
+    if changed_post is None:
+        await raise_not_owned(db, id_)
+    published, followers_count = changed_post
     # commit changes into the database
-    db.commit()
-    return {"detail": f"post was successfully {'' if updated_post.published else 'un'}published (id: {id_})"}
+    await db.commit()
+    await cache.invalidate_posts(id_)
+    # unpublished posts stay in timelines, feed skips them
+    if published:
+        timeline.schedule_fan_out(background_tasks, db, verified_user.id, followers_count, [id_])
+    return {"detail": f"post was successfully {'' if published else 'un'}published (id: {id_})"}
 
 
 @router.delete("/{id_}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id_: int, db: Session = Depends(database.get_db),
-                verified_user: models.User = Depends(oauth2.verify_current_user)) -> Response:
+async def delete_post(id_: int, db: AsyncSession = Depends(database.get_db),
+                      verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> Response:
     """Delete your post"""
-    # find post for deletion by id
-    post_to_delete = db.query(models.Post).filter(models.Post.id == id_)
-    post = post_to_delete.first()
-    # return 404 if post was not found
-    if post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post was not found (id: {id_})")
-    # return 403 if post isn't owned by user
-    if post.owner_id != verified_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="unauthorized action")
-    # if deleted post exist - delete
-    post_to_delete.delete(synchronize_session=False)
+    # delete own post
+    deleted_id = await db.scalar(delete(models.Post)
+                                 .where(models.Post.id == id_, models.Post.owner_id == verified_user.id)
+                                 .returning(models.Post.id)
+                                 .execution_options(synchronize_session=False))
+    # return 404 or 403 if nothing was deleted
+    if deleted_id is None:
+        await raise_not_owned(db, id_)
     # commit changes into database
-    db.commit()
+    await db.commit()
+    await cache.invalidate_posts(id_)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.put("/{id_}", response_model=schemas.PostResponse)
-def update_post(id_: int, post: schemas.PostCreate, db: Session = Depends(database.get_db),
-                verified_user: models.User = Depends(oauth2.verify_current_user)) -> schemas.PostResponse:
+async def update_post(id_: int, post: schemas.PostCreate, background_tasks: BackgroundTasks,
+                      db: AsyncSession = Depends(database.get_db),
+                      verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> dict:
     """Update your post"""
-    # find post by id
-    post_to_update = db.query(models.Post).filter_by(id=id_)
-    fetched_post = post_to_update.first()
-    # return 404 if post was not found
-    if fetched_post is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"post was not found (id: {id_})")
-    if fetched_post.owner_id != verified_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="unauthorized action")
-    # if updated post exist, update it
-    post_to_update.update(dict(post), synchronize_session=False)
+    # row before update, to find out if post gets published
+    old_post = aliased(models.Post, name="old_post")
+    values = dict(post)
+    if post.published:
+        # fan-out is decided only when post gets published, like in change_post_visibility
+        values["fanned_out"] = case((old_post.published, models.Post.fanned_out),
+                                    else_=timeline.fan_out_flag(models.Post.owner_id))
+    # update own post and get it back for respond, with owner followers for fan-out
+    updated_post = (await db.execute(select_written_posts(
+        update(models.Post).where(models.Post.id == id_, models.Post.owner_id == verified_user.id,
+                                  old_post.id == models.Post.id)
+        .values(**values),
+        old_post.published.label("was_published"),
+        select(models.User.followers_count).where(models.User.id == models.Post.owner_id)
+        .scalar_subquery().label("followers_count")))).first()
+    # return 404 or 403 if nothing was updated
+    if updated_post is None:
+        await raise_not_owned(db, id_)
+    was_published, followers_count = updated_post.was_published, updated_post.followers_count
+    # serialize before commit expires loaded post
+    updated_post = serialize_post(updated_post)
     # commit database changes
-    db.commit()
-    # fetch updated post for respond
-    post_to_update = db.query(models.Post, func.count(models.Rating.post_id).label("likes"))\
-        .join(models.Rating, models.Rating.post_id == models.Post.id, isouter=True)\
-        .group_by(models.Post.id)\
-        .filter(models.Post.id == id_).first()
-    return post_to_update
+    await db.commit()
+    await cache.invalidate_posts(id_)
+    if post.published and not was_published:
+        timeline.schedule_fan_out(background_tasks, db, verified_user.id, followers_count, [id_])
+    return updated_post
@@ -1,44 +1,160 @@
 """Router with voting queries"""
-from typing import Optional
+from typing import NoReturn
 
 from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, update, delete, exists, literal, true, tuple_, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import schemas, database, models, oauth2
+from .. import schemas, database, models, oauth2, cache, write_behind
+from ..config import settings
 
 router = APIRouter()
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def rate_post(rate: schemas.Rate, db: Session = Depends(database.get_db),
-              verified_user: models.User = Depends(oauth2.verify_current_user)) -> dict:
+async def rate_post(rate: schemas.Rate, db: AsyncSession = Depends(database.get_db),
+                    verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> dict:
     """Add or remove like from foreign post"""
-    # firstly check if post exist and user have sufficient rights
-    post: Optional[models.Post] = db.query(models.Post)\
-        .filter(models.Post.id == rate.post_id, models.Post.published == "TRUE").first()
+    if settings.rate_write_behind:
+        return await buffer_rate(db, rate, verified_user.id)
+    # only published foreign posts can be rated
+    ratable_post = (models.Post.id == rate.post_id, models.Post.published == true(),
+                    models.Post.owner_id != verified_user.id)
+    if rate.dir == 1:   # like post, existing rating is skipped
+        rating = select(literal(verified_user.id), models.Post.id).where(*ratable_post)
+        changed_rating = insert(models.Rating).from_select(["user_id", "post_id"], rating).on_conflict_do_nothing()
+        likes_change = 1
+    else:   # remove rating
+        changed_rating = delete(models.Rating)\
+            .where(models.Rating.user_id == verified_user.id,
+                   models.Rating.post_id.in_(select(models.Post.id).where(*ratable_post)))
+        likes_change = -1
+    changed_rating = changed_rating.returning(models.Rating.post_id).cte("changed_rating")
+    # change rating and keep denormalized likes counter in the same statement
+    rated_post_id = await db.scalar(update(models.Post).where(models.Post.id == changed_rating.c.post_id)
+                                    .values(likes_count=models.Post.likes_count + likes_change)
+                                    .returning(models.Post.id)
+                                    .execution_options(synchronize_session=False))
+    if rated_post_id is None:
+        await raise_not_rated(db, rate, verified_user.id)
+    # commit changes into a database
+    await db.commit()
+    await cache.invalidate_posts(rate.post_id)
+    return {"detail": "rating is saved"}
+
+
+async def buffer_rate(db: AsyncSession, rate: schemas.Rate, user_id: int) -> ORJSONResponse:
+    """Validate rate and queue it into write-behind buffer
+
+    :param db: database session
+    :param rate: requested rate
+    :param user_id: rating user id
+    :return: 202 response, rating is written later
+    :raise HTTPException: same errors as synchronous rating, 503 if buffer is full
+    """
+    rated = exists().where(models.Rating.user_id == user_id, models.Rating.post_id == models.Post.id)
+    post = (await db.execute(select(models.Post.owner_id, rated)
+                             .where(models.Post.id == rate.post_id, models.Post.published == true()))).first()
     if post is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"post was not found (id: {rate.post_id})")
-    if post.owner_id == verified_user.id:
+    if post[0] == user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="you can't rate your own post")
-    # found rating
-    rating = db.query(models.Rating)\
-        .filter(models.Rating.post_id == rate.post_id, models.Rating.user_id == verified_user.id)
-    vote: Optional[models.Rating] = rating.first()
-    if rate.dir == 1:   # like post
-        # return 409 if rating already exist
-        if vote is not None:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                                detail="rating already exist")
-        new_rating = models.Rating(user_id=verified_user.id, post_id=rate.post_id)
-        db.add(new_rating)
-    elif rate.dir == 0:     # remove rating
-        # return 404 if rating does not exist
-        if vote is None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="rating does not exist")
-        rating.delete(synchronize_session=False)
-    # commit changes into a database
-    db.commit()
-    return {"detail": "rating is saved"}
+    # buffered rates are not in the database yet
+    previous = write_behind.rating_buffer.rated(user_id, rate.post_id, post[1])
+    if rate.dir == 1 and previous:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="rating already exist")
+    if rate.dir == 0 and not previous:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="rating does not exist")
+    write_behind.rating_buffer.add(user_id, rate.post_id, rate.dir == 1, previous)
+    return ORJSONResponse({"detail": "rating is accepted"}, status_code=status.HTTP_202_ACCEPTED)
+
+
+async def raise_not_rated(db: AsyncSession, rate: schemas.Rate, user_id: int) -> NoReturn:
+    """Explain why rating was not changed
+
+    :param db: database session
+    :param rate: requested rate
+    :param user_id: rating user id
+    :raise HTTPException: 404 if post is not found or there is no rating to remove,
+        403 for own post, 409 if rating already exist
+    """
+    owner_id = await db.scalar(select(models.Post.owner_id)
+                               .where(models.Post.id == rate.post_id, models.Post.published == true()))
+    if owner_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"post was not found (id: {rate.post_id})")
+    if owner_id == user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="you can't rate your own post")
+    # return 409 if rating already exist
+    if rate.dir == 1:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="rating already exist")
+    # return 404 if rating does not exist
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                        detail="rating does not exist")
+
+
+@router.post("/batch", response_model=list[schemas.RateResult])
+async def rate_posts(rates: list[schemas.Rate], db: AsyncSession = Depends(database.get_db),
+                     verified_user: schemas.CurrentUser = Depends(oauth2.verify_current_user)) -> list[dict]:
+    """Add or remove likes from multiple foreign posts in one transaction
+
+    Every rate gets its own result with the same status and detail
+    as single rate query would respond with
+    """
+    if len(rates) > settings.rate_batch_limit:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"too many rates in batch (max: {settings.rate_batch_limit})")
+    post_ids = [rate.post_id for rate in rates]
+    if len(set(post_ids)) != len(post_ids):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="post can be rated only once in batch")
+    results = {post_id: (status.HTTP_201_CREATED, "rating is saved") for post_id in post_ids}
+    # check all posts at once
+    owners = dict((await db.execute(select(models.Post.id, models.Post.owner_id)
+                                    .where(models.Post.id.in_(post_ids), models.Post.published == true()))).all())
+    likes, unlikes = [], []
+    for rate in rates:
+        if rate.post_id not in owners:
+            results[rate.post_id] = (status.HTTP_404_NOT_FOUND, f"post was not found (id: {rate.post_id})")
+        elif owners[rate.post_id] == verified_user.id:
+            results[rate.post_id] = (status.HTTP_403_FORBIDDEN, "you can't rate your own post")
+        else:
+            (likes if rate.dir == 1 else unlikes).append(rate.post_id)
+    likes_change = {}
+    if likes:
+        # existing ratings are skipped and not returned
+        liked = (await db.execute(insert(models.Rating)
+                                  .values([{"user_id": verified_user.id, "post_id": post_id} for post_id in likes])
+                                  .on_conflict_do_nothing()
+                                  .returning(models.Rating.post_id))).scalars().all()
+        likes_change.update((post_id, 1) for post_id in liked)
+        for post_id in set(likes) - set(liked):
+            results[post_id] = (status.HTTP_409_CONFLICT, "rating already exist")
+    if unlikes:
+        unliked = (await db.execute(delete(models.Rating)
+                                    .where(tuple_(models.Rating.user_id, models.Rating.post_id)
+                                           .in_([(verified_user.id, post_id) for post_id in unlikes]))
+                                    .returning(models.Rating.post_id)
+                                    .execution_options(synchronize_session=False))).scalars().all()
+        likes_change.update((post_id, -1) for post_id in unliked)
+        for post_id in set(unlikes) - set(unliked):
+            results[post_id] = (status.HTTP_404_NOT_FOUND, "rating does not exist")
+    if likes_change:
+        # keep denormalized likes counters with one statement
+        await db.execute(update(models.Post).where(models.Post.id.in_(likes_change))
+                         .values(likes_count=models.Post.likes_count
+                                 + case(likes_change, value=models.Post.id, else_=0))
+                         .execution_options(synchronize_session=False))
+    await db.commit()
+    if likes_change:
+        await cache.invalidate_posts(*likes_change)
+    return [{"post_id": post_id, "status_code": results[post_id][0], "detail": results[post_id][1]}
+            for post_id in post_ids]
@@ -2,7 +2,9 @@
 import re
 
 from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import database, utils, models, schemas
 
@@ -13,34 +15,41 @@ PASSWORD_REGEX = r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)) -> schemas.UserResponse:
+async def create_user(user: schemas.UserCreate,
+                      db: AsyncSession = Depends(database.get_db)) -> schemas.UserResponse:
     """Create new user and save him into the database"""
     if re.match(PASSWORD_REGEX, user.password) is None:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                             detail=f"password must contain at least 8 characters, one uppercase letter, "
                                    f"one lowercase letter, one number and one special character")
-    # save hashed password
-    user.password = utils.hash_password(user.password)
-    # check if email already registered
-    existence = db.query(models.User).filter(models.User.email == user.email).first()
+    email_taken = HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"email already registered (email: {user.email})")
+    # check if email already registered before spending time on hashing
+    existence = await db.scalar(select(models.User.id).where(models.User.email == user.email))
     if existence is not None:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                            detail=f"email already registered (email: {user.email})")
+        raise email_taken
+    # save hashed password
+    user.password = await utils.hash_password_async(user.password)
     # create single user
     new_user = models.User(**dict(user))  # unpack class as dictionary for easier input
     db.add(new_user)
     # commit changes into database
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:      # same email was registered concurrently
+        await db.rollback()
+        raise email_taken
     # return new user details
-    db.refresh(new_user)
+    await db.refresh(new_user)
     return new_user
 
 
 @router.get("/{id_}", response_model=schemas.UserResponse)
-def get_user(id_: int, db: Session = Depends(database.get_db)) -> schemas.UserResponse:
+async def get_user(id_: int,
+                   db: AsyncSession = Depends(database.get_read_db)) -> schemas.UserResponse:
     """Get user details by his id"""
     # get user by id
-    user = db.query(models.User).filter_by(id=id_).first()
+    user = await db.get(models.User, id_)
     # return 404 if user id was not found
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
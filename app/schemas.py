@@ -68,9 +68,33 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     """Scheme for token that verify user rights"""
     user_id: Optional[str] = None
+    email: Optional[str] = None
+
+
+class CurrentUser(BaseModel):
+    """Authenticated user, as verified from JWT"""
+    id: int
+    email: Optional[str] = None
+
+    class Config:
+        """Also trying to get information as attribute (id = data.id)"""
+        orm_mode = True
 
 
 class Rate(BaseModel):
     """Schema for users rate query"""
     post_id: int
     dir: Literal[0, 1]  # direction: 0 - remove, 1 - add
+
+
+class Follow(BaseModel):
+    """Schema for users follow query"""
+    user_id: int
+    dir: Literal[0, 1]  # direction: 0 - unfollow, 1 - follow
+
+
+class RateResult(BaseModel):
+    """Result of single rate from the batch"""
+    post_id: int
+    status_code: int
+    detail: str
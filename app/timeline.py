@@ -0,0 +1,146 @@
+"""Home timelines of followed users posts
+
+Published posts are fanned out on write into timelines table of author followers
+by background task after response, so feed read is a single range scan of
+(user_id, created_at, post_id) primary key. Posts of authors with more than
+feed_fanout_limit followers would cost too many writes, so they are published with
+fanned_out flag off and feed pulls them from posts table at read time, even after
+the author drops back under the limit.
+"""
+import logging
+from datetime import datetime
+from typing import Optional, Union
+
+from fastapi import BackgroundTasks
+from sqlalchemy import select, delete, desc, false, func, literal, true, tuple_, union
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement, Subquery
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_celebrity(followers_count: int) -> bool:
+    """Check if posts of author are pulled at read time instead of fan-out"""
+    return followers_count > settings.feed_fanout_limit
+
+
+def fan_out_flag(owner_id: Union[int, ColumnElement]) -> ColumnElement:
+    """Post.fanned_out value of posts being published, computed by the publishing statement,
+    so it agrees with followers count returned by it
+
+    :param owner_id: author of the posts, id or posts column
+    """
+    return select(models.User.followers_count <= settings.feed_fanout_limit)\
+        .where(models.User.id == owner_id).scalar_subquery()
+
+
+def schedule_fan_out(background_tasks: BackgroundTasks, db: AsyncSession, owner_id: int, followers_count: int,
+                     post_ids: list[int]) -> None:
+    """Fan out published posts after response, if author has followers and is not a celebrity
+
+    :param background_tasks: tasks of the request
+    :param db: request database session, still open while background tasks run
+    :param owner_id: author of the posts
+    :param followers_count: amount of author followers
+    :param post_ids: published posts
+    """
+    if post_ids and 0 < followers_count and not is_celebrity(followers_count):
+        background_tasks.add_task(fan_out_posts, db, owner_id, post_ids)
+
+
+async def fan_out_posts(db: AsyncSession, owner_id: int, post_ids: list[int]) -> int:
+    """Insert posts into timelines of author followers, batch of followers per transaction
+
+    :param db: database session
+    :param owner_id: author of the posts
+    :param post_ids: posts to fan out, unpublished ones are skipped
+    :return: amount of inserted timeline entries
+    """
+    last_follower_id, inserted = 0, 0
+    try:
+        while True:
+            followers = select(models.Follow.follower_id)\
+                .where(models.Follow.followee_id == owner_id, models.Follow.follower_id > last_follower_id)\
+                .order_by(models.Follow.follower_id).limit(settings.feed_fanout_batch).cte("followers")
+            entries = insert(models.TimelineEntry)\
+                .from_select(["user_id", "created_at", "post_id"],
+                             # every follower of the batch gets every post
+                             select(followers.c.follower_id, models.Post.created_at, models.Post.id)
+                             .join_from(followers, models.Post, true())
+                             .where(models.Post.id.in_(post_ids), models.Post.published == true()))\
+                .on_conflict_do_nothing()\
+                .returning(models.TimelineEntry.post_id).cte("entries")
+            # write batch and get the next keyset position in one statement
+            batch = (await db.execute(select(func.count(), func.max(followers.c.follower_id),
+                                             select(func.count()).select_from(entries).scalar_subquery())
+                                      .select_from(followers))).one()
+            await db.commit()
+            inserted += batch[2]
+            if batch[0] < settings.feed_fanout_batch:
+                return inserted
+            last_follower_id = batch[1]
+    except SQLAlchemyError:
+        # feed of followers misses the posts, request itself is already done
+        logger.exception("fan-out of posts %s of user %s failed", post_ids, owner_id)
+        await db.rollback()
+        return inserted
+
+
+async def backfill(db: AsyncSession, user_id: int, followee_id: int) -> None:
+    """Add recent published posts of newly followed user into the timeline
+
+    :param db: database session
+    :param user_id: follower
+    :param followee_id: followed user
+    """
+    recent_posts = select(literal(user_id), models.Post.created_at, models.Post.id)\
+        .where(models.Post.owner_id == followee_id, models.Post.published == true())\
+        .order_by(desc(models.Post.created_at), desc(models.Post.id)).limit(settings.feed_backfill)
+    await db.execute(insert(models.TimelineEntry)
+                     .from_select(["user_id", "created_at", "post_id"], recent_posts)
+                     .on_conflict_do_nothing())
+
+
+async def remove_author(db: AsyncSession, user_id: int, followee_id: int) -> None:
+    """Remove posts of unfollowed user from the timeline
+
+    :param db: database session
+    :param user_id: follower
+    :param followee_id: unfollowed user
+    """
+    await db.execute(delete(models.TimelineEntry)
+                     .where(models.TimelineEntry.user_id == user_id,
+                            models.TimelineEntry.post_id.in_(select(models.Post.id)
+                                                             .where(models.Post.owner_id == followee_id)))
+                     .execution_options(synchronize_session=False))
+
+
+def select_feed(user_id: int, limit: int, after: Optional[tuple[datetime, int]]) -> Subquery:
+    """Ids of one feed page: timeline range merged with recent not fanned out posts of followed users
+
+    :param user_id: feed owner
+    :param limit: page size
+    :param after: (created_at, id) of the last post of the previous page
+    :return: subquery with post_id column
+    """
+    entry = models.TimelineEntry
+    timeline = select(entry.post_id.label("post_id"), entry.created_at.label("created_at"))\
+        .join(models.Post, models.Post.id == entry.post_id)\
+        .where(entry.user_id == user_id, models.Post.published == true())\
+        .order_by(desc(entry.created_at), desc(entry.post_id)).limit(limit)
+    followees = select(models.Follow.followee_id).where(models.Follow.follower_id == user_id)
+    # posts published while author was a celebrity, whatever followers count is now
+    pulled = select(models.Post.id.label("post_id"), models.Post.created_at.label("created_at"))\
+        .where(models.Post.owner_id.in_(followees), models.Post.published == true(),
+               models.Post.fanned_out == false())\
+        .order_by(desc(models.Post.created_at), desc(models.Post.id)).limit(limit)
+    if after is not None:
+        timeline = timeline.where(tuple_(entry.created_at, entry.post_id) < tuple_(*after))
+        pulled = pulled.where(tuple_(models.Post.created_at, models.Post.id) < tuple_(*after))
+    # union drops pulled posts that are in the timeline too (backfilled on follow)
+    return union(timeline, pulled).subquery("feed")
@@ -0,0 +1,109 @@
+"""Trending posts ranking
+
+Score of post is the sum of its likes from the last trending_window, every like
+weighted by 0.5 ^ (like age / trending_half_life). Ranking over ratings is too
+expensive per request, so top trending_size posts are written into trending_posts
+table every trending_refresh_interval by background thread and GET /posts/trending
+only pages through that table.
+
+Usage: python -m app.trending - refresh once, e.g. from cron with interval set to 0
+"""
+import logging
+from datetime import timedelta
+from threading import Event, Thread
+from typing import Optional
+
+from sqlalchemy import select, insert, delete, desc, exists, extract, func, true
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import database, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# advisory lock of the refresh, only one worker recomputes ranking at a time
+REFRESH_LOCK = 7_310_023
+
+
+def refresh(db: Session, force: bool = False) -> bool:
+    """Recompute ranking in one transaction, readers see the previous one until commit
+
+    Skipped if another worker is refreshing or, unless forced,
+    ranking was refreshed during the last half of the interval
+
+    :param db: synchronous database session
+    :param force: refresh even if ranking is fresh
+    :return: True if ranking was recomputed
+    """
+    if not db.scalar(select(func.pg_try_advisory_xact_lock(REFRESH_LOCK))):
+        db.rollback()
+        return False
+    fresh_since = func.now() - timedelta(seconds=settings.trending_refresh_interval / 2)
+    if not force and db.scalar(select(exists().where(models.TrendingPost.refreshed_at > fresh_since))):
+        db.rollback()
+        return False
+    like_age = extract("epoch", func.now() - models.Rating.created_at)
+    score = func.sum(func.power(0.5, like_age / settings.trending_half_life))
+    ranking = select(models.Rating.post_id, score)\
+        .join(models.Post, models.Post.id == models.Rating.post_id)\
+        .where(models.Rating.created_at > func.now() - timedelta(seconds=settings.trending_window),
+               models.Post.published == true())\
+        .group_by(models.Rating.post_id)\
+        .order_by(desc(score), desc(models.Rating.post_id))\
+        .limit(settings.trending_size)
+    db.execute(delete(models.TrendingPost))
+    db.execute(insert(models.TrendingPost).from_select(["post_id", "score"], ranking))
+    db.commit()
+    return True
+
+
+class TrendingRefresher:
+    """Background thread refreshing ranking every trending_refresh_interval"""
+
+    def __init__(self):
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def refresh(self) -> None:
+        """Refresh ranking with own session, failure is logged and retried next interval"""
+        try:
+            with database.SessionLocal() as db:
+                refresh(db)
+        except SQLAlchemyError:
+            logger.exception("trending posts refresh failed")
+
+    def run(self) -> None:
+        """Refresh loop of background thread"""
+        while True:
+            self.refresh()
+            if self.stopped.wait(settings.trending_refresh_interval):
+                return
+
+    def start(self) -> None:
+        """Start periodic refresh, if enabled in settings"""
+        if settings.trending_refresh_interval > 0 and self.thread is None:
+            self.stopped.clear()
+            self.thread = Thread(target=self.run, name="trending-refresh", daemon=True)
+            self.thread.start()
+
+    async def stop(self) -> None:
+        """Stop periodic refresh"""
+        self.stopped.set()
+        if self.thread is not None:
+            await run_in_threadpool(self.thread.join)
+            self.thread = None
+
+
+trending_refresher = TrendingRefresher()
+
+
+def main() -> None:
+    with database.SessionLocal() as db:
+        refreshed = refresh(db, force=True)
+    print("trending posts are refreshed" if refreshed else "trending posts are being refreshed by another process")
+
+
+if __name__ == "__main__":
+    main()
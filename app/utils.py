@@ -1,9 +1,22 @@
 """Utilities module"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import status, HTTPException
 from passlib.context import CryptContext
 
+from .config import settings
+from .profiling import run_in_threadpool
+
 # declare hashing algorithm
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# separate processes for CPU heavy password hashing, created on first use
+password_executor: Optional[ProcessPoolExecutor] = None
+# amount of password jobs that are running or waiting for a worker
+password_jobs = 0
+
 
 def hash_password(password: str):
     """Hashes password with declared hashing algorithm
@@ -23,3 +36,58 @@ def verify_password(password: str, hashed_password: str) -> bool:
     :return: True if hashed password is the same, False otherwise
     """
     return pwd_context.verify(password, hashed_password)
+
+
+async def run_password_job(func: Callable, *args: Any) -> Any:
+    """Run password function outside the event loop
+
+    Jobs are sent to the process pool, so bcrypt can't stall
+    other requests of the worker. With full queue request is rejected
+    with 503 instead of piling up.
+
+    :param func: password function to run
+    :param args: function arguments
+    :return: function result
+    """
+    global password_executor, password_jobs
+    if password_jobs >= settings.password_queue_limit:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="server is busy, try again later",
+                            headers={"Retry-After": "1"})
+    password_jobs += 1
+    try:
+        # without workers fall back to the threadpool
+        if settings.password_workers <= 0:
+            return await run_in_threadpool(func, *args)
+        if password_executor is None:
+            password_executor = ProcessPoolExecutor(max_workers=settings.password_workers)
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    """Hash password in the password workers pool
+
+    :param password: password to hash
+    :return: hashed password
+    """
+    return await run_password_job(hash_password, password)
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    """Verify password in the password workers pool
+
+    :param password: password to verify
+    :param hashed_password: stored hashed password
+    :return: True if hashed password is the same, False otherwise
+    """
+    return await run_password_job(verify_password, password, hashed_password)
+
+
+def shutdown_password_executor() -> None:
+    """Stop password workers"""
+    global password_executor
+    if password_executor is not None:
+        password_executor.shutdown()
+        password_executor = None
@@ -0,0 +1,277 @@
+"""Write-behind buffer of single rates
+
+With rate_write_behind enabled POST /rate/ only validates the rate against the database
+and the buffer, queues it and answers 202. Buffered ratings are written by background
+task every rate_flush_interval in multi-row statements, like and unlike of the same post
+by the same user in between are coalesced and cost nothing.
+
+Every accepted rate is appended to the worker journal file before answering, so rates
+of crashed worker are replayed by the next started worker. Journal is compacted to
+not yet written rates after every flush. Ratings are written as final state
+(liked or not), so replaying already written rates changes nothing.
+"""
+import asyncio
+import fcntl
+import glob
+import logging
+import os
+import time
+from contextlib import aclosing
+from typing import IO, Optional
+
+from fastapi import status, HTTPException
+from sqlalchemy import Boolean, Integer, column, delete, func, literal, not_, select, true, tuple_, union_all, \
+    update, values
+from sqlalchemy.dialects.postgresql import insert
+
+from . import cache, database, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# (user_id, post_id) -> [rated in database before buffering (None if unknown), rated after]
+Ratings = dict[tuple[int, int], list[Optional[bool]]]
+
+
+class RatingBuffer:
+    """Pending ratings of the worker with their journal,
+    used only from the event loop
+    """
+
+    def __init__(self):
+        self.pending: Ratings = {}
+        self.flushing: Ratings = {}     # being written right now
+        self.journal: Optional[IO[str]] = None
+        self.stopped: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def rated(self, user_id: int, post_id: int, stored: bool) -> bool:
+        """Current rating state with buffered rates applied
+
+        :param user_id: rating user
+        :param post_id: rated post
+        :param stored: rating exists in the database
+        """
+        entry = self.pending.get((user_id, post_id)) or self.flushing.get((user_id, post_id))
+        return stored if entry is None else entry[1]
+
+    def add(self, user_id: int, post_id: int, rated: bool, previous: bool) -> None:
+        """Queue rate and save it into the journal
+
+        :param user_id: rating user
+        :param post_id: rated post
+        :param rated: True to like, False to remove like
+        :param previous: current rating state, see rated()
+        :raise HTTPException: 503 if buffer is full
+        """
+        key = (user_id, post_id)
+        if key not in self.pending and len(self.pending) >= settings.rate_buffer_size:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="server is busy, try again later",
+                                headers={"Retry-After": str(max(1, round(settings.rate_flush_interval)))})
+        self.write_journal([(user_id, post_id, rated)])
+        if key in self.pending:
+            self.pending[key][1] = rated
+        else:
+            self.pending[key] = [previous, rated]
+
+    def open_journal(self) -> IO[str]:
+        """New locked journal file of the worker, newer files have greater names"""
+        os.makedirs(settings.rate_journal_dir, exist_ok=True)
+        path = os.path.join(settings.rate_journal_dir, f"rates-{time.time_ns()}-{os.getpid()}.journal")
+        return open(path, "a", opener=create_locked)
+
+    def write_journal(self, rates: list[tuple[int, int, bool]], journal: Optional[IO[str]] = None) -> None:
+        """Append rates to the journal
+
+        :param rates: (user_id, post_id, rated) in order of arrival
+        :param journal: journal file, worker journal by default
+        """
+        if journal is None:
+            if self.journal is None:
+                self.journal = self.open_journal()
+            journal = self.journal
+        journal.write("".join(f"{user_id} {post_id} {int(rated)}\n" for user_id, post_id, rated in rates))
+        journal.flush()
+        if settings.rate_journal_fsync:
+            os.fsync(journal.fileno())
+
+    def compact_journal(self) -> None:
+        """Replace worker journal with rates that are not written yet,
+        old journal stays in use if the new one can't be written
+        """
+        journal = None
+        if self.pending:
+            journal = self.open_journal()
+            try:
+                self.write_journal([(user_id, post_id, entry[1]) for (user_id, post_id), entry in self.pending.items()],
+                                   journal)
+            except OSError:
+                os.remove(journal.name)
+                journal.close()
+                raise
+        old_journal, self.journal = self.journal, journal
+        if old_journal is not None:
+            try:
+                os.remove(old_journal.name)
+            finally:
+                old_journal.close()
+
+    def recover(self) -> int:
+        """Take over journals of stopped or crashed workers
+
+        :return: amount of recovered rates
+        """
+        recovered = []
+        for path in sorted(glob.glob(os.path.join(settings.rate_journal_dir, "rates-*.journal"))):
+            if self.journal is not None and path == self.journal.name:
+                continue
+            with open(path) as journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue    # journal of running worker
+                rates = []
+                for line in journal:
+                    fields = line.split()
+                    if len(fields) == 3:    # last line may be cut by crash
+                        rates.append((int(fields[0]), int(fields[1]), fields[2] == "1"))
+                # rates are in own journal before the old one is gone
+                self.write_journal(rates)
+                os.remove(path)
+                recovered += rates
+        for user_id, post_id, rated in recovered:
+            # state before is unknown, rate is written even if it changes nothing
+            self.pending.setdefault((user_id, post_id), [None, rated])[1] = rated
+        return len(recovered)
+
+    async def flush(self) -> int:
+        """Write pending ratings, failed ones stay in the buffer
+
+        :return: amount of written rates
+        """
+        if not self.pending:
+            return 0
+        self.flushing, self.pending = self.pending, {}
+        # like and unlike pairs leave rating as it was
+        rates = [(user_id, post_id, entry[1]) for (user_id, post_id), entry in self.flushing.items()
+                 if entry[0] != entry[1]]
+        try:
+            changed_post_ids = set()
+            if rates:
+                # session is closed on failure too
+                async with aclosing(database.open_session(database.SessionLocal, database.AsyncSessionLocal)) \
+                        as sessions:
+                    async for db in sessions:
+                        for start in range(0, len(rates), settings.rate_flush_batch):
+                            changed_post_ids.update((await db.execute(
+                                write_ratings(rates[start:start + settings.rate_flush_batch]))).scalars().all())
+                        await db.commit()
+        except Exception:   # noqa, database is not available, retry on the next flush
+            logger.exception("writing of %d buffered rates failed", len(rates))
+            for key, entry in self.flushing.items():
+                if key in self.pending:
+                    self.pending[key][0] = entry[0]     # newer rate was based on not written one
+                else:
+                    self.pending[key] = entry
+            return 0
+        finally:
+            self.flushing = {}
+        try:
+            self.compact_journal()
+        except OSError:
+            # written rates stay in the journal, their replay changes nothing
+            logger.exception("compaction of rates journal failed")
+        if changed_post_ids:
+            try:
+                await cache.invalidate_posts(*changed_post_ids)
+            except Exception:   # noqa, cached likes counters get fresh after cache ttl
+                logger.exception("cache invalidation of %d rated posts failed", len(changed_post_ids))
+        return len(rates)
+
+    async def run(self) -> None:
+        """Flush loop of background task, last flush is done after stop"""
+        while not self.stopped.is_set():
+            try:
+                await asyncio.wait_for(self.stopped.wait(), settings.rate_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:   # noqa, flushing goes on, not written rates are kept
+                logger.exception("flush of buffered rates failed")
+
+    async def start(self) -> None:
+        """Replay journals of stopped workers and start flushing"""
+        recovered = self.recover()
+        if recovered:
+            logger.warning("%d rates recovered from journals", recovered)
+        self.stopped = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop flushing after writing all pending rates,
+        not written ones stay in the journal for the next worker
+        """
+        if self.task is not None:
+            self.stopped.set()
+            await self.task
+            self.task = None
+        if self.journal is not None:
+            if self.pending:
+                self.journal.close()    # unlocked, so next worker takes it over
+            else:
+                self.compact_journal()
+            self.journal = None
+
+
+def create_locked(path: str, flags: int) -> int:
+    """Opener of journal files, file shows up under its name only when already locked,
+    so recovering workers never take over journal of running one
+
+    :param path: journal path
+    :param flags: open flags
+    :return: file descriptor
+    """
+    temp_path = path + ".tmp"   # not matched by journals recovery
+    fd = os.open(temp_path, flags | os.O_EXCL, 0o644)
+    try:
+        # lock tells other workers the journal is alive
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(temp_path, path)
+    except OSError:
+        os.close(fd)
+        os.remove(temp_path)
+        raise
+    return fd
+
+
+def write_ratings(rates: list[tuple[int, int, bool]]):
+    """Apply final rating states and likes counters in one statement
+
+    :param rates: (user_id, post_id, rated) with unique (user_id, post_id)
+    :return: statement returning ids of posts with changed likes
+    """
+    events = select(values(column("user_id", Integer), column("post_id", Integer), column("rated", Boolean),
+                           name="rates").data(rates)).cte("events")
+    # posts could be unpublished or removed since rate was accepted
+    likes = select(events.c.user_id, events.c.post_id)\
+        .join(models.Post, models.Post.id == events.c.post_id)\
+        .where(events.c.rated, models.Post.published == true(), models.Post.owner_id != events.c.user_id)
+    liked = insert(models.Rating).from_select(["user_id", "post_id"], likes).on_conflict_do_nothing()\
+        .returning(models.Rating.post_id).cte("liked")
+    unliked = delete(models.Rating)\
+        .where(tuple_(models.Rating.user_id, models.Rating.post_id)
+               .in_(select(events.c.user_id, events.c.post_id).where(not_(events.c.rated))))\
+        .returning(models.Rating.post_id).cte("unliked")
+    changes = union_all(select(liked.c.post_id, literal(1).label("change")),
+                        select(unliked.c.post_id, literal(-1).label("change"))).subquery("changes")
+    likes_change = select(changes.c.post_id, func.sum(changes.c.change).label("change"))\
+        .group_by(changes.c.post_id).subquery("likes_change")
+    return update(models.Post).where(models.Post.id == likes_change.c.post_id)\
+        .values(likes_count=models.Post.likes_count + likes_change.c.change)\
+        .returning(models.Post.id)\
+        .execution_options(synchronize_session=False)
+
+
+rating_buffer = RatingBuffer()
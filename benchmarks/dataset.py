@@ -0,0 +1,103 @@
+"""Deterministic synthetic dataset for load tests
+
+Usage: python -m benchmarks.dataset OUT_DIR [--users 1000] [--posts 10000] [--ratings 50000]
+                                            [--seed 42] [--skew 1.1]
+
+Writes users.ndjson, posts.ndjson and ratings.ndjson in app.bulk_import format:
+python -m app.bulk_import --users OUT_DIR/users.ndjson --posts OUT_DIR/posts.ndjson --ratings OUT_DIR/ratings.ndjson
+
+Popularity is Zipf distributed: few users own most of posts and few posts get most of likes.
+The same seed always gives the same files. Every user has PASSWORD.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from passlib.hash import bcrypt
+
+PASSWORD = "BenchPassword123!"
+EMAIL = "user{}@bench.test"
+# fixed salt keeps files reproducible, users are synthetic anyway
+PASSWORD_SALT = "benchmarkdatasetsaltbu"
+STARTED_AT = datetime(2022, 1, 1, tzinfo=timezone.utc)
+WORDS = ("tiger", "python", "coffee", "morning", "music", "travel", "code", "weekend", "movie", "garden",
+         "football", "recipe", "photo", "city", "book", "rain", "mountain", "idea", "friend", "news")
+
+
+def zipf_cum_weights(amount: int, skew: float) -> list[float]:
+    """Cumulative weights of ranks 1..amount, weight of rank is 1 / rank^skew"""
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, amount + 1)))
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    """Random sentence of given amount of words"""
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def generate(out_dir: str, users: int, posts: int, ratings: int, seed: int = 42, skew: float = 1.1) -> dict:
+    """Write users, posts and ratings files
+
+    :param out_dir: output directory
+    :param users: amount of users
+    :param posts: amount of posts
+    :param ratings: amount of ratings, less are written if there are not enough distinct pairs
+    :param seed: random seed
+    :param skew: Zipf exponent of users and posts popularity
+    :return: amount of written rows by file
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    password = bcrypt.using(salt=PASSWORD_SALT).hash(PASSWORD)
+    with open(os.path.join(out_dir, "users.ndjson"), "w") as file:
+        for user_id in range(1, users + 1):
+            file.write(json.dumps({"id": user_id, "email": EMAIL.format(user_id), "password": password}) + "\n")
+
+    # most active authors first
+    authors = rng.sample(range(1, users + 1), users)
+    owners = rng.choices(authors, cum_weights=zipf_cum_weights(users, skew), k=posts)
+    published, owner_of = [], {}
+    with open(os.path.join(out_dir, "posts.ndjson"), "w") as file:
+        for post_id, owner_id in enumerate(owners, start=1):
+            post = {"id": post_id, "owner_id": owner_id, "title": sentence(rng, rng.randint(2, 6)),
+                    "content": sentence(rng, rng.randint(5, 40)), "published": rng.random() < 0.9,
+                    "created_at": (STARTED_AT + timedelta(seconds=rng.randrange(365 * 24 * 3600))).isoformat()}
+            file.write(json.dumps(post) + "\n")
+            owner_of[post_id] = owner_id
+            if post["published"]:
+                published.append(post_id)
+
+    # only published foreign posts are rated, most popular posts first
+    rng.shuffle(published)
+    post_weights = zipf_cum_weights(len(published), skew)
+    rated = set()
+    with open(os.path.join(out_dir, "ratings.ndjson"), "w") as file:
+        for _ in range(ratings * 10):
+            if len(rated) >= ratings or not published:
+                break
+            post_id = rng.choices(published, cum_weights=post_weights)[0]
+            user_id = rng.randint(1, users)
+            if user_id == owner_of[post_id] or (user_id, post_id) in rated:
+                continue
+            rated.add((user_id, post_id))
+            file.write(json.dumps({"user_id": user_id, "post_id": post_id}) + "\n")
+    return {"users": users, "posts": posts, "ratings": len(rated)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="output directory")
+    parser.add_argument("--users", type=int, default=1000, help="amount of users")
+    parser.add_argument("--posts", type=int, default=10000, help="amount of posts")
+    parser.add_argument("--ratings", type=int, default=50000, help="amount of ratings")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of popularity")
+    args = parser.parse_args()
+    result = generate(args.out_dir, args.users, args.posts, args.ratings, args.seed, args.skew)
+    print(", ".join(f"{name}: {count}" for name, count in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Micro-benchmark of access token verification
+with and without decoded tokens cache
+
+Usage: python -m benchmarks.jwt_decode [--tokens 100] [--rounds 50]
+(JWT_ENCODE_KEY and JWT_ALGORITHM must be set as for the application)
+"""
+import argparse
+import timeit
+
+from app import oauth2
+
+
+def run(tokens: int, rounds: int) -> dict:
+    """Verify each token `rounds` times with cold and warm cache
+
+    :param tokens: amount of distinct tokens (clients)
+    :param rounds: amount of requests per token
+    :return: microseconds per verification for both modes
+    """
+    exception = Exception("invalid token")
+    access_tokens = [oauth2.create_access_token(data={"user_id": user_id}) for user_id in range(tokens)]
+
+    def verify_all() -> None:
+        for token in access_tokens:
+            oauth2.verify_access_token(token, exception)
+
+    def verify_uncached() -> None:
+        oauth2.token_cache.clear()
+        verify_all()
+
+    calls = tokens * rounds
+    uncached = timeit.timeit(verify_uncached, number=rounds)
+    oauth2.token_cache.clear()
+    verify_all()    # warm up cache
+    cached = timeit.timeit(verify_all, number=rounds)
+    return {"uncached_us": uncached / calls * 1e6,
+            "cached_us": cached / calls * 1e6,
+            "speedup": uncached / cached,
+            **oauth2.token_cache.stats()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=100, help="amount of distinct tokens")
+    parser.add_argument("--rounds", type=int, default=50, help="verifications per token")
+    args = parser.parse_args()
+    result = run(args.tokens, args.rounds)
+    print(f"uncached: {result['uncached_us']:.1f} us/token")
+    print(f"cached:   {result['cached_us']:.1f} us/token")
+    print(f"speedup:  {result['speedup']:.1f}x (hits: {result['hits']}, misses: {result['misses']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Concurrent load test of the hot endpoints
+
+Usage: python -m benchmarks.load [--url http://localhost:8000] [--users 100]
+                                 [--concurrency 16] [--requests 5000] [--seed 1]
+                                 [--output report.json] [--baseline baseline.json] [--tolerance 0.2]
+
+Runs against a server with data of benchmarks.dataset imported by app.bulk_import, e.g.:
+    python -m benchmarks.dataset bench-data
+    python -m app.bulk_import --users bench-data/users.ndjson --posts ... --ratings ...
+    DB_STATEMENTS_HEADER=true uvicorn app.main:app
+    python -m benchmarks.load --output baseline.json
+    ...change...
+    python -m benchmarks.load --baseline baseline.json
+
+Every worker logs in as a dataset user and sends a weighted mix of /posts/, /posts/{id},
+/posts/my and /rate/ requests, single posts and rated posts are chosen with Zipf skew.
+The report has latency percentiles, requests per second and database statements per request
+(X-DB-Statements header) of every endpoint. With baseline given, regressions over tolerance
+are printed and the exit code is 1.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+from .dataset import EMAIL, PASSWORD, zipf_cum_weights
+
+# endpoint -> share of requests
+MIX = {
+    "GET /posts/": 35,
+    "GET /posts/{id}": 35,
+    "GET /posts/my": 10,
+    "POST /rate/": 20,
+}
+LOGIN = "POST /login"
+
+
+class Sample:
+    """Single measured request"""
+    __slots__ = ("endpoint", "latency", "status", "statements")
+
+    def __init__(self, endpoint: str, latency: float, status: int, statements: Optional[int]):
+        self.endpoint = endpoint
+        self.latency = latency
+        self.status = status
+        self.statements = statements
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+class LoadTest:
+    """Workers sharing list of posts and collected samples"""
+
+    def __init__(self, url: str, users: int, requests_amount: int, concurrency: int, seed: int, skew: float):
+        self.url = url.rstrip("/")
+        self.users = users
+        self.requests_amount = requests_amount
+        self.concurrency = concurrency
+        self.seed = seed
+        self.skew = skew
+        self.samples: list[Sample] = []
+        self.lock = threading.Lock()
+        self.post_ids: list[int] = []
+        self.post_weights: list[float] = []
+
+    def send(self, session: requests.Session, endpoint: str, method: str, path: str, **kwargs) -> requests.Response:
+        """Send request and save its sample"""
+        started = time.perf_counter()
+        try:
+            res = session.request(method, self.url + path, **kwargs)
+        except requests.RequestException:
+            with self.lock:
+                self.samples.append(Sample(endpoint, time.perf_counter() - started, 0, None))
+            raise
+        latency = time.perf_counter() - started
+        statements = res.headers.get("X-DB-Statements")
+        with self.lock:
+            self.samples.append(Sample(endpoint, latency, res.status_code,
+                                       int(statements) if statements is not None else None))
+        return res
+
+    def login(self, session: requests.Session, user_id: int) -> None:
+        """Authorize session as dataset user"""
+        res = self.send(session, LOGIN, "POST", "/login",
+                        data={"username": EMAIL.format(user_id), "password": PASSWORD})
+        res.raise_for_status()
+        session.headers["Authorization"] = f"Bearer {res.json()['token']}"
+
+    def load_posts(self) -> None:
+        """Get published posts, most liked first, to pick skewed post ids"""
+        session = requests.Session()
+        self.login(session, 1)
+        res = session.get(self.url + "/posts/export", stream=True)
+        res.raise_for_status()
+        posts = [json.loads(line) for line in res.iter_lines() if line]
+        posts.sort(key=lambda post: -post["likes"])
+        self.post_ids = [post["Post"]["id"] for post in posts]
+        self.post_weights = zipf_cum_weights(len(self.post_ids), self.skew)
+        self.samples.clear()    # setup is not measured
+
+    def worker(self, number: int, amount: int) -> None:
+        """Log in and send mix of requests"""
+        rng = random.Random(self.seed * 1000 + number)
+        session = requests.Session()
+        self.login(session, rng.randint(1, self.users))
+        endpoints, weights = list(MIX), list(MIX.values())
+        for _ in range(amount):
+            endpoint = rng.choices(endpoints, weights)[0]
+            try:
+                if endpoint == "GET /posts/":
+                    self.send(session, endpoint, "GET", "/posts/", params={"limit": 10})
+                elif endpoint == "GET /posts/{id}":
+                    post_id = rng.choices(self.post_ids, cum_weights=self.post_weights)[0]
+                    self.send(session, endpoint, "GET", f"/posts/{post_id}")
+                elif endpoint == "GET /posts/my":
+                    self.send(session, endpoint, "GET", "/posts/my", params={"limit": 10})
+                else:
+                    post_id = rng.choices(self.post_ids, cum_weights=self.post_weights)[0]
+                    self.send(session, endpoint, "POST", "/rate/", json={"post_id": post_id, "dir": rng.randint(0, 1)})
+            except requests.RequestException:
+                pass    # saved as error sample
+
+    def run(self) -> dict:
+        """Run workers and build report"""
+        self.load_posts()
+        per_worker = [self.requests_amount // self.concurrency + (number < self.requests_amount % self.concurrency)
+                      for number in range(self.concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [executor.submit(self.worker, number, amount) for number, amount in enumerate(per_worker)]:
+                future.result()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, duration: float) -> dict:
+        """Statistics of collected samples by endpoint"""
+        endpoints = {}
+        for endpoint in [LOGIN, *MIX]:
+            samples = [sample for sample in self.samples if sample.endpoint == endpoint]
+            if not samples:
+                continue
+            latencies = sorted(sample.latency * 1000 for sample in samples)
+            statements = [sample.statements for sample in samples if sample.statements is not None]
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                # client errors like 409 on rating twice are expected answers
+                "errors": sum(1 for sample in samples if sample.status == 0 or sample.status >= 500),
+                "rps": len(samples) / duration,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "statements_per_request": sum(statements) / len(statements) if statements else None,
+            }
+        return {
+            "config": {"url": self.url, "users": self.users, "requests": self.requests_amount,
+                       "concurrency": self.concurrency, "seed": self.seed, "skew": self.skew},
+            "duration_s": duration,
+            "rps": len(self.samples) / duration,
+            "endpoints": endpoints,
+        }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Find endpoints that got slower or run more statements than in baseline
+
+    :param report: current report
+    :param baseline: stored report
+    :param tolerance: allowed relative change of latency, throughput and statements
+    :return: regression descriptions
+    """
+    regressions = []
+    for endpoint, current in report["endpoints"].items():
+        base = baseline["endpoints"].get(endpoint)
+        if base is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{endpoint} {metric}: {base[metric]:.1f} -> {current[metric]:.1f}")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint} rps: {base['rps']:.1f} -> {current['rps']:.1f}")
+        if None not in (current["statements_per_request"], base["statements_per_request"]) \
+                and current["statements_per_request"] > base["statements_per_request"] * (1 + tolerance):
+            regressions.append(f"{endpoint} statements per request: "
+                               f"{base['statements_per_request']:.2f} -> {current['statements_per_request']:.2f}")
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    """Print report as table"""
+    print(f"{'endpoint':<18}{'requests':>9}{'errors':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'stmts':>7}")
+    for endpoint, stats in report["endpoints"].items():
+        statements = stats["statements_per_request"]
+        print(f"{endpoint:<18}{stats['requests']:>9}{stats['errors']:>7}{stats['rps']:>9.1f}{stats['p50_ms']:>9.1f}"
+              f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{'-' if statements is None else f'{statements:.2f}':>7}")
+    print(f"total: {report['rps']:.1f} requests/s in {report['duration_s']:.1f} s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="server url")
+    parser.add_argument("--users", type=int, default=100, help="amount of dataset users to log in as")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel clients")
+    parser.add_argument("--requests", type=int, default=5000, help="amount of requests without logins")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of posts popularity")
+    parser.add_argument("--output", help="save JSON report to file")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    report = LoadTest(args.url, args.users, args.requests, args.concurrency, args.seed, args.skew).run()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
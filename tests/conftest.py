@@ -1,13 +1,17 @@
 """Pytest fixtures"""
+from contextlib import contextmanager
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
-from app import models
+from app import database, models, oauth2
 from app.main import app
 from app.config import settings
-from app.database import get_db, Base
+from app.database import get_db, Base, ThreadedSession, async_url, open_session
 from app.oauth2 import create_access_token
 
 
@@ -15,6 +19,9 @@ SQLALCHEMY_DB_URL = f"{settings.database}://{settings.db_user}:{settings.db_pass
                     f"@{settings.host}:{settings.port}/{settings.db_name}_test"
 engine = create_engine(SQLALCHEMY_DB_URL)
 TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# asyncpg connections belong to event loop of the request, so they are not pooled
+async_engine = create_async_engine(async_url(SQLALCHEMY_DB_URL), poolclass=NullPool)
+TestAsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 
 @pytest.fixture()
@@ -22,6 +29,8 @@ def db_session():
     """Initializing testing database for possible future manipulations"""
     Base.metadata.drop_all(bind=engine)  # drop all existing tables
     Base.metadata.create_all(bind=engine)  # create tables manually
+    oauth2.clear_user_cache()   # ids are reused by recreated tables
+    oauth2.token_cache.clear()
     db = TestSessionLocal()
     try:
         yield db
@@ -32,15 +41,54 @@ def db_session():
 @pytest.fixture()
 def client(db_session):
     """Initializing of fastapi test client"""
-    def override_get_db():
+    async def override_get_db():
         try:
-            yield db_session
+            yield ThreadedSession(db_session)
         finally:
             db_session.close()
     app.dependency_overrides[get_db] = override_get_db  # override database
     yield TestClient(app)
 
 
+@pytest.fixture()
+def async_client(db_session, monkeypatch):
+    """Fastapi test client of application serving requests with asyncpg and AsyncSession (db_async)"""
+    monkeypatch.setattr(settings, "db_async", True)
+    monkeypatch.setattr(database, "SessionLocal", TestSessionLocal)
+    monkeypatch.setattr(database, "AsyncSessionLocal", TestAsyncSessionLocal)
+
+    async def override_get_db():
+        async for db in open_session(TestSessionLocal, TestAsyncSessionLocal):
+            yield db
+    app.dependency_overrides[get_db] = override_get_db
+    yield TestClient(app)
+
+
+@pytest.fixture
+def statements():
+    """Collect SQL statements sent to the testing database"""
+    executed = []
+
+    def on_execute(conn, cursor, statement, *args):
+        executed.append(statement)
+    event.listen(engine, "before_cursor_execute", on_execute)
+    yield executed
+    event.remove(engine, "before_cursor_execute", on_execute)
+
+
+@pytest.fixture
+def assert_queries(statements):
+    """Assert amount of SQL statements sent to the testing database inside the block,
+    e.g. lazy loaded relationships of listed posts (with assert_queries(1): ...)
+    """
+    @contextmanager
+    def assert_queries_block(expected: int):
+        statements.clear()
+        yield statements
+        assert len(statements) == expected, "\n\n".join(statements)
+    return assert_queries_block
+
+
 @pytest.fixture
 def user(client):
     """Create user"""
@@ -0,0 +1,55 @@
+"""Administration query tests"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.config import settings
+from app.database import track_pool, TimedQueuePool
+from tests.conftest import SQLALCHEMY_DB_URL
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "AdminToken123")
+    return "AdminToken123"
+
+
+def test_admin_disabled(client):
+    res = client.get("/admin/pool", headers={"X-Admin-Token": "anything"})
+    assert res.status_code == 404
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "WrongToken"}])
+def test_admin_bad_token(client, admin_token, headers):
+    res = client.get("/admin/pool", headers=headers)
+    assert res.status_code == 403
+    assert res.json()["detail"] == "unauthorized action"
+
+
+def test_pool_stats(client, admin_token):
+    res = client.get("/admin/pool", headers={"X-Admin-Token": admin_token})
+    assert res.status_code == 200
+    stats = res.json()["sync"]
+    assert {"size", "checked_out", "idle", "overflow", "checkouts", "wait_avg_ms", "wait_max_ms"} <= set(stats)
+    assert stats["size"] == settings.db_pool_size
+
+
+def test_pool_tracking():
+    pool_engine = track_pool(create_engine(SQLALCHEMY_DB_URL, poolclass=TimedQueuePool, pool_size=1,
+                                           max_overflow=0, pool_timeout=0.1))
+    try:
+        with pool_engine.connect():
+            stats = pool_engine.pool.stats.snapshot(pool_engine.pool)
+            assert stats["checked_out"] == 1
+            # second checkout times out on exhausted pool
+            with pytest.raises(PoolTimeoutError):
+                pool_engine.connect()
+        stats = pool_engine.pool.stats.snapshot(pool_engine.pool)
+        assert stats["checked_out"] == 0
+        assert stats["idle"] == 1
+        assert stats["checkouts"] == 1
+        assert stats["connects"] == 1
+        assert stats["timeouts"] == 1
+        assert stats["wait_max_ms"] >= 100
+    finally:
+        pool_engine.dispose()
@@ -0,0 +1,236 @@
+"""Admission control and rate limits tests"""
+import asyncio
+import time
+
+import pytest
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.testclient import TestClient
+from starlette.middleware import Middleware
+
+from app.config import settings
+from app.main import app
+from app.middleware import AdmissionControlMiddleware, RateLimitMiddleware, request_class
+from app.oauth2 import create_access_token
+
+
+class SlowApp:
+    """Application answering requests only after they are released"""
+
+    def __init__(self):
+        self.released = asyncio.Event()
+        self.handled = 0
+
+    async def __call__(self, scope, receive, send):
+        self.handled += 1
+        await self.released.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def call(asgi_app, method: str = "GET", path: str = "/posts/") -> tuple[int, dict]:
+    """Send request to the application
+
+    :return: response status and headers
+    """
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {name.decode(): value.decode() for name, value in message["headers"]}
+    await asyncio.wait_for(asgi_app({"type": "http", "method": method, "path": path, "headers": [],
+                                     "client": ("testclient", 50000)}, receive, send), 5)
+    return response["status"], response["headers"]
+
+
+@pytest.fixture
+def admission_limits(monkeypatch):
+    """One request of every class at once, one waiting"""
+    for route_class in ("read", "write", "auth"):
+        monkeypatch.setattr(settings, f"admission_{route_class}_limit", 1)
+    monkeypatch.setattr(settings, "admission_queue_size", 1)
+    monkeypatch.setattr(settings, "admission_queue_timeout", 5)
+
+
+@pytest.fixture
+def rate_limit(monkeypatch):
+    """Two requests burst, then one request per 10 seconds"""
+    monkeypatch.setattr(settings, "request_rate_limit", 0.1)
+    monkeypatch.setattr(settings, "request_rate_burst", 2)
+
+
+@pytest.fixture
+def cors_limited_client(add_test_posts, rate_limit, monkeypatch):
+    """Client of application with rate limit registered like with REQUEST_RATE_LIMIT set,
+    test posts are added before, so their requests take no tokens
+    """
+    middleware = list(app.user_middleware)
+    middleware.insert([item.cls for item in middleware].index(AdmissionControlMiddleware),
+                      Middleware(RateLimitMiddleware))
+    monkeypatch.setattr(app, "user_middleware", middleware)
+    monkeypatch.setattr(app, "middleware_stack", app.build_middleware_stack())
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("method, path, route_class", [
+    ("GET", "/posts/", "read"),
+    ("HEAD", "/users/1", "read"),
+    ("POST", "/posts/", "write"),
+    ("DELETE", "/posts/1", "write"),
+    ("POST", "/login", "auth"),
+    ("POST", "/users/", "auth"),
+    ("GET", "/metrics", None),
+    ("DELETE", "/admin/cache", None),
+])
+def test_request_class(method, path, route_class):
+    assert request_class({"method": method, "path": path}) == route_class
+
+
+def test_admission_control_enabled():
+    assert AdmissionControlMiddleware in [middleware.cls for middleware in app.user_middleware]
+    assert RateLimitMiddleware not in [middleware.cls for middleware in app.user_middleware]
+
+
+def test_excess_requests_queued_and_shed(admission_limits):
+    slow_app = SlowApp()
+    middleware = AdmissionControlMiddleware(slow_app)
+
+    async def serve():
+        first = asyncio.create_task(call(middleware))
+        second = asyncio.create_task(call(middleware))
+        await asyncio.sleep(0.05)
+        # second request waits in the queue
+        assert slow_app.handled == 1
+        status, headers = await call(middleware)
+        assert status == 503
+        assert headers["retry-after"] == "1"
+        slow_app.released.set()
+        assert [(await first)[0], (await second)[0]] == [200, 200]
+        assert slow_app.handled == 2
+    asyncio.run(serve())
+    assert middleware.limits["read"].active == 0
+
+
+def test_retry_after_grows_with_queue(admission_limits, monkeypatch):
+    monkeypatch.setattr(settings, "admission_queue_size", 3)
+    middleware = AdmissionControlMiddleware(SlowApp())
+    middleware.limits["read"].observe(2.5)
+
+    async def serve():
+        tasks = [asyncio.create_task(call(middleware)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        status, headers = await call(middleware)
+        middleware.app.released.set()
+        await asyncio.gather(*tasks)
+        return status, headers
+    status, headers = asyncio.run(serve())
+    assert status == 503
+    # three queued requests and the rejected one, 2.5 seconds each
+    assert headers["retry-after"] == "10"
+
+
+def test_queue_timeout(admission_limits, monkeypatch):
+    monkeypatch.setattr(settings, "admission_queue_timeout", 0.05)
+    slow_app = SlowApp()
+    middleware = AdmissionControlMiddleware(slow_app)
+
+    async def serve():
+        first = asyncio.create_task(call(middleware, "POST"))
+        await asyncio.sleep(0.01)
+        assert (await call(middleware, "POST"))[0] == 503
+        slow_app.released.set()
+        await first
+    asyncio.run(serve())
+    assert not middleware.limits["write"].waiters
+    assert middleware.limits["write"].active == 0
+
+
+def test_route_classes_limited_separately(admission_limits):
+    slow_app = SlowApp()
+    middleware = AdmissionControlMiddleware(slow_app)
+
+    async def serve():
+        tasks = [asyncio.create_task(call(middleware, "POST", "/login")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert (await call(middleware, "POST", "/users/"))[0] == 503
+        # reads and operators endpoints are not affected by busy auth
+        reads = [asyncio.create_task(call(middleware)), asyncio.create_task(call(middleware, "GET", "/metrics"))]
+        await asyncio.sleep(0.05)
+        assert slow_app.handled == 3
+        slow_app.released.set()
+        await asyncio.gather(*tasks, *reads)
+    asyncio.run(serve())
+
+
+def test_unlimited_class(admission_limits, monkeypatch):
+    monkeypatch.setattr(settings, "admission_read_limit", 0)
+    slow_app = SlowApp()
+    middleware = AdmissionControlMiddleware(slow_app)
+
+    async def serve():
+        tasks = [asyncio.create_task(call(middleware)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert slow_app.handled == 5
+        slow_app.released.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(serve())
+
+
+def test_rate_limited_by_address(client, add_test_posts, rate_limit):
+    limited_client = TestClient(RateLimitMiddleware(app))
+    assert [limited_client.get("/posts/").status_code for _ in range(2)] == [200, 200]
+    res = limited_client.get("/posts/")
+    assert res.status_code == 429
+    assert res.json()["detail"] == "too many requests, try again later"
+    assert res.headers["Retry-After"] == "10"
+    # operators endpoints are not limited
+    assert limited_client.get("/metrics").status_code == 200
+
+
+def test_rate_limited_by_user(client, token, user2, rate_limit):
+    limited_app = RateLimitMiddleware(app)
+    user_client = TestClient(limited_app)
+    user_client.headers["Authorization"] = f"Bearer {token}"
+    for _ in range(2):
+        user_client.get("/posts/")
+    assert user_client.get("/posts/").status_code == 429
+    # other users and anonymous clients at the same address have own buckets
+    user2_client = TestClient(limited_app)
+    user2_client.headers["Authorization"] = f"Bearer {create_access_token(data={'user_id': user2['id']})}"
+    assert user2_client.get("/posts/").status_code == 200
+    assert TestClient(limited_app).get("/posts/").status_code == 200
+    # invalid token doesn't get own bucket
+    forged_client = TestClient(limited_app)
+    forged_client.headers["Authorization"] = "Bearer forged"
+    assert forged_client.get("/posts/").status_code == 200
+    assert forged_client.get("/posts/").status_code == 429
+
+
+def test_cors_outermost():
+    assert app.user_middleware[0].cls is CORSMiddleware
+
+
+def test_rejected_request_keeps_cors_headers(cors_limited_client):
+    origin = {"Origin": "https://example.com"}
+    preflight = {**origin, "Access-Control-Request-Method": "GET"}
+    # preflights take no tokens
+    for _ in range(3):
+        assert cors_limited_client.options("/posts/", headers=preflight).status_code == 200
+    assert [cors_limited_client.get("/posts/", headers=origin).status_code for _ in range(2)] == [200, 200]
+    res = cors_limited_client.get("/posts/", headers=origin)
+    assert res.status_code == 429
+    assert res.headers["Retry-After"] == "10"
+    assert res.headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_tokens_refilled(rate_limit, monkeypatch):
+    middleware = RateLimitMiddleware(SlowApp())
+    assert middleware.take(("client", "testclient")) == 0
+    assert middleware.take(("client", "testclient")) == 0
+    assert middleware.take(("client", "testclient")) == pytest.approx(10, abs=0.1)
+    monkeypatch.setattr(settings, "request_rate_limit", 1000)
+    time.sleep(0.01)
+    assert middleware.take(("client", "testclient")) == 0
@@ -0,0 +1,85 @@
+"""Requests served with asyncpg driver and AsyncSession (db_async)"""
+import pytest
+
+from app import trending
+from app.config import settings
+from app.oauth2 import create_access_token
+
+
+@pytest.fixture
+def async_users(async_client):
+    """Two signed up users with their authorization headers"""
+    users = []
+    for email in ("async1@gmail.com", "async2@gmail.com"):
+        res = async_client.post("/users/", json={"email": email, "password": "TestPassword123!"})
+        assert res.status_code == 201
+        token = create_access_token(data={"user_id": res.json()["id"]})
+        users.append({**res.json(), "headers": {"Authorization": f"Bearer {token}"}})
+    return users
+
+
+def test_users_and_login(async_client, async_users):
+    res = async_client.post("/login", data={"username": "async1@gmail.com", "password": "TestPassword123!"})
+    assert res.status_code == 200
+    headers = {"Authorization": f"Bearer {res.json()['token']}"}
+    res = async_client.get(f"/users/{async_users[1]['id']}", headers=headers)
+    assert res.status_code == 200
+    assert res.json()["email"] == "async2@gmail.com"
+    res = async_client.post("/login", data={"username": "async1@gmail.com", "password": "WrongPassword"})
+    assert res.status_code == 403
+
+
+def test_posts(async_client, async_users, statements):
+    author, reader = async_users[0]["headers"], async_users[1]["headers"]
+    res = async_client.post("/posts/", json={"title": "hello tigers", "content": "stripes"}, headers=author)
+    assert res.status_code == 201
+    # nothing goes through synchronous engine
+    assert statements == []
+    post_id = res.json()["id"]
+    res = async_client.post("/posts/bulk", json=[{"title": f"bulk {number}", "content": "c"} for number in range(3)],
+                            headers=author)
+    assert len(res.json()) == 3
+    # owners are loaded with posts, lazy loads would fail under asyncpg
+    res = async_client.get("/posts/", params={"limit": 2}, headers=reader)
+    assert [post["Post"]["owner"]["id"] for post in res.json()] == [async_users[0]["id"]] * 2
+    res = async_client.get("/posts/", params={"limit": 2, "cursor": res.headers["X-Next-Cursor"]}, headers=reader)
+    assert len(res.json()) == 2
+    assert async_client.get(f"/posts/{post_id}", headers=reader).json()["Post"]["title"] == "hello tigers"
+    assert async_client.get("/posts/latest").status_code == 200
+    assert async_client.get("/posts/search", params={"q": "tiger"}, headers=reader).json()[0]["Post"]["id"] == post_id
+    assert len(async_client.get("/posts/my", headers=author).json()) == 4
+    # export streams rows from server-side cursor
+    res = async_client.get("/posts/export", headers=reader)
+    assert res.status_code == 200
+    assert len(res.text.splitlines()) == 4
+    res = async_client.put(f"/posts/{post_id}", json={"title": "edited", "content": "c"}, headers=author)
+    assert res.json()["Post"]["title"] == "edited"
+    assert async_client.put(f"/posts/publish/{post_id}", headers=author).status_code == 200
+    assert async_client.get(f"/posts/{post_id}", headers=reader).status_code == 404
+    assert async_client.delete(f"/posts/{post_id}", headers=author).status_code == 204
+    assert async_client.delete(f"/posts/{post_id}", headers=author).status_code == 404
+
+
+def test_ratings(async_client, async_users, db_session):
+    author, reader = async_users[0]["headers"], async_users[1]["headers"]
+    post_id = async_client.post("/posts/", json={"title": "liked", "content": "c"}, headers=author).json()["id"]
+    assert async_client.post("/rate/", json={"post_id": post_id, "dir": 1}, headers=reader).status_code == 201
+    assert async_client.post("/rate/", json={"post_id": post_id, "dir": 1}, headers=reader).status_code == 409
+    assert async_client.get(f"/posts/{post_id}", headers=reader).json()["likes"] == 1
+    trending.refresh(db_session, force=True)
+    assert [post["Post"]["id"] for post in async_client.get("/posts/trending").json()] == [post_id]
+    assert async_client.post("/rate/", json={"post_id": post_id, "dir": 0}, headers=reader).status_code == 201
+    assert async_client.get(f"/posts/{post_id}", headers=reader).json()["likes"] == 0
+
+
+def test_follows_and_feed(async_client, async_users, monkeypatch):
+    author, reader = async_users[0]["headers"], async_users[1]["headers"]
+    old_id = async_client.post("/posts/", json={"title": "old", "content": "c"}, headers=author).json()["id"]
+    res = async_client.post("/follow/", json={"user_id": async_users[0]["id"], "dir": 1}, headers=reader)
+    assert res.status_code == 201
+    # fan-out runs after response with the request session
+    new_id = async_client.post("/posts/", json={"title": "new", "content": "c"}, headers=author).json()["id"]
+    monkeypatch.setattr(settings, "feed_fanout_limit", 0)
+    pulled_id = async_client.post("/posts/", json={"title": "pulled", "content": "c"}, headers=author).json()["id"]
+    res = async_client.get("/posts/feed", headers=reader)
+    assert [post["Post"]["id"] for post in res.json()] == [pulled_id, new_id, old_id]
@@ -0,0 +1,39 @@
+"""Benchmark tools tests"""
+from benchmarks import dataset, load
+from app import bulk_import, models
+from .conftest import engine
+
+
+def test_dataset_deterministic(tmp_path):
+    first = dataset.generate(str(tmp_path / "first"), users=20, posts=100, ratings=300, seed=7)
+    second = dataset.generate(str(tmp_path / "second"), users=20, posts=100, ratings=300, seed=7)
+    assert first == second == {"users": 20, "posts": 100, "ratings": 300}
+    for name in ("users.ndjson", "posts.ndjson", "ratings.ndjson"):
+        assert (tmp_path / "first" / name).read_bytes() == (tmp_path / "second" / name).read_bytes()
+
+
+def test_dataset_import(tmp_path, db_session, client):
+    dataset.generate(str(tmp_path), users=10, posts=50, ratings=100)
+    connection = engine.raw_connection()
+    try:
+        result = bulk_import.run_import(connection, str(tmp_path / "users.ndjson"), str(tmp_path / "posts.ndjson"),
+                                        str(tmp_path / "ratings.ndjson"))
+    finally:
+        connection.close()
+    assert result == {"users": 10, "posts": 50, "ratings": 100}
+    assert sum(post.likes_count for post in db_session.query(models.Post)) == 100
+    # popularity is skewed to few posts
+    assert max(post.likes_count for post in db_session.query(models.Post)) > 100 / 50 * 3
+    res = client.post("/login", data={"username": dataset.EMAIL.format(1), "password": dataset.PASSWORD})
+    assert res.status_code == 200
+
+
+def test_load_report_compare():
+    stats = {"requests": 10, "errors": 0, "rps": 100.0, "p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 30.0,
+             "statements_per_request": 1.0}
+    baseline = {"endpoints": {"GET /posts/": stats}}
+    assert load.compare({"endpoints": {"GET /posts/": {**stats, "p95_ms": 22.0}}}, baseline, 0.2) == []
+    regressions = load.compare({"endpoints": {"GET /posts/": {**stats, "p95_ms": 30.0, "statements_per_request": 2.0}}},
+                               baseline, 0.2)
+    assert regressions == ["GET /posts/ p95_ms: 20.0 -> 30.0", "GET /posts/ statements per request: 1.00 -> 2.00"]
+    assert load.percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
@@ -0,0 +1,72 @@
+"""Bulk import command tests"""
+import json
+
+import pytest
+
+from app import bulk_import, models, utils
+from .conftest import engine
+
+
+@pytest.fixture
+def connection(db_session):
+    connection = engine.raw_connection()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def import_files(tmp_path):
+    """Users and posts as NDJSON, ratings as CSV, with ids unrelated to database ids"""
+    users = tmp_path / "users.ndjson"
+    users.write_text("\n".join(json.dumps(user) for user in [
+        {"id": 101, "email": "first@import.com", "password": utils.hash_password("TestPassword123!")},
+        {"id": 102, "email": "second@import.com", "password": utils.hash_password("TestPassword123!")},
+    ]))
+    posts = tmp_path / "posts.ndjson"
+    posts.write_text("\n".join(json.dumps(post) for post in [
+        {"id": 201, "owner_id": 101, "title": "First\ttitle", "content": "Line\nbreak \\ slash"},
+        {"id": 202, "owner_id": 102, "title": "Draft", "content": "", "published": False},
+        {"id": 203, "owner_id": 999, "title": "Unknown owner", "content": "Skipped"},
+        # line of posts export
+        {"Post": {"id": 204, "title": "Exported", "content": "Post", "published": True,
+                  "created_at": "2022-04-01T20:30:40.231458+00:00", "owner": {"id": 102}}, "likes": 5},
+    ]))
+    ratings = tmp_path / "ratings.csv"
+    ratings.write_text("user_id,post_id\n102,201\n101,204\n102,204\n101,203\n")
+    return {"users": str(users), "posts": str(posts), "ratings": str(ratings)}
+
+
+def test_bulk_import(connection, import_files, db_session):
+    progress = []
+    result = bulk_import.run_import(connection, **import_files, batch_size=2,
+                                    progress=lambda *args: progress.append(args))
+    assert result == {"users": 2, "posts": 3, "ratings": 3}
+    assert progress[-1] == ("ratings", 4, 3)
+    posts = {post.title: post for post in db_session.query(models.Post)}
+    assert set(posts) == {"First\ttitle", "Draft", "Exported"}
+    assert posts["First\ttitle"].content == "Line\nbreak \\ slash"
+    assert posts["Draft"].content == "" and posts["Draft"].published is False
+    assert posts["Exported"].created_at.year == 2022
+    # foreign keys point to new ids, likes are counted from imported ratings
+    assert posts["First\ttitle"].owner.email == "first@import.com"
+    assert posts["Exported"].owner.email == "second@import.com"
+    assert (posts["First\ttitle"].likes_count, posts["Draft"].likes_count, posts["Exported"].likes_count) == (1, 0, 2)
+
+
+def test_bulk_import_existing_user(connection, import_files, client, user):
+    # user with the same email is reused and keeps its password
+    with open(import_files["users"], "a") as file:
+        file.write("\n" + json.dumps({"id": 103, "email": user["email"], "password": "not a hash"}))
+    result = bulk_import.run_import(connection, users=import_files["users"])
+    assert result["users"] == 2
+    res = client.post("/login", data={"username": user["email"], "password": user["password"]})
+    assert res.status_code == 200
+
+
+def test_bulk_import_hash_passwords(connection, tmp_path, client, monkeypatch):
+    monkeypatch.setattr(bulk_import.settings, "password_workers", 1)
+    users = tmp_path / "users.csv"
+    users.write_text("id,email,password\n1,plain@import.com,TestPassword123!\n")
+    assert bulk_import.run_import(connection, users=str(users), hash_passwords=True)["users"] == 1
+    res = client.post("/login", data={"username": "plain@import.com", "password": "TestPassword123!"})
+    assert res.status_code == 200
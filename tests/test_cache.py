@@ -0,0 +1,49 @@
+"""In-process cache tests"""
+import time
+
+from app.cache import TTLCache
+
+
+def test_cache_hit_miss():
+    cache = TTLCache(maxsize=2, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")      # "b" is least recently used now
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_cache_expiration():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    cache.set("b", 2, ttl=-1)       # already expired, not stored
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cache_disabled():
+    cache = TTLCache(maxsize=0, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_cache_pop_clear():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.pop("a")
+    cache.pop("missing")
+    assert cache.get("a") is None
+    cache.clear()
+    assert cache.stats() == {"size": 0, "hits": 0, "misses": 0}
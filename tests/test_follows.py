@@ -0,0 +1,214 @@
+"""Follows and home feed tests"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models
+from app.config import settings
+from app.main import app
+from app.oauth2 import create_access_token
+
+
+@pytest.fixture
+def user2_client(client, user2):
+    """Client authorized as second user"""
+    user2_client = TestClient(app)
+    user2_client.headers["Authorization"] = f"Bearer {create_access_token(data={'user_id': user2['id']})}"
+    return user2_client
+
+
+@pytest.fixture
+def followed_user2(authorized_client, user2):
+    res = authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 1})
+    assert res.status_code == 201
+
+
+@pytest.fixture
+def user2_post_id(add_test_posts, user2, db_session):
+    """Id of the published post of second user"""
+    return db_session.query(models.Post.id).filter_by(owner_id=user2["id"]).scalar()
+
+
+def feed_ids(client, **params) -> list[int]:
+    res = client.get("/posts/feed", params=params)
+    assert res.status_code == 200
+    return [post["Post"]["id"] for post in res.json()]
+
+
+def test_follow_user(authorized_client, user2, db_session):
+    res = authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 1})
+    assert res.status_code == 201
+    assert res.json()["detail"] == "user is followed"
+    assert db_session.get(models.User, user2["id"]).followers_count == 1
+
+
+def test_unfollow_user(authorized_client, user2, followed_user2, db_session):
+    res = authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 0})
+    assert res.status_code == 201
+    assert res.json()["detail"] == "user is unfollowed"
+    assert db_session.get(models.User, user2["id"]).followers_count == 0
+
+
+def test_follow_twice(authorized_client, user2, followed_user2):
+    res = authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 1})
+    assert res.status_code == 409
+    assert res.json()["detail"] == "user is already followed"
+
+
+def test_unfollow_not_followed(authorized_client, user2):
+    res = authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 0})
+    assert res.status_code == 404
+    assert res.json()["detail"] == "user is not followed"
+
+
+@pytest.mark.parametrize("direction", [0, 1])
+def test_follow_not_existing_user(authorized_client, direction):
+    res = authorized_client.post("/follow/", json={"user_id": 99999, "dir": direction})
+    assert res.status_code == 404
+    assert res.json()["detail"] == "user was not found (id: 99999)"
+
+
+def test_follow_yourself(authorized_client, user):
+    res = authorized_client.post("/follow/", json={"user_id": user["id"], "dir": 1})
+    assert res.status_code == 403
+
+
+def test_follow_unauthorized(client, user2):
+    res = client.post("/follow/", json={"user_id": user2["id"], "dir": 1})
+    assert res.status_code == 401
+
+
+def test_feed_backfilled_on_follow(authorized_client, user2_post_id, followed_user2):
+    assert feed_ids(authorized_client) == [user2_post_id]
+
+
+def test_feed_empty_without_follows(authorized_client, add_test_posts):
+    assert feed_ids(authorized_client) == []
+
+
+def test_feed_unauthorized(client):
+    assert client.get("/posts/feed").status_code == 401
+
+
+def test_new_posts_fanned_out(authorized_client, user2_client, user2_post_id, followed_user2, db_session):
+    created_id = user2_client.post("/posts/", json={"title": "fresh", "content": "news"}).json()["id"]
+    bulk_ids = [post["id"] for post in user2_client.post("/posts/bulk", json=[
+        {"title": "bulk", "content": "news"}, {"title": "hidden", "content": "news", "published": False}]).json()]
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=created_id).count() == 1
+    assert feed_ids(authorized_client) == [bulk_ids[0], created_id, user2_post_id]
+    # post is fanned out when it gets published
+    user2_client.put(f"/posts/publish/{bulk_ids[1]}")
+    assert feed_ids(authorized_client)[0] == bulk_ids[1]
+
+
+def test_post_published_by_update_fanned_out(authorized_client, user2_client, user2_post_id, followed_user2,
+                                             db_session):
+    hidden_id = user2_client.post("/posts/", json={"title": "hidden", "content": "news",
+                                                   "published": False}).json()["id"]
+    assert feed_ids(authorized_client) == [user2_post_id]
+    res = user2_client.put(f"/posts/{hidden_id}", json={"title": "shown", "content": "news", "published": True})
+    assert res.status_code == 200
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=hidden_id).count() == 1
+    assert feed_ids(authorized_client) == [hidden_id, user2_post_id]
+    # editing published post doesn't fan it out again
+    db_session.query(models.TimelineEntry).filter_by(post_id=hidden_id).delete()
+    db_session.commit()
+    user2_client.put(f"/posts/{hidden_id}", json={"title": "edited", "content": "news", "published": True})
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=hidden_id).count() == 0
+
+
+def test_unpublished_post_hidden_from_feed(authorized_client, user2_client, user2_post_id, followed_user2):
+    user2_client.put(f"/posts/publish/{user2_post_id}")
+    assert feed_ids(authorized_client) == []
+
+
+def test_deleted_post_removed_from_feed(authorized_client, user2_client, user2_post_id, followed_user2):
+    assert user2_client.delete(f"/posts/{user2_post_id}").status_code == 204
+    assert feed_ids(authorized_client) == []
+
+
+def test_unfollow_removes_posts_from_feed(authorized_client, user2, user2_post_id, followed_user2):
+    authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 0})
+    assert feed_ids(authorized_client) == []
+
+
+def test_fan_out_in_batches(authorized_client, user2_client, user2, user2_post_id, followed_user2, db_session,
+                            monkeypatch):
+    # more followers than one fan-out batch
+    followers = [models.User(email=f"follower{number}@gmail.com", password="hash") for number in range(4)]
+    db_session.add_all(followers)
+    db_session.flush()
+    db_session.add_all([models.Follow(follower_id=follower.id, followee_id=user2["id"]) for follower in followers])
+    db_session.query(models.User).filter_by(id=user2["id"]).update({"followers_count": 5})
+    db_session.commit()
+    monkeypatch.setattr(settings, "feed_fanout_batch", 2)
+    created_id = user2_client.post("/posts/", json={"title": "fresh", "content": "news"}).json()["id"]
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=created_id).count() == 5
+
+
+def test_celebrity_posts_pulled_at_read(authorized_client, user2_client, user2_post_id, followed_user2,
+                                        db_session, monkeypatch):
+    monkeypatch.setattr(settings, "feed_fanout_limit", 0)
+    created_id = user2_client.post("/posts/", json={"title": "fresh", "content": "news"}).json()["id"]
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=created_id).count() == 0
+    # fanned out before becoming celebrity and pulled posts are merged without duplicates
+    assert feed_ids(authorized_client) == [created_id, user2_post_id]
+
+
+def test_demoted_celebrity_posts_stay_in_feed(authorized_client, user2_client, user2_post_id, followed_user2,
+                                              db_session, monkeypatch):
+    monkeypatch.setattr(settings, "feed_fanout_limit", 0)
+    created_id = user2_client.post("/posts/", json={"title": "fresh", "content": "news"}).json()["id"]
+    assert db_session.get(models.Post, created_id).fanned_out is False
+    # author drops back under the limit, post is still pulled
+    monkeypatch.setattr(settings, "feed_fanout_limit", 10000)
+    assert feed_ids(authorized_client) == [created_id, user2_post_id]
+    newer_id = user2_client.post("/posts/", json={"title": "newer", "content": "news"}).json()["id"]
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=newer_id).count() == 1
+    assert feed_ids(authorized_client) == [newer_id, created_id, user2_post_id]
+
+
+def test_celebrity_status_decided_at_publish(authorized_client, user2_client, user2_post_id, followed_user2,
+                                             db_session, monkeypatch):
+    hidden_id = user2_client.post("/posts/", json={"title": "hidden", "content": "news",
+                                                   "published": False}).json()["id"]
+    monkeypatch.setattr(settings, "feed_fanout_limit", 0)
+    user2_client.put(f"/posts/publish/{hidden_id}")
+    assert db_session.query(models.TimelineEntry).filter_by(post_id=hidden_id).count() == 0
+    monkeypatch.setattr(settings, "feed_fanout_limit", 10000)
+    assert feed_ids(authorized_client) == [hidden_id, user2_post_id]
+
+
+def test_follow_celebrity_backfills_fanned_out_posts(authorized_client, user2_client, user2, user2_post_id,
+                                                     monkeypatch):
+    # post published before author became a celebrity
+    monkeypatch.setattr(settings, "feed_fanout_limit", 0)
+    created_id = user2_client.post("/posts/", json={"title": "fresh", "content": "news"}).json()["id"]
+    authorized_client.post("/follow/", json={"user_id": user2["id"], "dir": 1})
+    assert feed_ids(authorized_client) == [created_id, user2_post_id]
+
+
+def test_feed_cursor(authorized_client, user2_client, user2_post_id, followed_user2, monkeypatch):
+    user2_client.post("/posts/bulk", json=[{"title": f"post {number}", "content": "news"} for number in range(3)])
+    expected = feed_ids(authorized_client)
+    assert len(expected) == 4
+    pages, cursor = [], None
+    while True:
+        res = authorized_client.get("/posts/feed", params={"limit": 3, **({"cursor": cursor} if cursor else {})})
+        pages += [post["Post"]["id"] for post in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert pages == expected
+    # celebrity pull is paged the same way
+    monkeypatch.setattr(settings, "feed_fanout_limit", 0)
+    res = authorized_client.get("/posts/feed", params={"limit": 3})
+    res = authorized_client.get("/posts/feed", params={"limit": 3, "cursor": res.headers["X-Next-Cursor"]})
+    assert [post["Post"]["id"] for post in res.json()] == expected[3:]
+
+
+def test_feed_single_statement(authorized_client, user2, user2_post_id, followed_user2, db_session, assert_queries):
+    authorized_client.get("/posts/feed")   # authorization is cached
+    db_session.expunge_all()
+    with assert_queries(1):
+        res = authorized_client.get("/posts/feed")
+    assert res.json()[0]["Post"]["owner"]["id"] == user2["id"]
@@ -1,4 +1,5 @@
 """Global tests"""
+from app.config import settings
 
 
 def test_root(client):
@@ -6,3 +7,11 @@ def test_root(client):
     res = client.get("/")
     assert res.status_code == 200
     assert res.json().get("message") == "Hello there :) Available queries -> /posts /users /rate"
+
+
+def test_db_statements_header(authorized_client, add_test_posts, monkeypatch):
+    assert "X-DB-Statements" not in authorized_client.get("/posts/").headers
+    monkeypatch.setattr(settings, "db_statements_header", True)
+    authorized_client.get("/posts/my")     # cache verified user
+    assert authorized_client.get("/posts/my").headers["X-DB-Statements"] == "1"
+    assert authorized_client.get("/").headers["X-DB-Statements"] == "0"
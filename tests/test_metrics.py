@@ -0,0 +1,53 @@
+"""Prometheus metrics tests"""
+from prometheus_client import REGISTRY
+
+from app import metrics
+from app.config import settings
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_route_template(authorized_client, add_test_posts):
+    post_id = add_test_posts[0].id
+    labels = {"method": "GET", "route": "/posts/{id_}"}
+    requests = sample("http_request_duration_seconds_count", status="200", **labels)
+    statements = sample("http_request_db_statements_sum", **labels)
+    authorized_client.get(f"/posts/{post_id}")
+    authorized_client.get(f"/posts/{post_id}")
+    # same route with different ids is one metric
+    assert sample("http_request_duration_seconds_count", status="200", **labels) == requests + 2
+    assert sample("http_request_db_statements_sum", **labels) > statements
+    assert sample("http_request_db_duration_seconds_count", **labels) >= 2
+    authorized_client.get("/posts/99999")
+    assert sample("http_request_duration_seconds_count", status="404", **labels) >= 1
+
+
+def test_metrics_unmatched_route(client):
+    requests = sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404")
+    client.get("/not/existing/path")
+    assert sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404") \
+        == requests + 1
+
+
+def test_metrics_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_enabled", False)
+    requests = sample("http_request_duration_seconds_count", method="GET", route="/", status="200")
+    client.get("/")
+    assert sample("http_request_duration_seconds_count", method="GET", route="/", status="200") == requests
+
+
+def test_metrics_endpoint(client):
+    client.get("/")
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="200"}' in res.text
+    assert "db_pool_wait_seconds_bucket" in res.text
+
+
+def test_metrics_multiprocess(client, tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    # only metrics written by workers into shared directory are exposed
+    assert metrics.render() == b""
@@ -1,7 +1,10 @@
 """Posts query tests"""
 import pytest
+import orjson
+from fastapi.encoders import jsonable_encoder
 
-from app import schemas
+from app import schemas, models
+from app.config import settings
 
 
 def test_get_all_posts(authorized_client, add_test_posts):
@@ -11,6 +14,74 @@ def test_get_all_posts(authorized_client, add_test_posts):
     assert_schema = [schemas.PostResponse(**post) for post in res.json()]
 
 
+def test_get_all_posts_same_as_schema(authorized_client, add_test_posts, db_session):
+    res = authorized_client.get("/posts/")
+    rows = db_session.query(models.Post, models.Post.likes_count.label("likes"))\
+        .order_by(models.Post.id.desc()).all()
+    # fast path output is the same as output of pydantic response model
+    assert res.json() == [jsonable_encoder(schemas.PostResponse.from_orm(row)) for row in rows]
+    assert list(res.json()[0]["Post"]) == list(schemas.Post.__fields__)
+    assert list(res.json()[0]["Post"]["owner"]) == list(schemas.UserResponse.__fields__)
+
+
+def test_get_all_posts_skip(authorized_client, add_test_posts):
+    res = authorized_client.get("/posts/", params={"limit": 2, "skip": 1})
+    assert res.status_code == 200
+    assert [post["Post"]["id"] for post in res.json()] == [3, 2]
+
+
+def test_get_all_posts_cursor(authorized_client, add_test_posts):
+    res = authorized_client.get("/posts/", params={"limit": 3})
+    assert res.status_code == 200
+    first_page = [post["Post"]["id"] for post in res.json()]
+    cursor = res.headers["X-Next-Cursor"]
+    res = authorized_client.get("/posts/", params={"limit": 3, "cursor": cursor})
+    assert res.status_code == 200
+    second_page = [post["Post"]["id"] for post in res.json()]
+    assert "X-Next-Cursor" not in res.headers       # last page
+    assert first_page + second_page == [4, 3, 2, 1]
+
+
+def test_get_my_posts_cursor(authorized_client, user, add_test_posts):
+    res = authorized_client.get("/posts/my", params={"limit": 2})
+    assert [post["Post"]["id"] for post in res.json()] == [3, 2]
+    res = authorized_client.get("/posts/my", params={"limit": 2, "cursor": res.headers["X-Next-Cursor"]})
+    assert [post["Post"]["id"] for post in res.json()] == [1]
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "WzFd", "W10"])
+def test_get_posts_invalid_cursor(authorized_client, add_test_posts, cursor):
+    res = authorized_client.get("/posts/", params={"cursor": cursor})
+    assert res.status_code == 400
+    assert res.json()["detail"] == "invalid cursor"
+
+
+def test_search_posts(client, add_test_posts):
+    res = client.get("/posts/search", params={"q": "tiger"})
+    assert res.status_code == 200
+    assert [post["Post"]["title"] for post in res.json()] == ["I love tigers"]
+
+
+def test_search_posts_title_ranked_first(client, add_test_posts):
+    res = client.get("/posts/search", params={"q": "second"})
+    assert res.status_code == 200
+    # title match outranks content match
+    assert [post["Post"]["id"] for post in res.json()] == [4, 2]
+
+
+def test_search_posts_cursor(client, add_test_posts):
+    res = client.get("/posts/search", params={"q": "stuff", "limit": 1})
+    found = [post["Post"]["id"] for post in res.json()]
+    res = client.get("/posts/search", params={"q": "stuff", "limit": 1, "cursor": res.headers["X-Next-Cursor"]})
+    found += [post["Post"]["id"] for post in res.json()]
+    assert sorted(found) == [1, 2]
+
+
+def test_search_posts_empty_query(client, add_test_posts):
+    res = client.get("/posts/search", params={"q": ""})
+    assert res.status_code == 422
+
+
 def test_get_my_posts(authorized_client, user, add_test_posts):
     res = authorized_client.get("/posts/my")
     assert res.status_code == 200
@@ -184,3 +255,133 @@ def test_update_not_existing_post(authorized_client, add_test_posts, post_id):
                                                            "published": False})
     assert res.status_code == 404
     assert res.json()["detail"] == f"post was not found (id: {post_id})"
+
+
+@pytest.mark.parametrize("method, path", [("put", "/posts/publish/{}"), ("delete", "/posts/{}")])
+def test_post_write_single_statement(authorized_client, add_test_posts, statements, method, path):
+    post_id = add_test_posts[0].id
+    authorized_client.get("/posts/my")     # cache verified user
+    statements.clear()
+    res = getattr(authorized_client, method)(path.format(post_id))
+    assert res.status_code in (200, 204)
+    assert len(statements) == 1
+
+
+def test_update_post_single_statement(authorized_client, add_test_posts, statements):
+    post_id, owner_id = add_test_posts[0].id, add_test_posts[0].owner_id
+    authorized_client.get("/posts/my")
+    statements.clear()
+    res = authorized_client.put(f"/posts/{post_id}", json={"title": "New title", "content": "New content"})
+    assert res.status_code == 200
+    assert res.json()["Post"]["owner"]["id"] == owner_id
+    assert len(statements) == 1
+
+
+def test_create_post_single_statement(authorized_client, add_test_posts, statements):
+    authorized_client.get("/posts/my")
+    statements.clear()
+    res = authorized_client.post("/posts/", json={"title": "New title", "content": "New content"})
+    assert res.status_code == 201
+    assert len(statements) == 1
+
+
+def test_foreign_post_write_probe(authorized_client, add_test_posts, statements):
+    post_id = add_test_posts[3].id
+    authorized_client.get("/posts/my")
+    statements.clear()
+    res = authorized_client.delete(f"/posts/{post_id}")
+    assert res.status_code == 403
+    # failed write is followed only by the ownership check
+    assert len(statements) == 2
+
+
+def test_create_posts_bulk(authorized_client, user, add_test_posts, statements):
+    posts = [{"title": f"Bulk title {i}", "content": f"Bulk content {i}", "published": i % 2 == 0}
+             for i in range(5)]
+    authorized_client.get("/posts/my")     # cache verified user
+    statements.clear()
+    res = authorized_client.post("/posts/bulk", json=posts)
+    assert res.status_code == 201
+    created_posts = [schemas.Post(**post) for post in res.json()]
+    assert [post.title for post in created_posts] == [post["title"] for post in posts]
+    assert [post.published for post in created_posts] == [post["published"] for post in posts]
+    assert all(post.owner.id == user["id"] for post in created_posts)
+    assert len(statements) == 1
+
+
+def test_create_posts_bulk_empty(authorized_client, add_test_posts):
+    res = authorized_client.post("/posts/bulk", json=[])
+    assert res.status_code == 201
+    assert res.json() == []
+
+
+def test_create_posts_bulk_too_large(authorized_client, add_test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_post_limit", 2)
+    res = authorized_client.post("/posts/bulk", json=[{"title": "Title", "content": "Content"}] * 3)
+    assert res.status_code == 422
+
+
+def test_create_posts_bulk_unauthorized(client, add_test_posts):
+    res = client.post("/posts/bulk", json=[{"title": "Title", "content": "Content"}])
+    assert res.status_code == 401
+
+
+@pytest.mark.parametrize("path", ["/posts/", "/posts/my", "/posts/search?q=post"])
+def test_get_posts_limit_capped(authorized_client, add_test_posts, path):
+    res = authorized_client.get(path, params={"limit": settings.max_page_size + 1})
+    assert res.status_code == 422
+
+
+def test_export_posts(authorized_client, add_test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "export_batch_size", 2)     # several partitions
+    published_ids = sorted(post.id for post in add_test_posts if post.published)
+    res = authorized_client.get("/posts/export")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    posts = [schemas.PostResponse(**orjson.loads(line)) for line in res.content.splitlines()]
+    assert [post.Post.id for post in posts] == published_ids
+    assert all(post.likes == 0 for post in posts)
+
+
+def test_export_posts_unauthorized(client, add_test_posts):
+    res = client.get("/posts/export")
+    assert res.status_code == 401
+
+
+@pytest.fixture
+def posts_of_many_owners(user, db_session):
+    """Published posts of different owners"""
+    owners = [models.User(email=f"owner{number}@gmail.com", password="hashed") for number in range(5)]
+    db_session.add_all(owners)
+    db_session.flush()
+    db_session.add_all([models.Post(title=f"Owner {owner.id} post", content="Post content", owner_id=owner.id)
+                        for owner in owners for _ in range(2)])
+    db_session.commit()
+
+
+@pytest.mark.parametrize("path", ["/posts/?limit=20", "/posts/search?q=post&limit=20", "/posts/latest",
+                                  "/posts/export"])
+def test_posts_owners_loaded_with_posts(authorized_client, posts_of_many_owners, db_session, assert_queries, path):
+    authorized_client.get("/posts/my")     # cache verified user
+    db_session.expunge_all()    # requests share the session, owners must not be taken from it
+    with assert_queries(1):
+        res = authorized_client.get(path)
+    assert res.status_code == 200
+    assert "owner" in res.text
+
+
+def test_my_posts_owner_loaded_with_posts(authorized_client, add_test_posts, db_session, assert_queries):
+    authorized_client.get("/posts/my")
+    db_session.expunge_all()
+    with assert_queries(1):
+        res = authorized_client.get("/posts/my")
+    assert len(res.json()) == 3
+
+
+def test_post_by_id_owner_loaded_with_post(authorized_client, posts_of_many_owners, db_session, assert_queries):
+    post_id = db_session.query(models.Post.id).first().id
+    authorized_client.get("/posts/my")
+    db_session.expunge_all()
+    with assert_queries(1):
+        res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["Post"]["owner"]["id"]
@@ -0,0 +1,72 @@
+"""Request profiling tests"""
+import pstats
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app
+from app.middleware import ProfilingMiddleware
+
+
+@pytest.fixture
+def admin_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "admin_token", "AdminToken123")
+    monkeypatch.setattr(settings, "profiling_dir", str(tmp_path))
+    return "AdminToken123"
+
+
+@pytest.fixture
+def profiling_client(client, token):
+    """Client of application with profiling middleware"""
+    profiling_client = TestClient(ProfilingMiddleware(app))
+    profiling_client.headers["Authorization"] = f"Bearer {token}"
+    return profiling_client
+
+
+def test_profiling_disabled_by_default():
+    assert ProfilingMiddleware not in [middleware.cls for middleware in app.user_middleware]
+
+
+@pytest.mark.parametrize("path, headers", [("/posts/", {"X-Profile": "1"}), ("/posts/?profile=1", {})])
+def test_profile_request(profiling_client, add_test_posts, admin_token, tmp_path, path, headers):
+    res = profiling_client.get(path, headers={"X-Admin-Token": admin_token, **headers})
+    assert res.status_code == 200
+    assert len(res.json()) == len(add_test_posts)
+    name = res.headers["X-Profile-Report"]
+    assert pstats.Stats(str(tmp_path / f"{name}.prof")).total_calls > 0
+    report = (tmp_path / f"{name}.txt").read_text()
+    assert "get_posts" in report
+    assert "Allocations by line:" in report
+
+
+def test_profile_includes_threadpool_calls(profiling_client, add_test_posts, admin_token, tmp_path):
+    res = profiling_client.get("/posts/", headers={"X-Admin-Token": admin_token, "X-Profile": "1"})
+    name = res.headers["X-Profile-Report"]
+    # statements of synchronous session are executed in the threadpool
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / f"{name}.prof")).stats}
+    assert "do_execute" in functions
+    report = (tmp_path / f"{name}.txt").read_text()
+    assert "other requests on the event loop meanwhile: 0" in report
+
+
+@pytest.mark.parametrize("headers", [{"X-Profile": "1"}, {"X-Profile": "1", "X-Admin-Token": "WrongToken"}])
+def test_profile_request_unauthorized(profiling_client, add_test_posts, admin_token, tmp_path, headers):
+    res = profiling_client.get("/posts/", headers=headers)
+    assert res.status_code == 200
+    assert "X-Profile-Report" not in res.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_reports(profiling_client, add_test_posts, admin_token):
+    admin_headers = {"X-Admin-Token": admin_token}
+    name = profiling_client.get("/posts/", headers={"X-Profile": "1", **admin_headers}).headers["X-Profile-Report"]
+    res = profiling_client.get("/admin/profiles", headers=admin_headers)
+    assert res.json() == [f"{name}.txt", f"{name}.prof"]
+    res = profiling_client.get(f"/admin/profiles/{name}.txt", headers=admin_headers)
+    assert res.status_code == 200
+    assert res.text.startswith(name)
+    res = profiling_client.get("/admin/profiles/missing.txt", headers=admin_headers)
+    assert res.status_code == 404
+    res = profiling_client.get(f"/admin/profiles/{name}.txt")
+    assert res.status_code == 403
@@ -2,12 +2,14 @@
 import pytest
 
 from app import models
+from app.config import settings
 
 
 @pytest.fixture
 def rated_post(add_test_posts, db_session, user):
     new_vote = models.Rating(user_id=user["id"], post_id=add_test_posts[-1].id)
     db_session.add(new_vote)
+    add_test_posts[-1].likes_count += 1
     db_session.commit()
 
 
@@ -26,6 +28,14 @@ def test_rate_post(authorized_client, add_test_posts):
     assert res.json()["detail"] == "rating is saved"
 
 
+def test_rate_post_likes_count(authorized_client, add_test_posts):
+    post_id = add_test_posts[-1].id
+    authorized_client.post("/rate/", json={"post_id": post_id, "dir": 1})
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+    authorized_client.post("/rate/", json={"post_id": post_id, "dir": 0})
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
+
+
 def test_rate_post_twice(authorized_client, add_test_posts, rated_post):
     res = authorized_client.post("/rate/", json={"post_id": add_test_posts[-1].id,
                                                  "dir": 1})
@@ -53,10 +63,12 @@ def test_rate_not_existing_post(authorized_client, add_test_posts, post_id, dire
 
 
 def test_remove_post_rating(authorized_client, add_test_posts, rated_post):
-    res = authorized_client.post("/rate/", json={"post_id": add_test_posts[-1].id,
+    post_id = add_test_posts[-1].id
+    res = authorized_client.post("/rate/", json={"post_id": post_id,
                                                  "dir": 0})
     assert res.status_code == 201
     assert res.json()["detail"] == f"rating is saved"
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
 
 
 def test_remove_not_existing_rating(authorized_client, add_test_posts):
@@ -64,3 +76,70 @@ def test_remove_not_existing_rating(authorized_client, add_test_posts):
                                                  "dir": 0})
     assert res.status_code == 404
     assert res.json()["detail"] == f"rating does not exist"
+
+
+def test_rate_posts_batch(authorized_client, add_test_posts, db_session, rated_post):
+    res = authorized_client.post("/rate/batch", json=[{"post_id": 4, "dir": 0},
+                                                      {"post_id": 1, "dir": 1},
+                                                      {"post_id": 99, "dir": 1}])
+    assert res.status_code == 200
+    assert res.json() == [
+        {"post_id": 4, "status_code": 201, "detail": "rating is saved"},
+        {"post_id": 1, "status_code": 403, "detail": "you can't rate your own post"},
+        {"post_id": 99, "status_code": 404, "detail": "post was not found (id: 99)"},
+    ]
+    assert authorized_client.get("/posts/4").json()["likes"] == 0
+
+
+def test_rate_posts_batch_conflicts(authorized_client, add_test_posts, db_session, user2, rated_post):
+    post = models.Post(title="Another post", content="Of second user", owner_id=user2["id"])
+    db_session.add(post)
+    db_session.commit()
+    res = authorized_client.post("/rate/batch", json=[{"post_id": 4, "dir": 1},
+                                                      {"post_id": 5, "dir": 1}])
+    assert [item["status_code"] for item in res.json()] == [409, 201]
+    res = authorized_client.post("/rate/batch", json=[{"post_id": 5, "dir": 0},
+                                                      {"post_id": 4, "dir": 0}])
+    assert [item["status_code"] for item in res.json()] == [201, 201]
+    res = authorized_client.post("/rate/batch", json=[{"post_id": 5, "dir": 0}])
+    assert res.json()[0] == {"post_id": 5, "status_code": 404, "detail": "rating does not exist"}
+    assert authorized_client.get("/posts/4").json()["likes"] == 0
+    assert authorized_client.get("/posts/5").json()["likes"] == 0
+
+
+def test_rate_posts_batch_duplicates(authorized_client, add_test_posts):
+    res = authorized_client.post("/rate/batch", json=[{"post_id": 4, "dir": 1}, {"post_id": 4, "dir": 0}])
+    assert res.status_code == 422
+    assert res.json()["detail"] == "post can be rated only once in batch"
+
+
+def test_rate_posts_batch_too_large(authorized_client, add_test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "rate_batch_limit", 1)
+    res = authorized_client.post("/rate/batch", json=[{"post_id": 4, "dir": 1}, {"post_id": 3, "dir": 1}])
+    assert res.status_code == 422
+
+
+def test_rate_posts_batch_unauthorized(client, add_test_posts):
+    res = client.post("/rate/batch", json=[{"post_id": 4, "dir": 1}])
+    assert res.status_code == 401
+
+
+@pytest.mark.parametrize("direction", [1, 0])
+def test_rate_post_single_statement(authorized_client, add_test_posts, statements, direction):
+    post_id = add_test_posts[-1].id
+    if direction == 0:
+        authorized_client.post("/rate/", json={"post_id": post_id, "dir": 1})
+    authorized_client.get("/posts/my")     # cache verified user
+    statements.clear()
+    res = authorized_client.post("/rate/", json={"post_id": post_id, "dir": direction})
+    assert res.status_code == 201
+    assert len(statements) == 1
+
+
+def test_rate_post_twice_probe(authorized_client, add_test_posts, rated_post, statements):
+    post_id = add_test_posts[-1].id
+    authorized_client.get("/posts/my")     # cache verified user
+    statements.clear()
+    res = authorized_client.post("/rate/", json={"post_id": post_id, "dir": 1})
+    assert res.status_code == 409
+    assert len(statements) == 2
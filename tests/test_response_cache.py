@@ -0,0 +1,88 @@
+"""Response cache tests"""
+import pytest
+
+from app import cache
+from app.cache import MemoryCacheBackend, RedisCacheBackend
+
+
+class FakeRedis:
+    """Local stand-in for asynchronous Redis client"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def response_cache(request, monkeypatch):
+    backend = MemoryCacheBackend(maxsize=100, ttl=60) if request.param == "memory" \
+        else RedisCacheBackend(FakeRedis())
+    monkeypatch.setattr(cache, "response_cache", backend)
+    return backend
+
+
+def test_first_page_cached(authorized_client, add_test_posts, response_cache):
+    res = authorized_client.get("/posts/", params={"limit": 2})
+    assert [post["Post"]["id"] for post in res.json()] == [4, 3]
+    assert "X-Next-Cursor" in res.headers
+    # shorter and longer pages are served by the same entry
+    assert len(authorized_client.get("/posts/", params={"limit": 10}).json()) == 4
+    res = authorized_client.get("/posts/", params={"limit": 2, "cursor": res.headers["X-Next-Cursor"]})
+    assert [post["Post"]["id"] for post in res.json()] == [2, 1]
+
+
+def test_cached_responses_same_as_uncached(authorized_client, add_test_posts, response_cache):
+    for url in ("/posts/", "/posts/latest", "/posts/1"):
+        uncached = authorized_client.get(url).json()
+        assert authorized_client.get(url).json() == uncached
+
+
+def test_update_post_invalidates(authorized_client, add_test_posts, response_cache):
+    authorized_client.get("/posts/1")
+    authorized_client.get("/posts/")
+    authorized_client.put("/posts/1", json={"title": "Updated", "content": "Updated"})
+    assert authorized_client.get("/posts/1").json()["Post"]["title"] == "Updated"
+    assert authorized_client.get("/posts/").json()[-1]["Post"]["title"] == "Updated"
+
+
+def test_create_post_invalidates(authorized_client, add_test_posts, response_cache):
+    authorized_client.get("/posts/latest")
+    res = authorized_client.post("/posts/", json={"title": "Newest", "content": "Post"})
+    assert authorized_client.get("/posts/latest").json()["Post"]["id"] == res.json()["id"]
+
+
+def test_delete_post_invalidates(authorized_client, add_test_posts, response_cache):
+    authorized_client.get("/posts/3")
+    authorized_client.delete("/posts/3")
+    assert authorized_client.get("/posts/3").status_code == 404
+
+
+def test_change_visibility_invalidates(authorized_client, add_test_posts, response_cache):
+    authorized_client.get("/posts/")
+    authorized_client.put("/posts/publish/3")
+    assert 3 not in [post["Post"]["id"] for post in authorized_client.get("/posts/").json()]
+
+
+def test_rate_post_invalidates(authorized_client, add_test_posts, response_cache):
+    assert authorized_client.get("/posts/4").json()["likes"] == 0
+    authorized_client.post("/rate/", json={"post_id": 4, "dir": 1})
+    assert authorized_client.get("/posts/4").json()["likes"] == 1
+    assert authorized_client.get("/posts/latest").json()["likes"] == 1
+
+
+def test_cached_unpublished_post_hidden(client, user2, add_test_posts, response_cache, token):
+    authorized = {"Authorization": f"Bearer {token}"}
+    client.put("/posts/publish/1", headers=authorized)
+    assert client.get("/posts/1", headers=authorized).status_code == 200    # owner caches the post
+    login = client.post("/login", data={"username": user2["email"], "password": user2["password"]})
+    other = {"Authorization": f"Bearer {login.json()['token']}"}
+    assert client.get("/posts/1", headers=other).status_code == 404
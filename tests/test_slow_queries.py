@@ -0,0 +1,56 @@
+"""Slow query log tests"""
+import pytest
+
+from app.config import settings
+from app.database import slow_query_log
+from .conftest import engine
+
+
+@pytest.fixture
+def slow_queries(monkeypatch, tmp_path):
+    """Log every statement as slow into temporary file"""
+    monkeypatch.setattr(settings, "admin_token", "AdminToken123")
+    monkeypatch.setattr(settings, "slow_query_threshold", 1e-9)
+    monkeypatch.setattr(settings, "slow_query_log_file", str(tmp_path / "slow_queries.log"))
+    slow_query_log.close()
+    yield
+    monkeypatch.setattr(settings, "slow_query_threshold", 0)
+    slow_query_log.close()
+
+
+def test_slow_query_logged(authorized_client, add_test_posts, slow_queries, monkeypatch):
+    monkeypatch.setattr(settings, "slow_query_explain_rate", 0)
+    post_id = add_test_posts[0].id
+    authorized_client.get(f"/posts/{post_id}")
+    entries = slow_query_log.read(10)
+    entry = next(entry for entry in entries if entry["route"] == "GET /posts/{id_}")
+    assert entry["statement"].startswith("SELECT posts.id")
+    assert str(post_id) in entry["parameters"]
+    assert entry["duration_ms"] > 0
+    assert "explain" not in entry
+
+
+def test_slow_query_explained(authorized_client, add_test_posts, slow_queries, monkeypatch):
+    monkeypatch.setattr(settings, "slow_query_explain_rate", 1)
+    authorized_client.get("/posts/?search=post")
+    authorized_client.delete(f"/posts/{add_test_posts[0].id}")
+    entries = slow_query_log.read(10)
+    select = next(entry for entry in entries if entry["route"] == "GET /posts/")
+    assert "Buffers" in select["explain"] or "actual time" in select["explain"]
+    # only SELECT statements are analyzed, others would be executed again
+    delete = next(entry for entry in entries if entry["statement"].startswith("DELETE"))
+    assert "explain" not in delete
+
+
+def test_slow_query_explain_positional_parameters():
+    # asyncpg dialect statement format
+    plan = slow_query_log.explain(engine, "SELECT %s::int + %s::int WHERE 'a' LIKE '%%'", (1, 2))
+    assert "actual time" in plan
+
+
+def test_slow_queries_endpoint(client, slow_queries):
+    client.get("/posts/")
+    res = client.get("/admin/slow-queries", params={"limit": 1}, headers={"X-Admin-Token": "AdminToken123"})
+    assert res.status_code == 200
+    assert len(res.json()) == 1
+    assert client.get("/admin/slow-queries").status_code == 403
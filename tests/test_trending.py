@@ -0,0 +1,134 @@
+"""Trending posts tests"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, func
+
+from app import database, models, trending
+from app.config import settings
+from .conftest import TestSessionLocal
+
+
+@pytest.fixture
+def post_ids(add_test_posts, db_session):
+    """Ids of test posts, oldest first"""
+    return [post_id for post_id, in db_session.query(models.Post.id).order_by(models.Post.id)]
+
+
+@pytest.fixture
+def liked_posts(post_ids, user, user2, db_session):
+    """Last post liked twice recently, first post liked once, second post liked long ago"""
+    now = datetime.now(timezone.utc)
+    db_session.add_all([
+        models.Rating(user_id=user["id"], post_id=post_ids[3], created_at=now),
+        models.Rating(user_id=user2["id"], post_id=post_ids[3], created_at=now - timedelta(hours=1)),
+        models.Rating(user_id=user2["id"], post_id=post_ids[0], created_at=now - timedelta(hours=1)),
+        models.Rating(user_id=user2["id"], post_id=post_ids[1], created_at=now - timedelta(days=30)),
+    ])
+    db_session.commit()
+    assert trending.refresh(db_session, force=True)
+    return post_ids
+
+
+def trending_ids(client, **params) -> list[int]:
+    res = client.get("/posts/trending", params=params)
+    assert res.status_code == 200
+    return [post["Post"]["id"] for post in res.json()]
+
+
+def test_trending_posts(client, liked_posts):
+    # likes out of the window are not counted
+    assert trending_ids(client) == [liked_posts[3], liked_posts[0]]
+
+
+def test_trending_empty_before_refresh(client, add_test_posts):
+    assert trending_ids(client) == []
+
+
+def test_trending_likes_decay(post_ids, user2, db_session):
+    now = datetime.now(timezone.utc)
+    db_session.add_all([
+        models.Rating(user_id=user2["id"], post_id=post_ids[0], created_at=now),
+        models.Rating(user_id=user2["id"], post_id=post_ids[1], created_at=now - timedelta(hours=12)),
+    ])
+    db_session.commit()
+    trending.refresh(db_session, force=True)
+    scores = dict(db_session.query(models.TrendingPost.post_id, models.TrendingPost.score))
+    assert scores[post_ids[0]] == pytest.approx(1, rel=0.01)
+    # two half-lives old like
+    assert scores[post_ids[1]] == pytest.approx(0.25, rel=0.01)
+
+
+def test_trending_cursor(client, liked_posts):
+    res = client.get("/posts/trending", params={"limit": 1})
+    assert [post["Post"]["id"] for post in res.json()] == [liked_posts[3]]
+    res = client.get("/posts/trending", params={"limit": 1, "cursor": res.headers["X-Next-Cursor"]})
+    assert [post["Post"]["id"] for post in res.json()] == [liked_posts[0]]
+    assert "X-Next-Cursor" in res.headers
+    res = client.get("/posts/trending", params={"limit": 1, "cursor": res.headers["X-Next-Cursor"]})
+    assert res.json() == []
+
+
+def test_trending_size(client, liked_posts, db_session, monkeypatch):
+    monkeypatch.setattr(settings, "trending_size", 1)
+    trending.refresh(db_session, force=True)
+    assert trending_ids(client) == [liked_posts[3]]
+
+
+def test_trending_hides_unpublished_post(authorized_client, liked_posts):
+    authorized_client.put(f"/posts/publish/{liked_posts[0]}")
+    assert trending_ids(authorized_client) == [liked_posts[3]]
+
+
+def test_trending_reads_only_ranking(client, liked_posts, statements):
+    client.get("/posts/trending")
+    statements.clear()
+    client.get("/posts/trending")
+    assert len(statements) == 1
+    assert "ratings" not in statements[0]
+
+
+def test_refresh_skipped_while_fresh(liked_posts, user, db_session):
+    db_session.add(models.Rating(user_id=user["id"], post_id=liked_posts[1]))
+    db_session.commit()
+    assert trending.refresh(db_session) is False
+    assert db_session.query(models.TrendingPost).count() == 2
+    assert trending.refresh(db_session, force=True) is True
+    assert db_session.query(models.TrendingPost).count() == 3
+
+
+def test_refresh_skipped_while_other_worker_refreshes(liked_posts, db_session):
+    other_worker = TestSessionLocal()
+    try:
+        other_worker.scalar(select(func.pg_advisory_xact_lock(trending.REFRESH_LOCK)))
+        assert trending.refresh(db_session, force=True) is False
+    finally:
+        other_worker.rollback()
+        other_worker.close()
+    assert trending.refresh(db_session, force=True) is True
+
+
+def test_refresher_thread(liked_posts, db_session, monkeypatch):
+    monkeypatch.setattr(database, "SessionLocal", TestSessionLocal)
+    db_session.query(models.TrendingPost).delete()
+    db_session.commit()
+    refresher = trending.TrendingRefresher()
+    refresher.start()
+    try:
+        deadline = time.monotonic() + 10
+        while db_session.query(models.TrendingPost).count() == 0 and time.monotonic() < deadline:
+            db_session.rollback()
+            time.sleep(0.05)
+    finally:
+        asyncio.run(refresher.stop())
+    assert db_session.query(models.TrendingPost).count() == 2
+    assert refresher.thread is None
+
+
+def test_refresher_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "trending_refresh_interval", 0)
+    refresher = trending.TrendingRefresher()
+    refresher.start()
+    assert refresher.thread is None
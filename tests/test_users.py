@@ -1,8 +1,10 @@
 """Users query tests"""
+import asyncio
+
 import pytest
 from jose import jwt
 
-from app import schemas
+from app import schemas, utils, models, oauth2
 from app.config import settings
 
 
@@ -36,6 +38,29 @@ def test_user_create_already_exist(client, registered_user):
     assert res.json()["detail"] == "email already registered (email: already@exist.com)"
 
 
+def test_user_create_already_exist_not_hashed(client, registered_user, monkeypatch):
+    async def fail_hash(password):
+        raise AssertionError("password must not be hashed for registered email")
+    monkeypatch.setattr(utils, "hash_password_async", fail_hash)
+    res = client.post("/users/", json={"email": "already@exist.com",
+                                       "password": "TestPassword123!"})
+    assert res.status_code == 409
+
+
+def test_user_create_password_queue_full(client, monkeypatch):
+    monkeypatch.setattr(settings, "password_queue_limit", 0)
+    res = client.post("/users/", json={"email": "testmail@gmail.com",
+                                       "password": "TestPassword123!"})
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+
+
+def test_password_job_in_threadpool(monkeypatch):
+    monkeypatch.setattr(settings, "password_workers", 0)
+    hashed = asyncio.run(utils.hash_password_async("TestPassword123!"))
+    assert asyncio.run(utils.verify_password_async("TestPassword123!", hashed)) is True
+
+
 def test_user_login(client, user):
     res = client.post("/login", data={"username": user["email"],
                                       "password": user["password"]})
@@ -61,3 +86,49 @@ def test_bad_user_login(client, user, email, password, status_code):
         assert res.json().get("detail")[0].get("msg") == "field required"
     else:
         assert res.json().get("detail") == "invalid credentials"
+
+
+def test_verified_user_cached(authorized_client, user, db_session):
+    assert authorized_client.get("/posts/my").status_code == 200
+    assert oauth2.user_cache.get(user["id"]).email == user["email"]
+    # cached user is trusted until invalidated
+    db_session.query(models.User).filter_by(id=user["id"]).delete()
+    db_session.commit()
+    assert authorized_client.get("/posts/my").status_code == 200
+    oauth2.invalidate_user(user["id"])
+    res = authorized_client.get("/posts/my")
+    assert res.status_code == 401
+    assert res.json()["detail"] == "Couldn't verify credentials"
+
+
+def test_trust_token_claims(client, monkeypatch):
+    monkeypatch.setattr(settings, "auth_trust_token_claims", True)
+    token = oauth2.create_access_token(data={"user_id": 42, "email": "ghost@gmail.com"})
+    res = client.get("/posts/my", headers={"Authorization": f"Bearer {token}"})
+    assert res.status_code == 200
+    assert oauth2.user_cache.get(42) is None
+
+
+def test_login_token_email_claim(client, user):
+    res = client.post("/login", data={"username": user["email"],
+                                      "password": user["password"]})
+    payload = jwt.decode(res.json()["token"], settings.jwt_encode_key, algorithms=[settings.jwt_algorithm])
+    assert payload["email"] == user["email"]
+
+
+def test_decoded_token_cached():
+    oauth2.token_cache.clear()
+    exception = Exception("invalid token")
+    token = oauth2.create_access_token(data={"user_id": 7})
+    assert oauth2.verify_access_token(token, exception).user_id == "7"
+    assert oauth2.verify_access_token(token, exception).user_id == "7"
+    assert oauth2.token_cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_expired_token_not_cached():
+    oauth2.token_cache.clear()
+    exception = Exception("invalid token")
+    token = jwt.encode({"user_id": 7, "exp": 1}, key=settings.jwt_encode_key, algorithm=settings.jwt_algorithm)
+    with pytest.raises(Exception, match="invalid token"):
+        oauth2.verify_access_token(token, exception)
+    assert len(oauth2.token_cache) == 0
@@ -0,0 +1,268 @@
+"""Write-behind rates tests"""
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import database, models, write_behind
+from app.config import settings
+from app.main import app
+from .conftest import TestSessionLocal
+
+
+@pytest.fixture
+def rating_buffer(db_session, tmp_path, monkeypatch):
+    """Enabled write-behind buffer writing into test database"""
+    monkeypatch.setattr(settings, "rate_write_behind", True)
+    monkeypatch.setattr(settings, "rate_journal_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "rate_flush_interval", 0.05)
+    monkeypatch.setattr(database, "SessionLocal", TestSessionLocal)
+    rating_buffer = write_behind.RatingBuffer()
+    monkeypatch.setattr(write_behind, "rating_buffer", rating_buffer)
+    yield rating_buffer
+    if rating_buffer.journal is not None:
+        rating_buffer.journal.close()
+
+
+@pytest.fixture
+def foreign_post_ids(add_test_posts, user2, db_session):
+    """Published posts of the second user"""
+    db_session.add_all([models.Post(title=f"post {number}", content="content", owner_id=user2["id"])
+                        for number in range(4)])
+    db_session.commit()
+    return [post_id for post_id, in db_session.query(models.Post.id).filter_by(owner_id=user2["id"])
+            .order_by(models.Post.id)]
+
+
+def stored_ratings(db_session) -> set:
+    db_session.rollback()
+    return set(db_session.query(models.Rating.user_id, models.Rating.post_id))
+
+
+def likes_count(db_session, post_id: int) -> int:
+    db_session.rollback()
+    return db_session.query(models.Post.likes_count).filter_by(id=post_id).scalar()
+
+
+def journal_files(tmp_path) -> list:
+    return sorted(tmp_path.glob("rates-*.journal"))
+
+
+def test_rate_accepted_and_flushed(authorized_client, user, foreign_post_ids, rating_buffer, db_session):
+    res = authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    assert res.status_code == 202
+    assert res.json()["detail"] == "rating is accepted"
+    assert stored_ratings(db_session) == set()
+    assert asyncio.run(rating_buffer.flush()) == 1
+    assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[0])}
+    assert likes_count(db_session, foreign_post_ids[0]) == 1
+
+
+def test_buffered_rates_validated(authorized_client, foreign_post_ids, rating_buffer):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    res = authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    assert res.status_code == 409
+    res = authorized_client.post("/rate/", json={"post_id": foreign_post_ids[1], "dir": 0})
+    assert res.status_code == 404
+    assert res.json()["detail"] == "rating does not exist"
+
+
+@pytest.mark.parametrize("post_index, status_code", [(None, 403), (99999, 404)])
+def test_invalid_rate_rejected(authorized_client, user, foreign_post_ids, rating_buffer, db_session,
+                               post_index, status_code):
+    post_id = post_index or db_session.query(models.Post.id).filter_by(owner_id=user["id"]).first()[0]
+    res = authorized_client.post("/rate/", json={"post_id": post_id, "dir": 1})
+    assert res.status_code == status_code
+    assert not rating_buffer.pending
+
+
+def test_like_unlike_coalesced(authorized_client, foreign_post_ids, rating_buffer, db_session, statements):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    res = authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 0})
+    assert res.status_code == 202
+    statements.clear()
+    assert asyncio.run(rating_buffer.flush()) == 0
+    assert statements == []
+    assert stored_ratings(db_session) == set()
+
+
+def test_unlike_written(authorized_client, user, foreign_post_ids, rating_buffer, db_session):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    asyncio.run(rating_buffer.flush())
+    assert authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 0}).status_code == 202
+    assert asyncio.run(rating_buffer.flush()) == 1
+    assert stored_ratings(db_session) == set()
+    assert likes_count(db_session, foreign_post_ids[0]) == 0
+
+
+def test_flush_batched(authorized_client, user, foreign_post_ids, rating_buffer, db_session, statements,
+                       monkeypatch):
+    for post_id in foreign_post_ids:
+        authorized_client.post("/rate/", json={"post_id": post_id, "dir": 1})
+    statements.clear()
+    assert asyncio.run(rating_buffer.flush()) == len(foreign_post_ids)
+    # every rate is written by one statement
+    assert len([statement for statement in statements if statement.startswith("WITH")]) == 1
+    assert stored_ratings(db_session) == {(user["id"], post_id) for post_id in foreign_post_ids}
+    for post_id in foreign_post_ids:
+        authorized_client.post("/rate/", json={"post_id": post_id, "dir": 0})
+    monkeypatch.setattr(settings, "rate_flush_batch", 3)
+    statements.clear()
+    asyncio.run(rating_buffer.flush())
+    assert len([statement for statement in statements if statement.startswith("WITH")]) == 2
+    assert stored_ratings(db_session) == set()
+
+
+def test_rate_of_removed_post_skipped(authorized_client, user, foreign_post_ids, rating_buffer, db_session):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[1], "dir": 1})
+    db_session.query(models.Post).filter_by(id=foreign_post_ids[0]).delete()
+    db_session.commit()
+    asyncio.run(rating_buffer.flush())
+    assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[1])}
+
+
+def test_full_buffer_rejects_rates(authorized_client, foreign_post_ids, rating_buffer, monkeypatch):
+    monkeypatch.setattr(settings, "rate_buffer_size", 1)
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    res = authorized_client.post("/rate/", json={"post_id": foreign_post_ids[1], "dir": 1})
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+    # buffered rating can still change
+    assert authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 0}).status_code == 202
+
+
+def test_failed_flush_keeps_rates(authorized_client, user, foreign_post_ids, rating_buffer, db_session, tmp_path,
+                                  monkeypatch):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+
+    def unavailable():
+        raise database.PoolTimeoutError("database is not available")
+    monkeypatch.setattr(database, "SessionLocal", unavailable)
+    assert asyncio.run(rating_buffer.flush()) == 0
+    assert list(rating_buffer.pending) == [(user["id"], foreign_post_ids[0])]
+    assert len(journal_files(tmp_path)) == 1
+    monkeypatch.setattr(database, "SessionLocal", TestSessionLocal)
+    assert asyncio.run(rating_buffer.flush()) == 1
+    assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[0])}
+    assert journal_files(tmp_path) == []
+
+
+def test_crashed_worker_rates_replayed(authorized_client, user, foreign_post_ids, rating_buffer, db_session,
+                                       tmp_path):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[1], "dir": 1})
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[1], "dir": 0})
+    # journal of running worker is not taken over
+    assert write_behind.RatingBuffer().recover() == 0
+    # crashed worker leaves its journal unlocked
+    rating_buffer.journal.close()
+    rating_buffer.journal = None
+    next_worker = write_behind.RatingBuffer()
+    assert next_worker.recover() == 3
+    assert asyncio.run(next_worker.flush()) == 2
+    assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[0])}
+    assert likes_count(db_session, foreign_post_ids[0]) == 1
+    assert journal_files(tmp_path) == []
+
+
+def test_replay_of_written_rates_changes_nothing(authorized_client, user, foreign_post_ids, rating_buffer,
+                                                 db_session, tmp_path):
+    authorized_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1})
+    journal = journal_files(tmp_path)[0].read_text()
+    asyncio.run(rating_buffer.flush())
+    # worker crashed after commit, before journal compaction
+    (tmp_path / "rates-1-1.journal").write_text(journal + "7 7")
+    next_worker = write_behind.RatingBuffer()
+    assert next_worker.recover() == 1
+    asyncio.run(next_worker.flush())
+    assert likes_count(db_session, foreign_post_ids[0]) == 1
+
+
+def test_shutdown_drains_buffer(client, token, user, foreign_post_ids, rating_buffer, db_session, tmp_path,
+                                monkeypatch):
+    monkeypatch.setattr(settings, "rate_flush_interval", 60)
+    # application lifespan starts and stops the flusher
+    with TestClient(app) as worker_client:
+        worker_client.headers["Authorization"] = f"Bearer {token}"
+        assert rating_buffer.task is not None
+        assert worker_client.post("/rate/", json={"post_id": foreign_post_ids[0], "dir": 1}).status_code == 202
+        assert stored_ratings(db_session) == set()
+    assert rating_buffer.task is None
+    assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[0])}
+    assert journal_files(tmp_path) == []
+
+
+def test_background_flush(user, foreign_post_ids, rating_buffer, db_session):
+    async def serve():
+        await rating_buffer.start()
+        rating_buffer.add(user["id"], foreign_post_ids[0], True, False)
+        for _ in range(100):
+            if not rating_buffer.pending:
+                break
+            await asyncio.sleep(0.05)
+        assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[0])}
+        await rating_buffer.stop()
+    asyncio.run(serve())
+
+
+def test_failed_cache_invalidation_keeps_flushing(user, foreign_post_ids, rating_buffer, db_session, monkeypatch):
+    async def unavailable(*post_ids):
+        raise ConnectionError("cache is not available")
+    monkeypatch.setattr(write_behind.cache, "invalidate_posts", unavailable)
+
+    async def serve():
+        await rating_buffer.start()
+        for post_id in foreign_post_ids[:2]:
+            rating_buffer.add(user["id"], post_id, True, False)
+            for _ in range(100):
+                if not rating_buffer.pending:
+                    break
+                await asyncio.sleep(0.05)
+        await rating_buffer.stop()
+    asyncio.run(serve())
+    assert stored_ratings(db_session) == {(user["id"], post_id) for post_id in foreign_post_ids[:2]}
+
+
+def test_failed_flush_keeps_flusher_running(user, foreign_post_ids, rating_buffer, db_session, monkeypatch):
+    flush = rating_buffer.flush
+    failures = []
+
+    async def failing_flush():
+        if not failures:
+            failures.append(True)
+            raise OSError("journal is not writable")
+        return await flush()
+    monkeypatch.setattr(rating_buffer, "flush", failing_flush)
+
+    async def serve():
+        await rating_buffer.start()
+        rating_buffer.add(user["id"], foreign_post_ids[0], True, False)
+        for _ in range(100):
+            if not rating_buffer.pending:
+                break
+            await asyncio.sleep(0.05)
+        # stop doesn't raise, application shutdown goes on
+        await rating_buffer.stop()
+    asyncio.run(serve())
+    assert failures
+    assert stored_ratings(db_session) == {(user["id"], foreign_post_ids[0])}
+
+
+def test_journal_locked_before_visible(rating_buffer, tmp_path, monkeypatch):
+    renamed = []
+    rename = write_behind.os.rename
+
+    def recovering_rename(source, destination):
+        # other worker recovers journals right before the new one gets its name
+        assert write_behind.RatingBuffer().recover() == 0
+        rename(source, destination)
+        renamed.append(destination)
+    monkeypatch.setattr(write_behind.os, "rename", recovering_rename)
+    rating_buffer.add(1, 1, True, False)
+    assert journal_files(tmp_path) == [tmp_path / os.path.basename(renamed[0])]
+    assert rating_buffer.journal.name == renamed[0]
+    # journal of running worker is not taken over
+    assert write_behind.RatingBuffer().recover() == 0
+    assert journal_files(tmp_path)[0].read_text() == "1 1 1\n"